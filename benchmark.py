@@ -0,0 +1,403 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/python3
+
+import io, re, sys, time, json, gzip, queue, random, hashlib, argparse, resource, tempfile, threading, traceback, multiprocessing
+from pathlib import Path
+from email.utils import formatdate
+from urllib.parse import urlparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from cnvd_xml_handler import parse_file, convert
+from cnvd_output import ShardWriter, JsonlShardWriter, CountingWriter
+from nvd_index import NvdIndex
+
+CRAWLERS = ["alpine", "amazon", "debian", "oracle", "photon", "pyupio", "rhel", "suse", "ubuntu", "cvss"]
+
+def in_child(func, *args):
+    # Runs func in a forked process so its peak RSS (ru_maxrss, KiB on Linux)
+    # is measured on its own, worker processes it spawns are reported apart.
+    # An exception in the child, or the child dying, is raised here.
+    def run(results):
+        try:
+            result = func(*args)
+            result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result["children_peak_rss_kb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        except Exception:
+            results.put((False, traceback.format_exc()))
+            return
+        results.put((True, result))
+
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    process = context.Process(target=run, args=(results,))
+    process.start()
+    while True:
+        try:
+            ok, result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            # a clean exit always put its result first, it is still on the way
+            if process.exitcode not in (None, 0):
+                raise RuntimeError("%s exited with code %d" % (func.__name__, process.exitcode))
+    process.join()
+    if not ok:
+        raise RuntimeError("%s failed in the child process:\n%s" % (func.__name__, result))
+    return result
+
+# ---- CNVD pipeline ----
+
+def generate_cnvd(workdir, scale, apps=3, oses=2, files=10, nvd_ratio=0.9, seed=0):
+    # Synthetic CNVD XML dumps and vuln-list style nvd/<year>/<CVE>.json files.
+    # Every vulnerability gets up to `apps` application and `oses` OS CPEs,
+    # so a flat record count of up to apps * oses per vulnerability.
+    rand = random.Random(seed)
+    workdir = Path(workdir)
+    cnvd_dirpath = workdir.joinpath("cnvd")
+    cnvd_dirpath.mkdir(parents=True, exist_ok=True)
+
+    handles = [open(cnvd_dirpath.joinpath("cnvd-%04d.xml" % i), "w", encoding="utf-8") for i in range(files)]
+    for f in handles:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<vulnerabilitys>\n')
+
+    for i in range(scale):
+        year = 2002 + i % 20
+        cve = "CVE-%d-%d" % (year, 10000 + i)
+        if rand.random() < nvd_ratio:
+            cpes = []
+            for j in range(rand.randint(1, apps)):
+                cpes.append({"cpe23Uri": "cpe:2.3:a:vendor%d:product%d:%d.%d.%d:*:*:*:*:*:*:*" % (i % 97, (i + j) % 1013, j, i % 10, i % 7)})
+            for j in range(rand.randint(0, oses)):
+                cpes.append({"cpe23Uri": "cpe:2.3:o:osvendor%d:os%d:%d:*:*:*:*:*:*:*" % (j, (i + j) % 31, i % 12)})
+            item = {
+                "cve": {"CVE_data_meta": {"ID": cve}},
+                "impact": {"baseMetricV3": {"cvssV3": {"baseSeverity": rand.choice(["LOW", "MEDIUM", "HIGH", "CRITICAL"])}}},
+                "configurations": {"nodes": [{"operator": "OR", "cpe_match": cpes}]}
+            }
+            nvd_dirpath = workdir.joinpath("nvd", "nvd", str(year))
+            nvd_dirpath.mkdir(parents=True, exist_ok=True)
+            with open(nvd_dirpath.joinpath(cve + ".json"), "w") as f:
+                json.dump(item, f)
+
+        handles[i % files].write(
+            "<vulnerability><number>CNVD-%d-%05d</number><title>漏洞 %d &amp; 测试</title><serverity>高</serverity>"
+            "<products><product>Vendor%d Product %d</product><product>Other &lt;%d&gt;</product></products>"
+            "<isEvent>通用型漏洞</isEvent><submitTime>2021-01-01</submitTime><openTime>2021-02-01</openTime>"
+            "<discovererName>benchmark</discovererName><referenceLink>https://example.com/%d</referenceLink>"
+            "<formalWay>厂商已发布了漏洞修复程序，请及时关注更新</formalWay><description>%s</description>"
+            "<patchName>patch %d</patchName><patchDescription>%s</patchDescription>"
+            "<cves><cve><cveNumber>%s</cveNumber><cveUrl>https://nvd.nist.gov/vuln/detail/%s</cveUrl></cve></cves></vulnerability>\n"
+            % (year, i, i, i % 97, i, i, i, "description of a synthetic vulnerability " * 8, i, "patch text " * 4, cve, cve))
+
+    for f in handles:
+        f.write("</vulnerabilitys>\n")
+        f.close()
+
+def run_cnvd(workdir, jobs, backend, output_format, layout, split_number):
+    workdir = Path(workdir)
+    output_dirpath = workdir.joinpath("out-%s-%s-%d" % (output_format, layout, jobs))
+    output_dirpath.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    nvd_source = NvdIndex(workdir.joinpath("nvd-index.sqlite"))
+    nvd_source.build(workdir.joinpath("nvd"))
+    index_seconds = time.perf_counter() - start
+
+    if output_format == "jsonl":
+        writer = JsonlShardWriter(output_dirpath, split_number, layout=layout)
+    else:
+        writer = ShardWriter(output_dirpath.joinpath("cnvd-%04d.json"), split_number)
+
+    start = time.perf_counter()
+    stats = convert(sorted(workdir.joinpath("cnvd").glob("*.xml")), nvd_source, writer, jobs, output_dirpath, layout, backend)
+    writer.close()
+    seconds = time.perf_counter() - start
+
+    result = dict(stats)
+    result.update({
+        "index_seconds": round(index_seconds, 3),
+        "seconds": round(seconds, 3),
+        "records_out_per_sec": round(stats["records_out"] / seconds, 1) if seconds else None,
+        "output_bytes": sum(p.stat().st_size for p in output_dirpath.iterdir())
+    })
+    return result
+
+def bench_cnvd(workdir, scale, apps, oses, jobs, backend, output_format, layout, split_number):
+    if not Path(workdir).joinpath("cnvd").exists():
+        start = time.perf_counter()
+        generate_cnvd(workdir, scale, apps, oses)
+        print("generated %d vulns in %.1fs" % (scale, time.perf_counter() - start))
+    result = in_child(run_cnvd, workdir, jobs, backend, output_format, layout, split_number)
+    result.update({"scale": scale, "apps": apps, "oses": oses, "jobs": jobs, "backend": backend, "format": output_format, "layout": layout})
+    result["records_in_per_sec"] = round(scale / result["seconds"], 1) if result["seconds"] else None
+    return result
+
+def bench_parsers(cnvd_xml_dirpath, backends=("sax", "expat"), rounds=3):
+    # XML parsing throughput of each backend, without NVD lookups
+    xml_filepaths = sorted(Path(cnvd_xml_dirpath).glob('*.xml'))
+    size = sum(filepath.stat().st_size for filepath in xml_filepaths)
+    results = []
+    for backend in backends:
+        best = None
+        for _ in range(rounds):
+            writer = CountingWriter()
+            start = time.perf_counter()
+            for filepath in xml_filepaths:
+                parse_file(filepath, None, writer, backend)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        results.append({
+            "backend": backend,
+            "files": len(xml_filepaths),
+            "records": writer.count,
+            "seconds": round(best, 3),
+            "records_per_sec": round(writer.count / best, 1) if best else None,
+            "mb_per_sec": round(size / 1024 / 1024 / best, 2) if best else None
+        })
+    return results
+
+# ---- crawler against a local stand-in for the upstream servers ----
+
+class FakeUpstream(object):
+    # Synthesizes deterministic content for any <host>/<path> the crawlers ask
+    # for, with the few structured files they parse (Amazon mirror.list, RHEL
+    # PULP_MANIFEST, NVD .meta and .json.gz) generated consistently.
+    def __init__(self, file_size=256 * 1024, rhel_files=40, latency=0.0, throttle=None):
+        self.file_size = file_size
+        self.rhel_files = rhel_files
+        self.latency = latency
+        self.throttle = throttle    # requests per second before answering 429
+        self.versions = {}          # path -> content version, bumped by change()
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.tokens = float(throttle or 0)
+        self.stamp = time.monotonic()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"requests": 0, "bytes": 0, "status": {}}
+
+    def count(self, status, size):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += size
+            self.stats["status"][str(status)] = self.stats["status"].get(str(status), 0) + 1
+
+    def allow(self):
+        if not self.throttle:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(float(self.throttle), self.tokens + (now - self.stamp) * self.throttle)
+            self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def change(self, fraction, seed=0):
+        # pretend upstream republished a fraction of the files
+        rand = random.Random(seed)
+        with self.lock:
+            for path in list(self.cache):
+                if rand.random() < fraction:
+                    self.versions[path] = self.versions.get(path, 0) + 1
+                    self.cache.pop(path)
+            # listings are rebuilt from the files they describe
+            for path in list(self.cache):
+                if path.endswith("PULP_MANIFEST") or path.endswith(".meta"):
+                    self.cache.pop(path)
+
+    def payload(self, path, size):
+        version = self.versions.get(path, 0)
+        block = hashlib.sha256(("%s:%d" % (path, version)).encode()).hexdigest().encode() * 64
+        return (block * (size // len(block) + 1))[:size]
+
+    def feed(self, path):
+        items = []
+        seed = int(hashlib.sha256(path.encode()).hexdigest()[:8], 16) + self.versions.get(path, 0)
+        for i in range(max(1, self.file_size // 512)):
+            items.append({
+                "cve": {"CVE_data_meta": {"ID": "CVE-%d-%d" % (2000 + seed % 20, i)}},
+                "impact": {"baseMetricV2": {"severity": "MEDIUM"}},
+                "configurations": {"nodes": [{"cpe_match": [{"cpe23Uri": "cpe:2.3:a:v%d:p%d:%d:*:*:*:*:*:*:*" % (seed % 9, i, seed)}]}]}
+            })
+        data = json.dumps({"CVE_data_type": "CVE", "CVE_Items": items}).encode()
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) as f:
+            f.write(data)
+        return data, buf.getvalue()
+
+    def content(self, path):
+        with self.lock:
+            if path in self.cache:
+                return self.cache[path]
+
+        size = self.file_size // 2 + int(hashlib.sha256(path.encode()).hexdigest()[:8], 16) % self.file_size
+        if path.endswith("mirror.list"):
+            body = ("http://mirror.fake/%s\n" % hashlib.sha256(path.encode()).hexdigest()[:8]).encode()
+        elif path.endswith("PULP_MANIFEST"):
+            lines = []
+            prefix = path[:-len("PULP_MANIFEST")]
+            for i in range(self.rhel_files):
+                item = "RHEL%d/rhel-%d-stream-%d.oval.xml.bz2" % (6 + i % 4, 6 + i % 4, i)
+                data = self.content(prefix + item)
+                lines.append("%s,%s,%d\n" % (item, hashlib.sha256(data).hexdigest(), len(data)))
+            body = ("".join(lines) + "\n").encode()
+        elif path.endswith(".meta"):
+            data, gz = self.feed(path[:-len(".meta")] + ".json.gz")
+            body = ("lastModifiedDate:2021-10-01T03:00:01-04:00\r\nsize:%d\r\nzipSize:0\r\ngzSize:%d\r\nsha256:%s\r\n" % (len(data), len(gz), hashlib.sha256(data).hexdigest().upper())).encode()
+        elif re.search(r"nvdcve-1\.1-.*\.json\.gz$", path):
+            body = self.feed(path)[1]
+        else:
+            body = self.payload(path, size)
+
+        with self.lock:
+            self.cache[path] = body
+        return body
+
+    def handler(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if upstream.latency:
+                    time.sleep(upstream.latency)
+                if not upstream.allow():
+                    self.send_response(429)
+                    self.send_header("Retry-After", "1")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    upstream.count(429, 0)
+                    return
+
+                body = upstream.content(self.path.lstrip("/"))
+                etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+                last_modified = formatdate(1600000000 + upstream.versions.get(self.path.lstrip("/"), 0) * 86400, usegmt=True)
+                if self.headers.get("If-None-Match") == etag or (self.headers.get("If-None-Match") is None and self.headers.get("If-Modified-Since") == last_modified):
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    upstream.count(304, 0)
+                    return
+
+                status = 200
+                match = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("Range", ""))
+                if match:
+                    first = int(match.group(1) or 0)
+                    last = int(match.group(2)) if match.group(2) else len(body) - 1
+                    status = 206
+                    content_range = "bytes %d-%d/%d" % (first, last, len(body))
+                    body = body[first:last + 1]
+
+                self.send_response(status)
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 206:
+                    self.send_header("Content-Range", content_range)
+                self.end_headers()
+                self.wfile.write(body)
+                upstream.count(status, len(body))
+
+        return Handler
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        return self
+
+    def rewrite(self, url):
+        parsed = urlparse(url)
+        return "%s/%s%s" % (self.base_url, parsed.netloc, parsed.path)
+
+    def stop(self):
+        self.server.shutdown()
+
+def bench_crawl(crawlers, file_size, latency, throttle, workers, per_host, change, rate_limit=True):
+    # Cold run, warm run (nothing changed) and a run after `change` of the
+    # files were republished, per crawler, against the local stand-in.
+    import crawler
+    from http_client import HttpClient, HOST_RATES
+
+    upstream = FakeUpstream(file_size=file_size, latency=latency, throttle=throttle).start()
+    host_rates = None if rate_limit else dict((host, None) for host in HOST_RATES)
+    results = []
+    try:
+        for name in crawlers:
+            root_path = tempfile.mkdtemp(prefix="bench-%s-" % name)
+            for run in ("cold", "warm", "changed"):
+                if run == "changed":
+                    upstream.change(change)
+                upstream.reset_stats()
+                client = HttpClient(retries=5, backoff=0.2, host_rates=host_rates, pool_size=per_host, rewrite=upstream.rewrite)
+                scheduler = crawler.FetchScheduler(workers, per_host, crawler.FetchManifest(root_path), client)
+                start = time.perf_counter()
+                getattr(crawler, name + "_crawler")(root_path, scheduler)
+                scheduler.shutdown()
+                seconds = time.perf_counter() - start
+                results.append({
+                    "crawler": name,
+                    "run": run,
+                    "seconds": round(seconds, 3),
+                    "requests": upstream.stats["requests"],
+                    "bytes": upstream.stats["bytes"],
+                    "status": upstream.stats["status"],
+                    "failures": len(scheduler.failures)
+                })
+    finally:
+        upstream.stop()
+    return results
+
+if ( __name__ == "__main__"):
+    arg_parser = argparse.ArgumentParser(prog='PROG', description='Benchmark the crawlers and the CNVD pipeline, results are printed or written as JSON.')
+    arg_parser.add_argument('-o', metavar='<RESULT FILE>', help='Write the results to this JSON file.')
+    subparsers = arg_parser.add_subparsers(dest='command', required=True)
+
+    parsers_parser = subparsers.add_parser('parsers', help='XML parser backend throughput on a CNVD dump.')
+    parsers_parser.add_argument('-c', metavar='<CNVD XML DIR>', required=True, help='Specify the directory including CNVD info. (e.g. /home/user/cnvd_xml_files/)')
+    parsers_parser.add_argument('-r', metavar='<ROUNDS>', type=int, default=3, help='Runs per backend, the fastest is reported. (default. 3)')
+
+    cnvd_parser = subparsers.add_parser('cnvd', help='CNVD pipeline on synthetic CNVD/NVD data.')
+    cnvd_parser.add_argument('-w', metavar='<WORK DIR>', required=True, help='Directory for the generated fixtures and outputs, reused when it exists.')
+    cnvd_parser.add_argument('--scale', type=int, default=10000, help='Number of CNVD vulnerabilities. (default. 10000)')
+    cnvd_parser.add_argument('--apps', type=int, default=3, help='Maximum application CPEs per CVE. (default. 3)')
+    cnvd_parser.add_argument('--oses', type=int, default=2, help='Maximum OS CPEs per CVE. (default. 2)')
+    cnvd_parser.add_argument('--jobs', type=int, default=1, help='Worker processes. (default. 1)')
+    cnvd_parser.add_argument('--parser', choices=['sax', 'expat'], default='sax', help='XML parser backend. (default. sax)')
+    cnvd_parser.add_argument('--format', choices=['json', 'jsonl'], default='json', help='Output format. (default. json)')
+    cnvd_parser.add_argument('--layout', choices=['flat', 'normalized'], default='flat', help='Output layout. (default. flat)')
+    cnvd_parser.add_argument('-s', metavar='<SPLIT NUMBER>', type=int, default=40000, help='Number of vulnerabilities in a shard. (default. 40000)')
+
+    crawl_parser = subparsers.add_parser('crawl', help='Crawl time per *_crawler against a local stand-in server.')
+    crawl_parser.add_argument('--only', metavar='<CRAWLER>', action='append', choices=CRAWLERS, help='Crawler to run, may be repeated. (default. all)')
+    crawl_parser.add_argument('--file-size', metavar='<BYTES>', type=int, default=256 * 1024, help='Typical size of a served file. (default. 262144)')
+    crawl_parser.add_argument('--latency', metavar='<SECONDS>', type=float, default=0.05, help='Delay before every response. (default. 0.05)')
+    crawl_parser.add_argument('--throttle', metavar='<RPS>', type=float, help='Answer 429 above this many requests per second.')
+    crawl_parser.add_argument('--change', metavar='<FRACTION>', type=float, default=0.1, help='Fraction of files republished before the last run. (default. 0.1)')
+    crawl_parser.add_argument('-j', metavar='<WORKERS>', type=int, default=16, help='Number of concurrent downloads. (default. 16)')
+    crawl_parser.add_argument('--per-host', metavar='<CONNECTIONS>', type=int, default=4, help='Maximum concurrent downloads from one host. (default. 4)')
+    crawl_parser.add_argument('--no-rate-limit', action='store_true', help='Disable the built-in per-host rate limits of the HTTP client.')
+    args = arg_parser.parse_args()
+
+    if args.command == 'parsers':
+        results = bench_parsers(args.c, rounds=args.r)
+    elif args.command == 'cnvd':
+        results = bench_cnvd(args.w, args.scale, args.apps, args.oses, args.jobs, args.parser, args.format, args.layout, args.s)
+    else:
+        results = bench_crawl(args.only or CRAWLERS, args.file_size, args.latency, args.throttle, args.j, args.per_host, args.change, not args.no_rate_limit)
+
+    report = {"command": args.command, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "argv": sys.argv[1:], "results": results}
+    if args.o:
+        with open(args.o, "w") as f:
+            json.dump(report, f, indent=1)
+    print(json.dumps(report, indent=1))
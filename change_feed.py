@@ -0,0 +1,216 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/python3
+
+import os, json, time, shutil, hashlib, argparse, tempfile
+from pathlib import Path
+from urllib.parse import quote
+from oval_parser import oval_files, iter_definitions
+from nvd_index import iter_feed_items
+from cnvd_matcher import iter_database
+from snapshot_store import file_sha256
+
+ADDED = "added"
+MODIFIED = "modified"
+WITHDRAWN = "withdrawn"
+
+def fingerprint(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def iter_alpine(filepath):
+    # one advisory per (package, fixed version) of a secdb file
+    with open(filepath) as f:
+        secdb = json.load(f)
+    for item in secdb.get("packages", []):
+        package = item["pkg"]["name"]
+        for fixed_version, fixes in sorted((item["pkg"].get("secfixes") or {}).items()):
+            yield "%s@%s" % (package, fixed_version), {"package": package, "fixed_version": fixed_version, "cves": fixes}
+
+def iter_cnvd(database_dirpath):
+    # one advisory per CNVD number, the rows of a flat database are consecutive
+    number = None
+    rows = []
+    for vuln in iter_database(database_dirpath):
+        if vuln.get("cnvdNumber") != number and rows:
+            yield number, rows if len(rows) > 1 else rows[0]
+            rows = []
+        number = vuln.get("cnvdNumber")
+        rows.append(vuln)
+    if rows:
+        yield number, rows if len(rows) > 1 else rows[0]
+
+def sources(root_path, cnvd_dirpath=None):
+    # (name, files, advisories) of every source; name is the path under the
+    # database root, files the inputs whose (size, mtime) decide whether it is
+    # read again, advisories() yields its (key, record) pairs
+    root_path = Path(root_path)
+    found = []
+    for distro, release, filepath in oval_files(root_path):
+        advisories = lambda filepath=filepath, release=release: ((definition["id"], definition) for definition in iter_definitions(filepath, release))
+        found.append((filepath.relative_to(root_path).as_posix(), [filepath], advisories))
+    for filepath in sorted(root_path.glob("alpine/*/*.json")):
+        found.append((filepath.relative_to(root_path).as_posix(), [filepath], lambda filepath=filepath: iter_alpine(filepath)))
+    for filepath in sorted(root_path.glob("cvss/nvdcve-1.1-[0-9]*.json.gz")):
+        advisories = lambda filepath=filepath: ((item["cve"]["CVE_data_meta"]["ID"], item) for item in iter_feed_items(filepath))
+        found.append((filepath.relative_to(root_path).as_posix(), [filepath], advisories))
+    if cnvd_dirpath is not None:
+        cnvd_dirpath = Path(cnvd_dirpath)
+        shards = sorted(cnvd_dirpath.glob("cnvd-[0-9]*.json")) + sorted(cnvd_dirpath.glob("cnvd-[0-9]*.jsonl*")) + sorted(cnvd_dirpath.glob("cnvd-index.json"))
+        found.append(("cnvd", shards, lambda: iter_cnvd(cnvd_dirpath)))
+    return found
+
+def iter_fingerprints(filepath):
+    # "<key>\t<fingerprint>" lines sorted by key, as written by the previous run
+    if not filepath.exists():
+        return
+    with open(filepath, encoding="utf-8") as f:
+        for line in f:
+            key, value = line.rstrip("\n").rsplit("\t", 1)
+            yield key, value
+
+def merge(old, new):
+    # Walks two key-sorted (key, fingerprint) streams side by side and yields
+    # (change, key) for every key added, modified or withdrawn.
+    old = iter(old)
+    new = iter(new)
+    old_item = next(old, None)
+    new_item = next(new, None)
+    while old_item is not None or new_item is not None:
+        if new_item is None or (old_item is not None and old_item[0] < new_item[0]):
+            yield WITHDRAWN, old_item[0]
+            old_item = next(old, None)
+        elif old_item is None or new_item[0] < old_item[0]:
+            yield ADDED, new_item[0]
+            new_item = next(new, None)
+        else:
+            if old_item[1] != new_item[1]:
+                yield MODIFIED, new_item[0]
+            old_item = next(old, None)
+            new_item = next(new, None)
+
+def diff_source(name, advisories, fp_filepath, out, baseline):
+    # writes the changes of one source to out and replaces its fingerprints
+    fingerprints = {}
+    for key, record in advisories():
+        fingerprints[key] = fingerprint(record)
+    current = sorted(fingerprints.items())
+
+    changed = {}
+    counts = {ADDED: 0, MODIFIED: 0, WITHDRAWN: 0}
+    for change, key in merge(iter_fingerprints(fp_filepath), current):
+        counts[change] += 1
+        if baseline:
+            continue
+        if change == WITHDRAWN:
+            out.write(json.dumps({"source": name, "change": change, "key": key}, ensure_ascii=False) + "\n")
+        else:
+            changed[key] = change
+    if changed:
+        for key, record in advisories():
+            if key in changed:
+                out.write(json.dumps({"source": name, "change": changed.pop(key), "key": key, "record": record}, ensure_ascii=False) + "\n")
+
+    tmp_filepath = fp_filepath.with_name("." + fp_filepath.name + ".part")
+    with open(tmp_filepath, "w", encoding="utf-8") as f:
+        for key, value in current:
+            f.write("%s\t%s\n" % (key, value))
+    os.replace(tmp_filepath, fp_filepath)
+    return counts
+
+def run(root_path, changes_dirpath, cnvd_dirpath=None, baseline=False):
+    # Writes <changes>/<run>.jsonl with one line per added, modified or
+    # withdrawn advisory of every source whose files changed since the last
+    # run, and appends the run to <changes>/index.json. Only the fingerprints
+    # of the changed source are held in memory, the previous ones are streamed
+    # from .state/ and compared key by key; the records of added and modified
+    # advisories are read in a second pass over that source.
+    # With baseline the fingerprints are recorded without writing changes.
+    changes_dirpath = Path(changes_dirpath)
+    fp_dirpath = changes_dirpath.joinpath(".state")
+    fp_dirpath.mkdir(parents=True, exist_ok=True)
+    state_filepath = fp_dirpath.joinpath("files.json")
+    state = {}
+    if state_filepath.exists():
+        with open(state_filepath) as f:
+            state = json.load(f)
+
+    run_id = time.strftime("%Y%m%dT%H%M%S")
+    if changes_dirpath.joinpath(run_id + ".jsonl").exists():
+        run_id += "-%d" % os.getpid()
+    delta_filepath = changes_dirpath.joinpath(run_id + ".jsonl")
+    tmp_filepath = changes_dirpath.joinpath("." + run_id + ".jsonl.part")
+    summary = {}
+    files_state = {}
+    with open(tmp_filepath, "w", encoding="utf-8") as out:
+        for name, filepaths, advisories in sources(root_path, cnvd_dirpath):
+            signature = [[filepath.name, os.stat(filepath).st_size, os.stat(filepath).st_mtime] for filepath in filepaths]
+            previous = state.get(name)
+            files_state[name] = {"files": signature}
+            if previous and previous["files"] == signature:
+                files_state[name] = previous
+                continue
+            if len(filepaths) == 1:
+                files_state[name]["sha256"] = file_sha256(filepaths[0])
+                if previous and previous.get("sha256") == files_state[name]["sha256"]:
+                    continue
+
+            # a source that fails to read keeps its previous state and is retried next run
+            fp_filepath = fp_dirpath.joinpath(quote(name, safe="") + ".tsv")
+            with tempfile.TemporaryFile("w+", encoding="utf-8", dir=changes_dirpath) as source_out:
+                try:
+                    summary[name] = diff_source(name, advisories, fp_filepath, source_out, baseline)
+                except:
+                    print("EXCEPTION: failed to compare %s" % name)
+                    if previous:
+                        files_state[name] = previous
+                    else:
+                        files_state.pop(name)
+                    continue
+                source_out.seek(0)
+                shutil.copyfileobj(source_out, out)
+
+        # sources whose files are all gone withdraw everything they had
+        for name in state:
+            if name in files_state:
+                continue
+            fp_filepath = fp_dirpath.joinpath(quote(name, safe="") + ".tsv")
+            counts = {ADDED: 0, MODIFIED: 0, WITHDRAWN: 0}
+            for key, value in iter_fingerprints(fp_filepath):
+                counts[WITHDRAWN] += 1
+                if not baseline:
+                    out.write(json.dumps({"source": name, "change": WITHDRAWN, "key": key}, ensure_ascii=False) + "\n")
+            summary[name] = counts
+            if fp_filepath.exists():
+                fp_filepath.unlink()
+
+    if baseline:
+        tmp_filepath.unlink()
+    else:
+        os.replace(tmp_filepath, delta_filepath)
+        index_filepath = changes_dirpath.joinpath("index.json")
+        index = {"runs": []}
+        if index_filepath.exists():
+            with open(index_filepath) as f:
+                index = json.load(f)
+        index["runs"].append({"run": run_id, "file": delta_filepath.name, "sources": summary})
+        tmp_index_filepath = changes_dirpath.joinpath(".index.json.part")
+        with open(tmp_index_filepath, "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_index_filepath, index_filepath)
+
+    tmp_state_filepath = fp_dirpath.joinpath(".files.json.part")
+    with open(tmp_state_filepath, "w") as f:
+        json.dump(files_state, f, indent=1, sort_keys=True)
+    os.replace(tmp_state_filepath, state_filepath)
+    return summary
+
+if ( __name__ == "__main__"):
+    arg_parser = argparse.ArgumentParser(prog='PROG', description='Write the advisories added, modified or withdrawn since the last run of the vuln database downloaded by crawler.py.')
+    arg_parser.add_argument('-d', metavar='<DATABASE DIR>', required=True, help='Specify the directory crawler.py stores the vuln database in. (e.g. /home/user/secdb/)')
+    arg_parser.add_argument('-c', metavar='<CNVD DATABASE DIR>', help='Also compare the CNVD database written by cnvd_xml_handler.py. (e.g. /home/user/secdb/cnvd/)')
+    arg_parser.add_argument('-o', metavar='<CHANGES DIR>', help='Specify the directory to store the change feed. (default. <DATABASE DIR>/changes)')
+    arg_parser.add_argument('--baseline', action='store_true', help='Only record the current state, e.g. on the first run, without writing changes.')
+    args = arg_parser.parse_args()
+
+    summary = run(args.d, args.o if args.o else Path(args.d).joinpath("changes"), args.c, args.baseline)
+    for name, counts in sorted(summary.items()):
+        print("%s: %d added, %d modified, %d withdrawn" % (name, counts[ADDED], counts[MODIFIED], counts[WITHDRAWN]))
@@ -0,0 +1,233 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/python3
+
+import re, sys, json, bisect, argparse
+from pathlib import Path
+from cnvd_output import iter_records
+
+SUMMARY_FIELDS = ["cnvdNumber", "cveNumber", "title", "serverity", "nvdSeverity"]
+
+def version_key(version):
+    # natural order: 1.2 < 1.10, 1.1.1 < 1.1.1k, compared piece by piece
+    key = []
+    for part in re.findall(r"\d+|[a-z]+", version.lower()):
+        key.append((1, int(part), "") if part.isdigit() else (0, 0, part))
+    return tuple(key)
+
+def iter_database(database_dirpath):
+    # normalized or flat vulns of a cnvd_xml_handler.py output directory, json or jsonl
+    database_dirpath = Path(database_dirpath)
+    if database_dirpath.joinpath("cnvd-index.json").exists():
+        for vuln in iter_records(database_dirpath):
+            yield vuln
+        return
+    for filepath in sorted(database_dirpath.glob("cnvd-[0-9]*.json")):
+        with open(filepath) as f:
+            for vuln in json.load(f):
+                yield vuln
+
+class ProductVersions(object):
+    # The CPE entries of one product: concrete versions sorted by version_key,
+    # prefix wildcards ("1.1.*") by prefix, and the entries matching any version.
+    # The database keeps only the cpe23Uri of the NVD configurations, not their
+    # versionStart*/versionEnd* bounds, so a "*" entry (usually such a range)
+    # matches every version of the product.
+    def __init__(self):
+        self.keys = []
+        self.entries = []       # (vendor, version, vuln, cpe), parallel to keys
+        self.prefixes = {}      # prefix -> [(vendor, version, vuln, cpe)]
+        self.any = []           # "*": every version
+        self.na = []            # "-": no version applies, matched by a "-" query only
+        self.pending = []
+
+    def add(self, vendor, version, vuln, cpe):
+        entry = (vendor, version, vuln, cpe)
+        if version in ("*", ""):
+            self.any.append(entry)
+        elif version == "-":
+            self.na.append(entry)
+        elif version.endswith("*") and "\\*" not in version[-2:]:
+            self.prefixes.setdefault(version.rstrip("*"), []).append(entry)
+        else:
+            self.pending.append((version_key(version.replace("\\", "")), entry))
+
+    def freeze(self):
+        self.pending.sort(key=lambda item: item[0])
+        self.keys = [key for key, entry in self.pending]
+        self.entries = [entry for key, entry in self.pending]
+        self.pending = []
+
+    def exact(self, key):
+        first = bisect.bisect_left(self.keys, key)
+        last = bisect.bisect_right(self.keys, key, first)
+        return self.entries[first:last]
+
+    def between(self, low, high):
+        # entries with low <= version <= high, either bound may be None
+        first = 0 if low is None else bisect.bisect_left(self.keys, version_key(low))
+        last = len(self.keys) if high is None else bisect.bisect_right(self.keys, version_key(high))
+        return self.entries[first:last]
+
+    def wildcards(self, version):
+        if version == "-":
+            return list(self.na)
+        matches = list(self.any)
+        for end in range(len(version) + 1):
+            matches.extend(self.prefixes.get(version[:end], []))
+        return matches
+
+class CnvdMatcher(object):
+    # In-memory index of a CNVD database by CPE part ("a" applications from
+    # packages, "o" operating systems from systems), product and version,
+    # answering "which CNVD entries affect <product> <version>".
+    def __init__(self):
+        self.vulns = []         # summary of every CNVD number, referenced by position
+        self.numbers = {}       # cnvdNumber -> position in vulns
+        self.products = {"a": {}, "o": {}}
+
+    def vuln_id(self, vuln):
+        number = vuln.get("cnvdNumber")
+        if number not in self.numbers:
+            self.numbers[number] = len(self.vulns)
+            self.vulns.append(dict((key, vuln.get(key)) for key in SUMMARY_FIELDS))
+        return self.numbers[number]
+
+    def add(self, part, vendor, product, version, vuln_id, cpe):
+        if product in ("", "Unknown") or version == "Unknown":
+            return
+        versions = self.products[part].get(product.lower())
+        if versions is None:
+            versions = self.products[part][product.lower()] = ProductVersions()
+        versions.add(vendor.lower(), version, vuln_id, cpe)
+
+    def load(self, database_dirpath):
+        seen = set()
+        for vuln in iter_database(database_dirpath):
+            vuln_id = self.vuln_id(vuln)
+            packages = vuln["packages"] if "packages" in vuln else [vuln["package"]]
+            systems = vuln["systems"] if "systems" in vuln else [vuln["system"]]
+            # flat rows repeat every package once per system
+            for pkg in packages:
+                if (vuln_id, "a", pkg["cpe"]) in seen:
+                    continue
+                seen.add((vuln_id, "a", pkg["cpe"]))
+                vendor = pkg["cpe"].split(":")[3] if pkg["cpe"].startswith("cpe:") else ""
+                self.add("a", vendor, pkg["name"], pkg["version"], vuln_id, pkg["cpe"])
+            for system in systems:
+                key = (vuln_id, "o", system["vendor"], system["product"], system["version"])
+                if key in seen:
+                    continue
+                seen.add(key)
+                self.add("o", system["vendor"], system["product"], system["version"], vuln_id, None)
+        for part in self.products.values():
+            for versions in part.values():
+                versions.freeze()
+        return self
+
+    def results(self, entries, vendor):
+        matches = []
+        found = set()
+        for entry_vendor, version, vuln_id, cpe in entries:
+            if vendor and entry_vendor != vendor.lower():
+                continue
+            if (vuln_id, version) in found:
+                continue
+            found.add((vuln_id, version))
+            match = dict(self.vulns[vuln_id])
+            match["vendor"] = entry_vendor
+            match["version"] = version
+            if cpe is not None:
+                match["cpe"] = cpe
+            matches.append(match)
+        return matches
+
+    def match(self, product, version, vendor=None, part="a"):
+        versions = self.products[part].get(product.lower())
+        if versions is None:
+            return []
+        if version in ("*", ""):
+            entries = versions.entries + versions.any + [entry for entries in versions.prefixes.values() for entry in entries]
+        else:
+            entries = versions.wildcards(version)
+            if version != "-":
+                entries = versions.exact(version_key(version)) + entries
+        return self.results(entries, vendor)
+
+    def match_range(self, product, low=None, high=None, vendor=None, part="a"):
+        # entries for any version between low and high (inclusive), plus the "*" ones
+        versions = self.products[part].get(product.lower())
+        if versions is None:
+            return []
+        return self.results(versions.between(low, high) + versions.any, vendor)
+
+    def match_batch(self, queries, part="a"):
+        # Queries are (product, version) or (product, version, vendor), e.g. the
+        # packages of one image. They are grouped by product and walked in version
+        # order against the sorted entries in a single merge pass per product.
+        # Returns the matches in query order.
+        results = [[] for _ in queries]
+        groups = {}
+        for position, query in enumerate(queries):
+            groups.setdefault(query[0].lower(), []).append(position)
+
+        for product, positions in groups.items():
+            versions = self.products[part].get(product)
+            if versions is None:
+                continue
+            concrete = []
+            for position in positions:
+                version = queries[position][1]
+                if version in ("*", "", "-"):
+                    vendor = queries[position][2] if len(queries[position]) > 2 else None
+                    results[position] = self.match(product, version, vendor, part)
+                else:
+                    concrete.append((version_key(version), position))
+            concrete.sort(key=lambda item: item[0])
+
+            index = 0
+            for key, position in concrete:
+                while index < len(versions.keys) and versions.keys[index] < key:
+                    index += 1
+                end = index
+                while end < len(versions.keys) and versions.keys[end] == key:
+                    end += 1
+                query = queries[position]
+                vendor = query[2] if len(query) > 2 else None
+                results[position] = self.results(versions.entries[index:end] + versions.wildcards(query[1]), vendor)
+        return results
+
+def read_queries(filepath):
+    # "<product> <version> [vendor]" lines or a JSON list of {name, version, vendor}
+    with (sys.stdin if filepath == "-" else open(filepath)) as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return [(item["name"], item["version"], item.get("vendor")) for item in json.loads(text)]
+    queries = []
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) >= 2:
+            queries.append((fields[0], fields[1], fields[2] if len(fields) > 2 else None))
+    return queries
+
+if ( __name__ == "__main__"):
+    arg_parser = argparse.ArgumentParser(prog='PROG', description='Match installed packages against a CNVD database written by cnvd_xml_handler.py. '
+        'The database has no NVD version ranges (versionStart*/versionEnd*): CPEs with a "*" version match every version of the product and should be checked against NVD.')
+    arg_parser.add_argument('-i', metavar='<DATABASE DIR>', required=True, help='Specify the directory storing the CNVD database, json or jsonl. (e.g. /home/user/secdb/cnvd/)')
+    arg_parser.add_argument('-q', metavar='<PRODUCT=VERSION>', action='append', default=[], help='Package to look up, may be repeated. (e.g. openssl=1.1.1k)')
+    arg_parser.add_argument('-l', metavar='<PACKAGE LIST>', help='File of "<product> <version> [vendor]" lines or a JSON list of {name, version, vendor}, - for stdin.')
+    arg_parser.add_argument('--os', action='store_true', help='Match operating systems (systems) instead of applications (packages).')
+    args = arg_parser.parse_args()
+
+    queries = []
+    for item in args.q:
+        if "=" not in item:
+            arg_parser.error("-q takes <PRODUCT=VERSION>, got %s" % item)
+        queries.append(tuple(item.split("=", 1)))
+    if args.l:
+        queries.extend(read_queries(args.l))
+    if not queries:
+        arg_parser.error("give packages with -q or -l")
+
+    matcher = CnvdMatcher().load(args.i)
+    for query, matches in zip(queries, matcher.match_batch(queries, "o" if args.os else "a")):
+        print(json.dumps({"name": query[0], "version": query[1], "matches": matches}, ensure_ascii=False))
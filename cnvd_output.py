@@ -0,0 +1,270 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/python3
+
+import os, io, json, gzip, argparse
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESS_SUFFIX = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+class ShardWriter(object):
+    # cnvd-%04d.json files holding a JSON list of split_number vulns each
+    def __init__(self, database_filepath, split_number):
+        self.count = 0
+        self.vulns = []
+        self.database_filepath = database_filepath
+        self.split_number = split_number
+
+    def write(self, vuln):
+        self.vulns.append(vuln)
+        if len(self.vulns) >= self.split_number:
+            self.flush()
+
+    def flush(self):
+        output_filepath = Path(str(self.database_filepath) % self.count)
+        with open(output_filepath, "w") as f:
+            json.dump(self.vulns, f)
+        self.count += 1
+        self.vulns = []
+
+    def resume(self, kept_shards):
+        # keep the first kept_shards files of the previous run and continue after them
+        self.count = kept_shards
+        self.vulns = []
+
+    def close(self):
+        if self.vulns:
+            self.flush()
+
+        # shards left over from a previous, longer run
+        pattern = Path(str(self.database_filepath))
+        prefix, suffix = pattern.name.split("%04d")
+        for filepath in pattern.parent.glob(prefix + "[0-9]*" + suffix):
+            number = filepath.name[len(prefix):len(filepath.name) - len(suffix)]
+            if number.isdigit() and int(number) >= self.count:
+                filepath.unlink()
+
+class SpoolWriter(object):
+    # one JSON line per vuln, used by --jobs workers to hand records back in order
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, vuln):
+        self.f.write(json.dumps(vuln))
+        self.f.write("\n")
+
+def flatten(vuln):
+    # legacy rows of a normalized vuln: the shared fields once per (package, system) pair
+    for pkg in vuln["packages"]:
+        for sys in vuln["systems"]:
+            row = {}
+            for key in vuln:
+                if key != "packages" and key != "systems":
+                    row[key] = vuln[key]
+            row["package"] = pkg
+            row["system"] = sys
+            yield row
+
+class SkipWriter(object):
+    # drops the first `skip` records, used to resume after the unchanged shards
+    def __init__(self, writer, skip=0):
+        self.writer = writer
+        self.skip = skip
+
+    def write(self, vuln):
+        if self.skip > 0:
+            self.skip -= 1
+        else:
+            self.writer.write(vuln)
+
+class CountingWriter(object):
+    # counts the records passed on to writer, or just counts them without one
+    def __init__(self, writer=None):
+        self.count = 0
+        self.writer = writer
+
+    def write(self, vuln):
+        self.count += 1
+        if self.writer is not None:
+            self.writer.write(vuln)
+
+class FlatWriter(object):
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, vuln):
+        for row in flatten(vuln):
+            self.writer.write(row)
+
+    def close(self):
+        self.writer.close()
+
+def open_compressed(filepath, mode, compress):
+    if compress == "gzip":
+        # no timestamp in the header, identical records give identical shards
+        return gzip.GzipFile(filepath, mode, mtime=0)
+    if compress == "zstd":
+        if "w" in mode:
+            return zstandard.ZstdCompressor().stream_writer(open(filepath, mode))
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(filepath, mode)))
+    return open(filepath, mode)
+
+class JsonlShardWriter(object):
+    # Writes vulns one per line into cnvd-%04d.jsonl[.gz|.zst], starting a new
+    # shard after split_number records or max_bytes (uncompressed) bytes.
+    # Each shard gets a cnvd-%04d.idx of "<cnvdNumber>\t<offset>" lines giving
+    # the uncompressed offset of the first record of every CNVD number, and
+    # cnvd-index.json lists the shards once the writer is closed.
+    def __init__(self, output_dirpath, split_number, max_bytes=None, compress=None, layout="flat"):
+        if compress == "zstd" and zstandard is None:
+            raise RuntimeError("zstd compression needs the zstandard package")
+        self.output_dirpath = Path(output_dirpath)
+        self.split_number = split_number
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.layout = layout
+        self.shards = []
+        self.f = None
+
+    def shard_filename(self, number):
+        return "cnvd-%04d.jsonl%s" % (number, COMPRESS_SUFFIX[self.compress])
+
+    def open_shard(self):
+        number = len(self.shards)
+        self.shard = {
+            "file": self.shard_filename(number),
+            "index": "cnvd-%04d.idx" % number,
+            "records": 0,
+            "first": None,
+            "last": None,
+            "bytes": 0
+        }
+        self.tmp_filepath = self.output_dirpath.joinpath("." + self.shard["file"] + ".part")
+        self.f = open_compressed(self.tmp_filepath, "wb", self.compress)
+        self.offsets = []
+
+    def resume(self, kept_shards):
+        # keep the first kept_shards shards listed in the previous cnvd-index.json
+        index_filepath = self.output_dirpath.joinpath("cnvd-index.json")
+        if kept_shards and index_filepath.exists():
+            with open(index_filepath) as f:
+                self.shards = json.load(f)["shards"][:kept_shards]
+
+    def write(self, vuln):
+        if self.f is None:
+            self.open_shard()
+        line = (json.dumps(vuln, ensure_ascii=False) + "\n").encode("utf-8")
+        number = vuln.get("cnvdNumber")
+        if number != self.shard["last"] or self.shard["records"] == 0:
+            self.offsets.append("%s\t%d\n" % (number, self.shard["bytes"]))
+        if self.shard["first"] is None:
+            self.shard["first"] = number
+        self.shard["last"] = number
+        self.f.write(line)
+        self.shard["records"] += 1
+        self.shard["bytes"] += len(line)
+        if self.shard["records"] >= self.split_number or (self.max_bytes and self.shard["bytes"] >= self.max_bytes):
+            self.finish_shard()
+
+    def finish_shard(self):
+        self.f.close()
+        self.f = None
+        os.replace(self.tmp_filepath, self.output_dirpath.joinpath(self.shard["file"]))
+        with open(self.output_dirpath.joinpath(self.shard["index"]), "w") as f:
+            f.writelines(self.offsets)
+        self.shard["compressed_bytes"] = os.path.getsize(self.output_dirpath.joinpath(self.shard["file"]))
+        self.shards.append(self.shard)
+
+    def close(self):
+        if self.f is not None:
+            self.finish_shard()
+
+        # shards left over from a previous, longer run
+        current = set()
+        for shard in self.shards:
+            current.update([shard["file"], shard["index"]])
+        for filepath in list(self.output_dirpath.glob("cnvd-[0-9]*.jsonl*")) + list(self.output_dirpath.glob("cnvd-[0-9]*.idx")):
+            if filepath.name not in current:
+                filepath.unlink()
+
+        index = {"layout": self.layout, "compress": self.compress, "shards": self.shards}
+        tmp_filepath = self.output_dirpath.joinpath(".cnvd-index.json.part")
+        with open(tmp_filepath, "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_filepath, self.output_dirpath.joinpath("cnvd-index.json"))
+
+def iter_records(output_dirpath):
+    # every vuln of a JSONL database, in shard order
+    output_dirpath = Path(output_dirpath)
+    with open(output_dirpath.joinpath("cnvd-index.json")) as f:
+        index = json.load(f)
+    for shard in index["shards"]:
+        with open_compressed(output_dirpath.joinpath(shard["file"]), "rb", index["compress"]) as f:
+            for line in f:
+                yield json.loads(line)
+
+def iter_flat_records(output_dirpath):
+    # the legacy flat view of a JSONL database, whatever its layout
+    output_dirpath = Path(output_dirpath)
+    with open(output_dirpath.joinpath("cnvd-index.json")) as f:
+        layout = json.load(f).get("layout", "flat")
+    for vuln in iter_records(output_dirpath):
+        if layout == "normalized":
+            for row in flatten(vuln):
+                yield row
+        else:
+            yield vuln
+
+def skip_to(f, offset):
+    # zstd streams only read forward, they are skipped through instead of seeking
+    if f.seekable():
+        f.seek(offset)
+        return
+    while offset > 0:
+        chunk = f.read(min(offset, 1024 * 1024))
+        if not chunk:
+            break
+        offset -= len(chunk)
+
+def find_records(output_dirpath, cnvd_number):
+    # the records of one CNVD number, read by seeking to its offset
+    output_dirpath = Path(output_dirpath)
+    with open(output_dirpath.joinpath("cnvd-index.json")) as f:
+        index = json.load(f)
+    records = []
+    for shard in index["shards"]:
+        offset = None
+        with open(output_dirpath.joinpath(shard["index"])) as f:
+            for line in f:
+                number, position = line.rstrip("\n").split("\t")
+                if number == cnvd_number:
+                    offset = int(position)
+                    break
+        if offset is None:
+            continue
+        with open_compressed(output_dirpath.joinpath(shard["file"]), "rb", index["compress"]) as f:
+            skip_to(f, offset)
+            for line in f:
+                vuln = json.loads(line)
+                if vuln.get("cnvdNumber") != cnvd_number:
+                    break
+                records.append(vuln)
+    return records
+
+if ( __name__ == "__main__"):
+    arg_parser = argparse.ArgumentParser(prog='PROG', description='Export the flat legacy view of a JSONL CNVD database as cnvd-%04d.json files.')
+    arg_parser.add_argument('-i', metavar='<JSONL DATABASE DIR>', required=True, help='Specify the directory including cnvd-index.json. (e.g. /home/user/secdb/cnvd/)')
+    arg_parser.add_argument('-o', metavar='<DATABASE DIR>', required=True, help='Specify the directory to store the flat CNVD database. (e.g. /home/user/secdb/cnvd-flat/)')
+    arg_parser.add_argument('-s', metavar='<SPLIT NUMBER>', type=int, default=40000, help='Number of vulnerabilities in a JSON file. (default. 40000)')
+    args = arg_parser.parse_args()
+
+    if not Path(args.o).exists():
+        Path(args.o).mkdir(parents=True, exist_ok=True)
+    writer = ShardWriter(Path(args.o).joinpath("cnvd-%04d.json"), args.s)
+    for vuln in iter_flat_records(args.i):
+        writer.write(vuln)
+    writer.close()
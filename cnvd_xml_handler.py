@@ -1,183 +1,455 @@
 # -*- coding: UTF-8 -*-
 #!/usr/bin/python3
 
-import xml.sax, json, jsonpath, argparse
+import xml.sax, xml.sax.saxutils, xml.parsers.expat, json, argparse, os, tempfile, hashlib, collections
 from pathlib import Path
- 
+from concurrent.futures import ProcessPoolExecutor
+from nvd_index import NvdJsonTree, NvdIndex
+from cnvd_output import ShardWriter, SpoolWriter, JsonlShardWriter, FlatWriter, SkipWriter, CountingWriter
+from run_metrics import RunMetrics
+from snapshot_store import file_sha256
+
+def enrich(raw, nvd_record):
+    # normalized vuln of a raw CNVD entry, None when NVD has no CPE data for its CVE
+    if nvd_record is None:
+        return None
+    severity, cpe23Uri = nvd_record # NVD严重等级
+    if not isinstance(cpe23Uri, list):
+        return None
+
+    packages = []
+    systems = []
+    for acpe in cpe23Uri:
+        cpe_slices = acpe.split(":")
+        if cpe_slices[2] == "a":
+            pkg = {}
+            pkg["name"] = cpe_slices[4]
+            pkg["version"] = cpe_slices[5]
+            pkg["cpe"] = acpe
+            packages.append(pkg)
+        if cpe_slices[2] == "o":
+            sys = {}
+            sys["vendor"] = cpe_slices[3]
+            sys["product"] = cpe_slices[4]
+            sys["version"] = cpe_slices[5]
+            systems.append(sys)
+
+    if len(packages) == 0:
+        pkg = {}
+        pkg["name"] = "Unknown"
+        pkg["version"] = "Unknown"
+        pkg["cpe"] = "Unknown"
+        packages.append(pkg)
+    if len(systems) == 0:
+        sys = {}
+        sys["vendor"] = "Unknown"
+        sys["product"] = "Unknown"
+        sys["version"] = "Unknown"
+        systems.append(sys)
+
+    vuln = dict(raw)
+    vuln["nvdSeverity"] = severity.strip()
+    vuln["packages"] = packages
+    vuln["systems"] = systems
+    return vuln
+
+# CNVD XML element -> record key, in record order
+FIELDS = [
+    ("number", "cnvdNumber"),                   # CNVD编号
+    ("title", "title"),                         # 漏洞名称
+    ("serverity", "serverity"),                 # 严重等级
+    ("product", "products"),                    # 受影响软件
+    ("isEvent", "vulnType"),                    # 漏洞类别
+    ("submitTime", "submitTime"),               # 提交时间
+    ("openTime", "openTime"),                   # 公开时间
+    ("discovererName", "discovererName"),       # 漏洞提交者
+    ("referenceLink", "referenceLink"),         # 参考链接
+    ("formalWay", "formalWay"),                 # 修补方案
+    ("description", "description"),             # 漏洞描述
+    ("patchName", "patchName"),                 # 补丁名称
+    ("patchDescription", "patchDescription"),   # 补丁描述
+    ("cveNumber", "cveNumber"),                 # CVE编号
+    ("cveUrl", "cveUrl"),                       # CVE链接
+]
+
 class VulnerabilityHandler( xml.sax.ContentHandler ):
-    def __init__(self, nvd_json_filepath, database_filepath, split_number):
-        self.count = 0
-        self.vulns = []
+    # Text of the FIELDS elements is accumulated chunk by chunk, parsers may
+    # split one text node into several characters() calls. All fields are
+    # reset at every <vulnerability>.
+    def __init__(self, nvd_source, writer, stats=None):
         self.CurrentData = ""
-        self.number = ""            # CNVD编号
-        self.title = ""             # 漏洞名称
-        self.serverity = ""         # 严重等级
+        self.buffers = {}           # element -> text chunks of the current vulnerability
         self.products = []          # 受影响软件
-        self.isEvent = ""           # 漏洞类别
-        self.submitTime = ""        # 提交时间
-        self.openTime = ""          # 公开时间
-        self.discovererName = ""    # 漏洞提交者
-        self.referenceLink = ""     # 参考链接
-        self.formalWay = ""         # 修补方案
-        self.description = ""       # 漏洞描述
-        self.patchName = ""         # 补丁名称
-        self.patchDescription = ""  # 补丁描述
-        self.cveNumber = ""         # CVE编号
-        self.cveUrl = ""            # CVE链接
-        self.nvd_json_filepath = nvd_json_filepath
-        self.database_filepath = database_filepath
-        self.split_number = split_number
+        self.nvd_source = nvd_source    # NvdIndex / NvdJsonTree
+        self.writer = writer            # receives one normalized record per vulnerability, the raw CNVD fields when nvd_source is None
+        self.stats = stats if stats is not None else collections.Counter()
  
     # 元素开始事件处理
     def startElement(self, tag, attributes):
         self.CurrentData = tag
         if tag == "vulnerability":
+            self.buffers = {}
             self.products = []
+        elif tag in FIELD_TAGS:
+            # a repeated element replaces the previous value, e.g. the last <cveNumber> wins
+            self.buffers[tag] = []
  
     # 元素结束事件处理
     def endElement(self, tag):
-        if tag == "vulnerability" and self.cveNumber:
-            try:
-                vulnyear = self.cveNumber.split("-")[1].strip()
-                filepath = Path(str(self.nvd_json_filepath) % (vulnyear, self.cveNumber.strip()))
-                severity = "" # NVD严重等级
-                cpe23Uri = []
-                
-                if filepath.exists():
-                    with open(filepath) as f:
-                        jsondata = json.load(f)
-                        if "baseMetricV3" in jsondata["impact"]:
-                            severity = jsondata["impact"]["baseMetricV3"]["cvssV3"]["baseSeverity"]
-                        elif "baseMetricV2" in jsondata["impact"]:
-                            severity = jsondata["impact"]["baseMetricV2"]["severity"]
-                        else:
-                            severity = "None"
-                        cpe23Uri = jsonpath.jsonpath(jsondata["configurations"], '$..cpe23Uri')
-                    
-                    if isinstance(cpe23Uri, list):
-                        packages = []
-                        systems = []
-                        for acpe in cpe23Uri:
-                            cpe_slices = acpe.split(":")
-                            if cpe_slices[2] == "a":
-                                pkg = {}
-                                pkg["name"] = cpe_slices[4]
-                                pkg["version"] = cpe_slices[5]
-                                pkg["cpe"] = acpe
-                                packages.append(pkg)
-                            if cpe_slices[2] == "o":
-                                sys = {}
-                                sys["vendor"] = cpe_slices[3]
-                                sys["product"] = cpe_slices[4]
-                                sys["version"] = cpe_slices[5]
-                                systems.append(sys)
-                        
-                        if len(packages) == 0:
-                            pkg = {}
-                            pkg["name"] = "Unknown"
-                            pkg["version"] = "Unknown"
-                            pkg["cpe"] = "Unknown"
-                            packages.append(pkg)
-                        if len(systems) == 0:
-                            sys = {}
-                            sys["vendor"] = "Unknown"
-                            sys["product"] = "Unknown"
-                            sys["version"] = "Unknown"
-                            systems.append(sys)
-                        
-                        for pkg in packages:
-                            for sys in systems:
-                                vuln = {}
-                                vuln["cnvdNumber"] = self.number.strip()
-                                vuln["title"] = self.title.strip()
-                                vuln["serverity"] = self.serverity.strip()
-                                vuln["products"] = "  ".join(self.products)
-                                vuln["vulnType"] = self.isEvent.strip()
-                                vuln["submitTime"] = self.submitTime.strip()
-                                vuln["openTime"] = self.openTime.strip()
-                                vuln["discovererName"] = self.discovererName.strip()
-                                vuln["referenceLink"] = self.referenceLink.strip()
-                                vuln["formalWay"] = self.formalWay.strip()
-                                vuln["description"] = self.description.strip()
-                                vuln["patchName"] = self.patchName.strip()
-                                vuln["patchDescription"] = self.patchDescription.strip()
-                                vuln["cveNumber"] = self.cveNumber.strip()
-                                vuln["cveUrl"] = self.cveUrl.strip()
-                                vuln["nvdSeverity"] = severity.strip()
-                                vuln["package"] = pkg
-                                vuln["system"] = sys
-                                self.vulns.append(vuln)
-                                if len(self.vulns) >= self.split_number:
-                                    output_filepath = Path(str(self.database_filepath) % self.count)
-                                    with open(output_filepath, "w") as f:
-                                        json.dump(self.vulns, f)
-                                    self.count += 1
-                                    self.vulns = []
-            except:
-                # print(self.cveNumber)
-                pass
+        if tag == "product":
+            self.products.append(xml.sax.saxutils.unescape("".join(self.buffers.get("product", []))))
+        elif tag == "vulnerability" and not "".join(self.buffers.get("cveNumber", [])).strip():
+            self.stats["no_cve"] += 1
+        elif tag == "vulnerability":
+            self.stats["vulns"] += 1
+            raw = {}
+            for field, key in FIELDS:
+                if field == "product":
+                    raw[key] = "  ".join(self.products)
+                else:
+                    raw[key] = "".join(self.buffers.get(field, [])).strip()
+            if self.nvd_source is None:
+                self.writer.write(raw)
+            else:
+                try:
+                    nvd_record = self.nvd_source.lookup(raw["cveNumber"])
+                    vuln = enrich(raw, nvd_record)
+                    if vuln is not None:
+                        self.writer.write(vuln)
+                        self.stats["enriched"] += 1
+                    elif nvd_record is None:
+                        self.stats["nvd_missing"] += 1
+                    else:
+                        self.stats["nvd_no_cpe"] += 1
+                except:
+                    self.stats["errors"] += 1
         self.CurrentData = ""
  
     # 内容事件处理
     def characters(self, content):
-        if self.CurrentData == "number":
-            self.number = content
-        elif self.CurrentData == "title":
-            self.title = content
-        elif self.CurrentData == "serverity":
-            self.serverity = content
-        elif self.CurrentData == "product":
-            self.products.append(xml.sax.saxutils.unescape(content))
-        elif self.CurrentData == "isEvent":
-            self.isEvent = content
-        elif self.CurrentData == "submitTime":
-            self.submitTime = content
-        elif self.CurrentData == "openTime":
-            self.openTime = content
-        elif self.CurrentData == "discovererName":
-            self.discovererName = content
-        elif self.CurrentData == "referenceLink":
-            self.referenceLink = content
-        elif self.CurrentData == "formalWay":
-            self.formalWay = content
-        elif self.CurrentData == "description":
-            self.description = content
-        elif self.CurrentData == "patchName":
-            self.patchName = content
-        elif self.CurrentData == "patchDescription":
-            self.patchDescription = content
-        elif self.CurrentData == "cveNumber":
-            self.cveNumber = content
-        elif self.CurrentData == "cveUrl":
-            self.cveUrl = content
+        buffer = self.buffers.get(self.CurrentData)
+        if buffer is not None:
+            buffer.append(content)
+
+FIELD_TAGS = set(field for field, key in FIELDS)
+
+def parse_file(filepath, nvd_source, writer, backend="sax", stats=None):
+    # returns the handler's counters: vulns, enriched, nvd_missing, nvd_no_cpe, no_cve, errors
+    handler = VulnerabilityHandler(nvd_source, writer, stats)
+    if backend == "expat":
+        # expat directly, without the SAX layer, with its own text buffering
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.buffer_size = 1024 * 1024
+        parser.StartElementHandler = handler.startElement
+        parser.EndElementHandler = handler.endElement
+        parser.CharacterDataHandler = handler.characters
+        with open(filepath, "rb") as f:
+            parser.ParseFile(f)
+        return handler.stats
+
+    # 创建一个 XMLReader
+    parser = xml.sax.make_parser()
+    # turn off namepsaces
+    parser.setFeature(xml.sax.handler.feature_namespaces, 0)
+    # 重写 ContextHandler
+    parser.setContentHandler( handler )
+    parser.parse(str(filepath))
+    return handler.stats
+
+worker_nvd_source = None
+
+def init_worker(nvd_source):
+    global worker_nvd_source
+    worker_nvd_source = nvd_source
+
+def spool_file(filepath, spool_dirpath, backend):
+    # converts one XML file in a worker process, records go to a spool file
+    fd, spool_filepath = tempfile.mkstemp(suffix=".jsonl", dir=spool_dirpath)
+    with os.fdopen(fd, "w") as f:
+        stats = parse_file(filepath, worker_nvd_source, SpoolWriter(f), backend)
+    return spool_filepath, stats
+
+def replay_spool(spool_filepath, writer):
+    with open(spool_filepath) as f:
+        for line in f:
+            writer.write(json.loads(line))
+
+def open_writer(output_dirpath, file_format, split_number, max_bytes=None, compress=None, layout="flat"):
+    if file_format == "jsonl":
+        return JsonlShardWriter(output_dirpath, split_number, max_bytes, compress, layout)
+    return ShardWriter(Path(output_dirpath).joinpath("cnvd-%04d.json"), split_number)
+
+def convert(xml_filepaths, nvd_source, writer, jobs=1, spool_dirpath=None, layout="flat", backend="sax", stats=None):
+    # Feeds the records of every XML file to writer in file order. With jobs > 1
+    # the files are parsed by a process pool and their records replayed in the
+    # same order, so the shards are identical to a serial run. The flat layout
+    # is expanded from the normalized records as they reach the writer.
+    # The parse counters of all files are added to stats.
+    if stats is None:
+        stats = collections.Counter()
+    counter = CountingWriter(writer)
+    writer = FlatWriter(counter) if layout == "flat" else counter
+
+    if jobs <= 1:
+        for filepath in xml_filepaths:
+            parse_file(filepath, nvd_source, writer, backend, stats)
+        stats["records_out"] += counter.count
+        return stats
+
+    with tempfile.TemporaryDirectory(prefix=".spool-", dir=spool_dirpath) as tmp_dirpath:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(nvd_source,)) as executor:
+            futures = [executor.submit(spool_file, filepath, tmp_dirpath, backend) for filepath in xml_filepaths]
+            for future in futures:
+                spool_filepath, file_stats = future.result()
+                stats.update(file_stats)
+                replay_spool(spool_filepath, writer)
+                os.unlink(spool_filepath)
+    stats["records_out"] += counter.count
+    return stats
+
+def nvd_fingerprint(nvd_record):
+    if nvd_record is None:
+        return ""
+    return hashlib.sha1(json.dumps(nvd_record).encode("utf-8")).hexdigest()
+
+def cache_entry(raw, nvd_source, layout):
+    # raw CNVD fields with the fingerprint of their NVD data and the number of rows they produce
+    # a CVE that fails to look up (e.g. a malformed number with --no-index)
+    # gives no rows, convert() counts it as an error
+    try:
+        nvd_record = nvd_source.lookup(raw["cveNumber"])
+        vuln = enrich(raw, nvd_record)
+    except:
+        nvd_record = None
+        vuln = None
+    if vuln is None:
+        rows = 0
+    elif layout == "flat":
+        rows = len(vuln["packages"]) * len(vuln["systems"])
+    else:
+        rows = 1
+    return {"raw": raw, "fp": nvd_fingerprint(nvd_record), "rows": rows}
+
+class CacheWriter(object):
+    def __init__(self, f, nvd_source, layout):
+        self.f = f
+        self.nvd_source = nvd_source
+        self.layout = layout
+
+    def write(self, raw):
+        self.f.write(json.dumps(cache_entry(raw, self.nvd_source, self.layout)))
+        self.f.write("\n")
+
+def update(xml_filepaths, nvd_source, writer, output_dirpath, layout, settings, backend="sax", stats=None):
+    # Incremental rebuild. cnvd-state.json records every input XML (size, mtime,
+    # sha256) and .cnvd-cache/<xml>.jsonl keeps its raw vulns together with
+    # the fingerprint of their NVD data. Only new or changed XML files are
+    # parsed again, unchanged ones are checked against the current NVD data,
+    # and shards are rewritten from the first one holding a changed record.
+    if stats is None:
+        stats = collections.Counter()
+    output_dirpath = Path(output_dirpath)
+    state_filepath = output_dirpath.joinpath("cnvd-state.json")
+    cache_dirpath = output_dirpath.joinpath(".cnvd-cache")
+    cache_dirpath.mkdir(exist_ok=True)
+
+    state = {}
+    if state_filepath.exists():
+        with open(state_filepath) as f:
+            state = json.load(f)
+    if state.get("settings") != settings:
+        state = {}
+    # caches and shards are rewritten below and the state only at the end: a
+    # run that stops halfway leaves none, and the next one rebuilds everything
+    drop_state(output_dirpath)
+    previous_files = state.get("files", {})
+    previous_order = state.get("order", [])
+
+    files = {}
+    order = []
+    position = 0
+    first_dirty = None
+    for filepath in xml_filepaths:
+        name = filepath.name
+        stat = os.stat(filepath)
+        previous = previous_files.get(name)
+        if previous and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+            files[name] = previous
+        else:
+            files[name] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": file_sha256(filepath)}
+        cache_filepath = cache_dirpath.joinpath(name + ".jsonl")
+
+        if len(order) >= len(previous_order) or previous_order[len(order)] != name:
+            if first_dirty is None:
+                first_dirty = position
+        order.append(name)
+
+        if previous is None or previous["sha256"] != files[name]["sha256"] or not cache_filepath.exists():
+            if first_dirty is None:
+                first_dirty = position
+            tmp_filepath = cache_dirpath.joinpath(name + ".jsonl.part")
+            stats["parsed_files"] += 1
+            with open(tmp_filepath, "w") as f:
+                stats["no_cve"] += parse_file(filepath, None, CacheWriter(f, nvd_source, layout), backend)["no_cve"]
+            os.replace(tmp_filepath, cache_filepath)
+            with open(cache_filepath) as f:
+                for line in f:
+                    position += json.loads(line)["rows"]
+            continue
+
+        # unchanged XML, look for CVEs whose NVD data changed
+        entries = []
+        changed = False
+        with open(cache_filepath) as f:
+            for line in f:
+                entry = json.loads(line)
+                try:
+                    fingerprint = nvd_fingerprint(nvd_source.lookup(entry["raw"]["cveNumber"]))
+                except:
+                    fingerprint = nvd_fingerprint(None)
+                if fingerprint != entry["fp"]:
+                    entry = cache_entry(entry["raw"], nvd_source, layout)
+                    changed = True
+                    stats["nvd_changed"] += 1
+                    if first_dirty is None:
+                        first_dirty = position
+                entries.append(entry)
+                position += entry["rows"]
+        if changed:
+            tmp_filepath = cache_dirpath.joinpath(name + ".jsonl.part")
+            with open(tmp_filepath, "w") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry))
+                    f.write("\n")
+            os.replace(tmp_filepath, cache_filepath)
+
+    for cache_filepath in cache_dirpath.glob("*.jsonl"):
+        if cache_filepath.name[:-len(".jsonl")] not in files:
+            cache_filepath.unlink()
+
+    if first_dirty is None:
+        first_dirty = position
+    if settings.get("max_bytes"):
+        # shard boundaries depend on record sizes, rewrite them all
+        first_dirty = 0
+    kept_shards = first_dirty // settings["split_number"]
+    writer.resume(kept_shards)
+
+    skip = kept_shards * settings["split_number"]
+    counter = CountingWriter(writer)
+    skip_writer = SkipWriter(counter)
+    out = FlatWriter(skip_writer) if layout == "flat" else skip_writer
+    position = 0
+    for name in order:
+        with open(cache_dirpath.joinpath(name + ".jsonl")) as f:
+            for line in f:
+                entry = json.loads(line)
+                stats["vulns"] += 1
+                if position + entry["rows"] <= skip:
+                    position += entry["rows"]
+                    stats["unchanged"] += 1
+                    continue
+                if position < skip:
+                    skip_writer.skip = skip - position
+                    position = skip
+                position += entry["rows"]
+                try:
+                    nvd_record = nvd_source.lookup(entry["raw"]["cveNumber"])
+                    vuln = enrich(entry["raw"], nvd_record)
+                except:
+                    vuln = None
+                    stats["errors"] += 1
+                    continue
+                if vuln is not None:
+                    out.write(vuln)
+                    stats["enriched"] += 1
+                elif nvd_record is None:
+                    stats["nvd_missing"] += 1
+                else:
+                    stats["nvd_no_cpe"] += 1
+    writer.close()
+    stats["records_out"] += counter.count
+
+    tmp_filepath = output_dirpath.joinpath(".cnvd-state.json.part")
+    with open(tmp_filepath, "w") as f:
+        json.dump({"settings": settings, "order": order, "files": files, "rows": position}, f)
+    os.replace(tmp_filepath, state_filepath)
+    return kept_shards
+
+def drop_state(output_dirpath):
+    # the shards no longer match the --update state, e.g. after a full convert
+    state_filepath = Path(output_dirpath).joinpath("cnvd-state.json")
+    if state_filepath.exists():
+        state_filepath.unlink()
   
 if ( __name__ == "__main__"):
     arg_parser = argparse.ArgumentParser(prog='PROG', description='Generate CNVD vuln database.')
     arg_parser.add_argument('-c', metavar='<CNVD XML DIR>', required=True, help='Specify the directory including CNVD info. (e.g. /home/user/cnvd_xml_files/)')
-    arg_parser.add_argument('-n', metavar='<NVD JSON DIR>', required=True, help='Specify the directory including NVD info. (e.g. /home/user/vuln-list-main/)')
+    nvd_group = arg_parser.add_mutually_exclusive_group(required=True)
+    nvd_group.add_argument('-n', metavar='<NVD JSON DIR>', help='Specify the directory including NVD info. (e.g. /home/user/vuln-list-main/)')
+    nvd_group.add_argument('-f', metavar='<NVD FEED DIR>', help='Specify the directory including the NVD JSON feeds downloaded by crawler.py. (e.g. /home/user/secdb/cvss/)')
     arg_parser.add_argument('-o', metavar='<DATABASE DIR>', required=True, help='Specify the directory to store CNVD database. (e.g. /home/user/secdb/cnvd/)')
     arg_parser.add_argument('-s', metavar='<SPLIT NUMBER>', type=int, default=40000, help='Number of vulnerabilities in a JSON file. (default. 40000)') # storage will be ~90 MB with 40k vulns in a JSON file
+    arg_parser.add_argument('-i', metavar='<INDEX FILE>', help='NVD lookup index, built or refreshed from -n/-f before converting. (default. <DATABASE DIR>/nvd-index.sqlite)')
+    arg_parser.add_argument('--no-index', action='store_true', help='Read the NVD JSON files of -n directly for every CVE instead of using the index.')
+    arg_parser.add_argument('--format', choices=['json', 'jsonl'], default='json', help='json: cnvd-%%04d.json lists, jsonl: one vuln per line with a cnvd-index.json. (default. json)')
+    arg_parser.add_argument('--layout', choices=['flat', 'normalized'], default='flat', help='flat: one vuln per (package, system) pair, normalized: one vuln per CNVD number with packages/systems arrays. (default. flat)')
+    arg_parser.add_argument('--compress', choices=['gzip', 'zstd'], help='Compress jsonl shards.')
+    arg_parser.add_argument('--max-bytes', metavar='<BYTES>', type=int, help='Also start a new jsonl shard after this many uncompressed bytes.')
+    arg_parser.add_argument('--jobs', metavar='<N>', type=int, default=1, help='Number of processes converting XML files in parallel. (default. 1)')
+    arg_parser.add_argument('--parser', choices=['sax', 'expat'], default='sax', help='XML parser backend, expat skips the SAX layer and is faster. (default. sax)')
+    arg_parser.add_argument('--update', action='store_true', help='Only reprocess new/changed XML files and CVEs whose NVD data changed since the last --update run.')
+    arg_parser.add_argument('--report', metavar='<REPORT FILE>', help='JSON report with the time and record counts of every stage. (default. <DATABASE DIR>/.cnvd-report.json)')
+    arg_parser.add_argument('--prom', metavar='<TEXTFILE>', help='Also write the run metrics for the node_exporter textfile collector. (e.g. /var/lib/node_exporter/secdb_cnvd.prom)')
     args = arg_parser.parse_args()
+    if args.update and args.jobs > 1:
+        arg_parser.error("--jobs is not supported with --update, the changed files are parsed in one process")
     
     split_number = args.s
     cnvd_xml_dirpath = Path(args.c)
-    nvd_json_filepath = Path(args.n).joinpath("nvd/%s/%s.json")
-    database_filepath = Path(args.o).joinpath("cnvd-%04d.json")
     if not Path(args.o).exists():
         Path(args.o).mkdir(parents=True, exist_ok=True)
 
-    # 创建一个 XMLReader
-    parser = xml.sax.make_parser()
-    # turn off namepsaces
-    parser.setFeature(xml.sax.handler.feature_namespaces, 0)
-    
-    # 重写 ContextHandler
-    Handler = VulnerabilityHandler(nvd_json_filepath, database_filepath, split_number)
-    parser.setContentHandler( Handler )
+    metrics = RunMetrics("cnvd")
+    if args.no_index and args.n:
+        nvd_source = NvdJsonTree(args.n)
+    elif args.f:
+        with metrics.stage("nvd_index") as stage:
+            nvd_source = NvdIndex(args.i if args.i else Path(args.o).joinpath("nvd-index.sqlite"))
+            stage["files"] = nvd_source.build_from_feeds(args.f)
+        print("%d NVD feeds indexed" % stage["files"])
+    else:
+        with metrics.stage("nvd_index") as stage:
+            nvd_source = NvdIndex(args.i if args.i else Path(args.o).joinpath("nvd-index.sqlite"))
+            stage["files"] = nvd_source.build(args.n)
+        print("%d NVD files indexed" % stage["files"])
+
+    writer = open_writer(args.o, args.format, split_number, args.max_bytes, args.compress, args.layout)
+    xml_filepaths = sorted(cnvd_xml_dirpath.glob('*.xml'))
+    if args.update:
+        settings = {"format": args.format, "layout": args.layout, "split_number": split_number, "compress": args.compress, "max_bytes": args.max_bytes}
+        with metrics.stage("update") as stage:
+            stats = collections.Counter()
+            stage["kept_shards"] = update(xml_filepaths, nvd_source, writer, args.o, args.layout, settings, args.parser, stats)
+            stage.update(stats)
+        print("%d shards unchanged" % stage["kept_shards"])
+    else:
+        with metrics.stage("convert") as stage:
+            stage["files"] = len(xml_filepaths)
+            stage.update(convert(xml_filepaths, nvd_source, writer, args.jobs, args.o, args.layout, args.parser))
+        with metrics.stage("write"):
+            writer.close()
+        drop_state(args.o)
+    if stage.get("errors"):
+        print("ERROR: %d vulnerabilities failed to convert" % stage["errors"])
 
-    for filepath in cnvd_xml_dirpath.glob('*.xml'):
-        parser.parse(filepath)
+    metrics.finish()
+    metrics.write_report(args.report if args.report else Path(args.o).joinpath(".cnvd-report.json"))
+    if args.prom:
+        metrics.write_prometheus(args.prom)
 
 '''
 python3 cnvd_xml_handler.py -n ~/vuln-list-main -c ~/cnvd_xml_files -o ~/secdb/cnvd/ -s 40000
+python3 cnvd_xml_handler.py -f ~/secdb/cvss -c ~/cnvd_xml_files -o ~/secdb/cnvd/ -s 40000 --jobs 32
 '''
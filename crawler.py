@@ -1,378 +1,535 @@
 # -*- coding: UTF-8 -*-
 #!/usr/bin/python3
 
-import os, requests, re, datetime, argparse
-
-def alpine_crawler(root_path):
-    alpineMatrix = {
-        "main": ["v3.15", "v3.14", "v3.13", "v3.12", "v3.11", "v3.10", "v3.9", "v3.8", "v3.7", "v3.6", "v3.5", "v3.4", "v3.3"],
-        "community": ["v3.15", "v3.14", "v3.13", "v3.12", "v3.11", "v3.10", "v3.9", "v3.8", "v3.7", "v3.6", "v3.5", "v3.4", "v3.3"]
-    }
-
-    alpineDbURL = "https://secdb.alpinelinux.org/%s/%s.json"
-
-    for repo in alpineMatrix.keys():
-        for release in alpineMatrix[repo]:
-            target_dirpath = os.path.join(root_path, "alpine", release)
-            if not os.path.exists(target_dirpath):
-                os.makedirs(target_dirpath)
-            
-            json_url = alpineDbURL % (release, repo)
-
-            try:
-                res = requests.get(json_url)
-                if res.status_code == 200:
-                    with open(os.path.join(target_dirpath, "%s.json" % repo), "wb") as f:
-                        f.write(res.content)
-                else:
-                    print("ERROR: failed to download %s, status code: %d" % (json_url, res.status_code))
-            except:
-                print("EXCEPTION: failed to download %s" % json_url)
-
-def amazon_crawler(root_path):
-    awsMatrix = {
-        "linux1": "http://repo.us-west-2.amazonaws.com/2018.03/updates/x86_64/mirror.list",
-        "linux2": "https://cdn.amazonlinux.com/2/core/latest/x86_64/mirror.list"
-    }
-
-    for release in awsMatrix.keys():
-        try:
-            res = requests.get(awsMatrix[release])
-            if res.status_code == 200:
-                mirror_url = res.text.strip()
-                if re.match(r'^https?:/{2}\w.+$', mirror_url):
-                    target_dirpath = os.path.join(root_path, "amazon", release, "repodata")
-                    if not os.path.exists(target_dirpath):
-                        os.makedirs(target_dirpath)
-                    
-                    xml_url = mirror_url + "/repodata/repomd.xml"
-                    gz_url = mirror_url + "/repodata/updateinfo.xml.gz"
-
-                    try:
-                        res = requests.get(xml_url)
-                        if res.status_code == 200:
-                            with open(os.path.join(target_dirpath, "repomd.xml"), "wb") as f:
-                                f.write(res.content)
-                        else:
-                            print("ERROR: failed to download %s repomd.xml, status code: %d" % (release, res.status_code))
-                    except:
-                        print("EXCEPTION: failed to download %s repomd.xml" % release)
-                    
-                    try:
-                        res= requests.get(gz_url)
-                        if res.status_code == 200:
-                            with open(os.path.join(target_dirpath, "updateinfo.xml.gz"), "wb") as f:
-                                f.write(res.content)
-                        else:
-                            print("ERROR: failed to download %s updateinfo.xml.gz, status code: %d" % (release, res.status_code))
-                    except:
-                        print("EXCEPTION: failed to download %s updateinfo.xml.gz" % release)
-                else:
-                    print("ERROR: malformed mirror url: %s" % mirror_url)
-            else: 
-                print("ERROR: failed to download %s mirror list, status code: %d" % (release, res.status_code))
-        except:
-            print("EXCEPTION: failed to download %s mirror list" % release)
-
-def debian_crawler(root_path):
-    debianReleases = ["bullseye", "buster", "jessie", "stretch", "wheezy"]
-    OVALTemplate   = "https://www.debian.org/security/oval/oval-definitions-%s.xml"
-
-    sourcesURL = "https://ftp.debian.org/debian/dists/%s/%s/source/Sources.gz"
-    sourceRepos = ["main", "contrib", "non-free"]
-
-    target_dirpath = os.path.join(root_path, "debian")
-    if not os.path.exists(target_dirpath):
-        os.makedirs(target_dirpath)
-
-    for release in debianReleases:
-        xml_url = OVALTemplate % release
-        try:
-            res = requests.get(xml_url)
-            if res.status_code == 200:
-                with open(os.path.join(target_dirpath, "oval-definitions-%s.xml" % release), "wb") as f:
-                    f.write(res.content)
-            else:
-                print("ERROR: failed to download %s, status code: %d" % (xml_url, res.status_code))
-        except:
-            print("EXCEPTION: failed to download %s" % xml_url)
-        
-        if release == "wheezy":
-            pass
-        else:
-            try:
-                for repo in sourceRepos:
-                    src_dirpath = os.path.join(root_path, "debian", "dists", release, repo, "source")
-                    if not os.path.exists(src_dirpath):
-                        os.makedirs(src_dirpath)
-                    gz_url = sourcesURL % (release, repo)
-                    res = requests.get(gz_url)
-                    if res.status_code == 200:
-                        with open(os.path.join(src_dirpath, "Sources.gz"), "wb") as f:
-                            f.write(res.content)
-                    else:
-                        print("ERROR: failed to download %s, status code: %d" % (gz_url, res.status_code))
-            except:
-                print("EXCEPTION: failed to download %s" % gz_url)
-
-def oracle_crawler(root_path):
-    allDB   = "https://linux.oracle.com/security/oval/com.oracle.elsa-all.xml.bz2"
-    baseURL = "https://linux.oracle.com/security/oval/com.oracle.elsa-%d.xml.bz2"
-
-    target_dirpath = os.path.join(root_path, "oracle")
+import os, re, sys, time, fcntl, argparse, threading, functools, collections, tempfile, hashlib, json, gzip
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from http_client import HttpClient, TransferError, host_rate
+from vuln_index import VulnIndex
+from snapshot_store import SnapshotStore, file_sha256
+import change_feed
+from sources import load_registry, select, fetch_plan, print_plan, read_pulp_manifest, read_nvd_meta, feed_name
+from run_metrics import RunMetrics, DOWNLOADED, NOT_MODIFIED, SKIPPED, FAILED, FALLBACK, CALLBACK_ERROR
+
+CHUNK_SIZE = 1024 * 1024
+
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+def save_stream(res, filepath, expected_sha256=None, validate=None):
+    # Streams the response body into a temp file next to filepath and renames it
+    # into place, so a failed transfer never truncates the last good copy.
+    # validate(tmp_filepath) may raise to reject a complete but unusable body.
+    target_dirpath = os.path.dirname(filepath)
     if not os.path.exists(target_dirpath):
-        os.makedirs(target_dirpath)
+        os.makedirs(target_dirpath, exist_ok=True)
 
+    fd, tmp_filepath = tempfile.mkstemp(prefix=".%s." % os.path.basename(filepath), suffix=".part", dir=target_dirpath)
     try:
-        res = requests.get(allDB)
-        if res.status_code == 200:
-            with open(os.path.join(target_dirpath, "com.oracle.elsa-all.xml.bz2"), "wb") as f:
-                f.write(res.content)
-        else:
-            print("ERROR: failed to download %s, status code: %d" % (allDB, res.status_code))
+        size = 0
+        digest = hashlib.sha256()
+        with os.fdopen(fd, "wb") as f:
+            for chunk in res.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+
+        expected_size = res.headers.get("Content-Length")
+        if expected_size and "Content-Encoding" not in res.headers and int(expected_size) != size:
+            raise TransferError("truncated transfer: got %d of %s bytes" % (size, expected_size))
+        if expected_sha256 and digest.hexdigest() != expected_sha256:
+            raise TransferError("checksum mismatch: expected %s, got %s" % (expected_sha256, digest.hexdigest()))
+        if validate is not None:
+            validate(tmp_filepath)
+
+        os.chmod(tmp_filepath, 0o666 & ~UMASK)
+        os.replace(tmp_filepath, filepath)
     except:
-        print("EXCEPTION: failed to download %s" % allDB)
-
-    for year in range(2007, datetime.datetime.now().year+1):
-        bz_url = baseURL % year
-        try:
-            res = requests.get(bz_url)
-            if res.status_code == 200:
-                with open(os.path.join(target_dirpath, "com.oracle.elsa-%d.xml.bz2" % year), "wb") as f:
-                    f.write(res.content)
+        if os.path.exists(tmp_filepath):
+            os.unlink(tmp_filepath)
+        raise
+    return size, digest.hexdigest()
+
+def gunzip_sha256(filepath):
+    digest = hashlib.sha256()
+    with gzip.open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class FetchManifest(object):
+    # Remembers ETag/Last-Modified, size and sha256 of every file downloaded
+    # under a root path, so later runs can send conditional requests.
+    def __init__(self, root_path):
+        self.root_path = root_path
+        self.filepath = os.path.join(root_path, ".fetch-manifest.json")
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.changed = set()
+        if os.path.exists(self.filepath):
+            try:
+                with open(self.filepath) as f:
+                    self.entries = json.load(f)
+            except:
+                print("EXCEPTION: failed to load %s, starting a full sync" % self.filepath)
+
+    def conditional_headers(self, url, filepath):
+        with self.lock:
+            entry = self.entries.get(url)
+        headers = {}
+        if entry and entry["path"] == os.path.relpath(filepath, self.root_path) and os.path.exists(filepath) and os.path.getsize(filepath) == entry["size"]:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def update(self, url, filepath, res, size, sha256):
+        with self.lock:
+            self.changed.add(url)
+            self.entries[url] = {
+                "path": os.path.relpath(filepath, self.root_path),
+                "etag": res.headers.get("ETag"),
+                "last_modified": res.headers.get("Last-Modified"),
+                "size": size,
+                "mtime": os.path.getmtime(filepath),
+                "sha256": sha256
+            }
+
+    def cached_digest(self, url, filepath, key, compute):
+        # Returns entry[key] while the file keeps the size and mtime it had when
+        # the digest was recorded, otherwise recomputes it with compute(filepath).
+        stat = os.stat(filepath)
+        relpath = os.path.relpath(filepath, self.root_path)
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry and entry["path"] == relpath and entry["size"] == stat.st_size and entry.get("mtime") == stat.st_mtime and entry.get(key):
+                return entry[key]
+
+        value = compute(filepath)
+        with self.lock:
+            entry = self.entries.get(url)
+            if not entry or entry["path"] != relpath or entry["size"] != stat.st_size or entry.get("mtime") != stat.st_mtime:
+                entry = {"path": relpath, "size": stat.st_size, "mtime": stat.st_mtime}
+                self.entries[url] = entry
+            entry[key] = value
+            self.changed.add(url)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.changed.update(self.entries)
+            self.entries = {}
+
+    def forget(self, url):
+        with self.lock:
+            self.changed.add(url)
+            self.entries.pop(url, None)
+
+    def save(self):
+        # Only the entries this run changed are written over the file on disk,
+        # so crawlers running in other processes on the same root (work_queue.py)
+        # keep theirs.
+        with open(os.path.join(self.root_path, ".fetch-manifest.lock"), "w") as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+            entries = {}
+            if os.path.exists(self.filepath):
+                try:
+                    with open(self.filepath) as f:
+                        entries = json.load(f)
+                except:
+                    print("EXCEPTION: failed to load %s, rewriting it" % self.filepath)
+            with self.lock:
+                for url in self.changed:
+                    if url in self.entries:
+                        entries[url] = self.entries[url]
+                    else:
+                        entries.pop(url, None)
+                data = json.dumps(entries, indent=1, sort_keys=True)
+            fd, tmp_filepath = tempfile.mkstemp(prefix=".fetch-manifest.", suffix=".part", dir=os.path.dirname(self.filepath))
+            with os.fdopen(fd, "w") as f:
+                f.write(data)
+            os.chmod(tmp_filepath, 0o666 & ~UMASK)
+            os.replace(tmp_filepath, self.filepath)
+
+class FetchScheduler(object):
+    # Runs downloads on a bounded thread pool with at most `per_host` transfers
+    # in flight to any one host. Tasks that depend on another download (e.g. a
+    # mirror list or a manifest) are submitted from the callback of that download.
+    def __init__(self, max_workers=16, per_host=4, manifest=None, client=None, metrics=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.per_host = per_host
+        self.manifest = manifest
+        self.client = client if client is not None else HttpClient(pool_size=per_host)
+        self.metrics = metrics
+        self.failures = []
+        self.active = {}    # host -> transfers in flight
+        self.waiting = {}   # host -> tasks queued behind the per-host cap
+        self.pending = 0
+        self.cond = threading.Condition()
+
+    def submit(self, url, filepath=None, callback=None, fallback=None, sha256=None, validate=None):
+        # filepath: where to store the body; None keeps it in memory for the callback
+        # callback: called as callback(body) on success, body is the bytes or the filepath
+        # fallback: alternative URL tried when the download fails
+        # sha256: expected digest, a mismatching download is discarded
+        # validate: called as validate(tmp_filepath) before a download replaces filepath,
+        #           raising keeps the previous file and fails the download
+        task = (url, filepath, callback, fallback, sha256, validate)
+        host = urlparse(url).netloc
+        with self.cond:
+            self.pending += 1
+            if self.active.get(host, 0) < self.per_host:
+                self.active[host] = self.active.get(host, 0) + 1
+                self.executor.submit(self.run, host, task)
             else:
-                print("ERROR: failed to download %s, status code: %d" % (bz_url, res.status_code))
-        except:
-            print("EXCEPTION: failed to download %s" % bz_url)
-
-def photon_crawler(root_path):
-    photonReleases = ["photon1", "photon2", "photon3", "photon4"]
-    xml_url_base = "https://packages.vmware.com/photon/photon_oval_definitions/com.vmware.phsa-%s.xml"
-    gz_url_base = "https://packages.vmware.com/photon/photon_oval_definitions/com.vmware.phsa-%s.xml.gz"
+                self.waiting.setdefault(host, collections.deque()).append(task)
 
-    target_dirpath = os.path.join(root_path, "photon")
-    if not os.path.exists(target_dirpath):
-        os.makedirs(target_dirpath)
-
-    for release in photonReleases:
+    def run(self, host, task):
         try:
-            res = requests.get(xml_url_base % release)
+            self.fetch(*task)
+        finally:
+            with self.cond:
+                queue = self.waiting.get(host)
+                if queue:
+                    self.executor.submit(self.run, host, queue.popleft())
+                else:
+                    self.active[host] -= 1
+                self.pending -= 1
+                if self.pending == 0:
+                    self.cond.notify_all()
+
+    def record(self, url, filepath, result, **kwargs):
+        if self.metrics is not None:
+            self.metrics.record_fetch(url, filepath, result, **kwargs)
+
+    def skip(self, url, filepath):
+        # the crawler found the local copy current without requesting it
+        self.record(url, filepath, SKIPPED, size=0)
+
+    def fetch(self, url, filepath, callback, fallback, sha256, validate=None):
+        headers = {}
+        if filepath is not None and self.manifest is not None and not sha256:
+            headers = self.manifest.conditional_headers(url, filepath)
+
+        info = {"status": None, "size": 0, "retries": 0}
+        def consume(res):
+            info["status"] = res.status_code
+            info["retries"] = getattr(res, "retries", 0)
             if res.status_code == 200:
-                with open(os.path.join(target_dirpath, "com.vmware.phsa-%s.xml" % release), "wb") as f:
-                    f.write(res.content)
-            else:
-                print("ERROR: failed to download %s xml file, status code: %d" % (release, res.status_code))
-        except:
-            print("EXCEPTION: failed to download %s xml file" % release)
-        
+                if filepath is None:
+                    body = res.content
+                    info["size"] = len(body)
+                    return body
+                size, digest = save_stream(res, filepath, sha256, validate)
+                info["size"] = size
+                if self.manifest is not None:
+                    self.manifest.update(url, filepath, res, size, digest)
+                return filepath
+            if res.status_code == 304 and headers:
+                return filepath
+            print("ERROR: failed to download %s, status code: %d" % (url, res.status_code))
+            return None
+
+        error = None
+        start = time.perf_counter()
         try:
-            res= requests.get(gz_url_base % release)
-            if res.status_code == 200:
-                with open(os.path.join(target_dirpath, "com.vmware.phsa-%s.xml.gz" % release), "wb") as f:
-                    f.write(res.content)
+            body = self.client.get(url, consume, headers=headers)
+        except Exception as e:
+            print("EXCEPTION: failed to download %s" % url)
+            error = "%s: %s" % (type(e).__name__, e)
+            info["retries"] = self.client.retries
+            body = None
+        seconds = time.perf_counter() - start
+
+        if body is None:
+            result = FALLBACK if fallback else FAILED
+            self.record(url, filepath, result, status=info["status"], seconds=seconds, retries=info["retries"], error=error)
+            if fallback:
+                print("Trying backup url %s" % fallback)
+                self.submit(fallback, filepath, callback, sha256=sha256, validate=validate)
             else:
-                print("ERROR: failed to download %s xml.gz file, status code: %d" % (release, res.status_code))
-        except:
-            print("EXCEPTION: failed to download %s xml.gz file" % release)
-
-def pyupio_crawler(root_path): # not available due to GFW
-    defaultURL = "https://github.com/pyupio/safety-db/archive/master.tar.gz"
+                with self.cond:
+                    self.failures.append(url)
+            return
 
-    target_dirpath = os.path.join(root_path, "pyupio")
-    if not os.path.exists(target_dirpath):
-        os.makedirs(target_dirpath)
-
-    try:
-        res = requests.get(defaultURL)
-        if res.status_code == 200:
-            with open(os.path.join(target_dirpath, "safety-db-master.tar.gz"), "wb") as f:
-                f.write(res.content)
+        result = NOT_MODIFIED if info["status"] == 304 else DOWNLOADED
+        if callback:
+            try:
+                callback(body)
+            except Exception as e:
+                print("EXCEPTION: failed to process %s" % url)
+                result = CALLBACK_ERROR
+                error = "%s: %s" % (type(e).__name__, e)
+                with self.cond:
+                    self.failures.append(url)
+        self.record(url, filepath, result, status=info["status"], size=info["size"], seconds=seconds, retries=info["retries"], error=error)
+
+    def wait(self):
+        with self.cond:
+            while self.pending > 0:
+                self.cond.wait()
+
+    def shutdown(self):
+        self.wait()
+        self.executor.shutdown()
+        self.client.close()
+        if self.manifest is not None:
+            self.manifest.save()
+
+def scheduled(crawler):
+    # Lets every *_crawler be called on its own (it then runs and waits on a
+    # private scheduler) or share one scheduler with the other crawlers.
+    @functools.wraps(crawler)
+    def wrapper(root_path, scheduler=None):
+        if scheduler is not None:
+            return crawler(root_path, scheduler)
+        os.makedirs(root_path, exist_ok=True)
+        scheduler = FetchScheduler(manifest=FetchManifest(root_path))
+        try:
+            crawler(root_path, scheduler)
+        finally:
+            scheduler.shutdown()
+    return wrapper
+
+def on_amazon_mirror(root_path, scheduler, item):
+    # the mirror list names the repository the repodata is read from
+    def on_mirror_list(body):
+        mirror_url = body.decode("utf-8", "replace").strip()
+        if re.match(r'^https?:/{2}\w.+$', mirror_url):
+            target_dirpath = os.path.join(root_path, item["dir"])
+            scheduler.submit(mirror_url + "/repodata/updateinfo.xml.gz", os.path.join(target_dirpath, "updateinfo.xml.gz"))
+            scheduler.submit(mirror_url + "/repodata/repomd.xml", os.path.join(target_dirpath, "repomd.xml"))
         else:
-            print("ERROR: failed to download %s, status code: %d" % (defaultURL, res.status_code))
-    except:
-        print("EXCEPTION: failed to download %s" % defaultURL)
+            print("ERROR: malformed mirror url: %s" % mirror_url)
+    return on_mirror_list
 
-def rhel_crawler(root_path):
-    target_dirpath = os.path.join(root_path, "redhat")
-    if not os.path.exists(target_dirpath):
-        os.makedirs(target_dirpath)
-    
-    # default oval
-    rhelReleases = [6, 7, 8]
-    dbURL = "https://access.redhat.com/security/data/oval/com.redhat.rhsa-RHEL%d.xml"
+def on_rhel_pulp_manifest(root_path, scheduler, item):
+    # oval v2, PULP_MANIFEST lists every file with its sha256 and size
+    target_dirpath = os.path.join(root_path, os.path.dirname(item["path"]))
+    manifest_filepath = os.path.join(root_path, item["path"])
+    DefaultURL = item["url"].rsplit("/", 1)[0] + "/%s"
 
-    for release in rhelReleases:
+    previous_entries = {}
+    if os.path.exists(manifest_filepath):
         try:
-            res = requests.get(dbURL % release)
-            if res.status_code == 200:
-                with open(os.path.join(target_dirpath, "com.redhat.rhsa-RHEL%d.xml" % release), "wb") as f:
-                    f.write(res.content)
-            else:
-                print("ERROR: failed to download com.redhat.rhsa-RHEL%d.xml, status code: %d" % (release, res.status_code))
+            previous_entries = read_pulp_manifest(manifest_filepath)
         except:
-            print("EXCEPTION: failed to download com.redhat.rhsa-RHEL%d.xml" % release)
-
-    # oval v2
-    DefaultURL = "https://access.redhat.com/security/data/oval/v2/%s/%s"
-    DefaultManifest = "https://access.redhat.com/security/data/oval/v2/PULP_MANIFEST"
-
-    try:
-        res = requests.get(DefaultManifest)
-        if res.status_code == 200:
-            with open(os.path.join(target_dirpath, "PULP_MANIFEST"), "wb") as f:
-                f.write(res.content)
-
-            exist_sub_dirs = []
-            download_list = res.text.split("\n")
-
-            for item in download_list:
-                sub_dirname = item.split("/")[0]
-                sub_dirpath = os.path.join(target_dirpath, sub_dirname)
-
-                if sub_dirpath not in exist_sub_dirs:
-                    if not os.path.exists(sub_dirpath):
-                        os.makedirs(sub_dirpath)
-                        exist_sub_dirs.append(sub_dirpath)
-                
-                filename = item.split("/")[1].split(",")[0]
-
-                try:
-                    res = requests.get(DefaultURL % (sub_dirname, filename))
-                    if res.status_code == 200:
-                        with open(os.path.join(sub_dirpath, filename), "wb") as f:
-                            f.write(res.content)
-                    else:
-                        print("ERROR: failed to download %s/%s, status code: %d" % (sub_dirname, filename, res.status_code))
-                except:
-                    print("EXCEPTION: failed to download %s/%s" % (sub_dirname, filename))
-        else:
-            print("ERROR: failed to download %s, status code: %d" % (DefaultManifest, res.status_code))
-    except:
-        print("EXCEPTION: failed to download %s" % DefaultManifest)
-
-def suse_crawler(root_path): # may not be available for opensuse.leap.42.3
-    suseReleases = [
-        "suse.linux.enterprise.server.15",
-        "suse.linux.enterprise.server.12",
-        "suse.linux.enterprise.server.11",
-        "opensuse.leap.15.1",
-        "opensuse.leap.15.0",
-        "opensuse.leap.42.3"
-    ]
-
-    baseURL = "https://support.novell.com/security/oval/%s.xml"
-    bakURL = "https://ftp.suse.com/pub/projects/security/oval/%s.xml"
-
-    target_dirpath = os.path.join(root_path, "suse")
-    if not os.path.exists(target_dirpath):
-        os.makedirs(target_dirpath)
-
-    for release in suseReleases:
+            print("EXCEPTION: failed to read %s" % manifest_filepath)
+
+    def is_current(url, filepath, sha256, size):
+        if not os.path.exists(filepath) or os.path.getsize(filepath) != size:
+            return False
+        if scheduler.manifest is None:
+            return file_sha256(filepath) == sha256
+        return scheduler.manifest.cached_digest(url, filepath, "sha256", file_sha256) == sha256
+
+    def check_manifest(filepath):
+        # e.g. a maintenance page served with 200; checked before it replaces the
+        # last good manifest, which keeps every file we have
+        entries = read_pulp_manifest(filepath)
+        with open(filepath, errors="replace") as f:
+            lines = sum(1 for line in f if line.strip())
+        if not entries or len(entries) < lines:
+            raise ValueError("%s is not a valid PULP_MANIFEST, %d entries in %d lines" % (filepath, len(entries), lines))
+        return entries
+
+    def on_manifest(filepath):
         try:
-            res = requests.get(baseURL % release)
-            if res.status_code == 200:
-                with open(os.path.join(target_dirpath, "%s.xml" % release), "wb") as f:
-                    f.write(res.content)
-            elif res.status_code == 403:
-                print("Default URL is Access Forbidden, trying backup ftp server")
-                try:
-                    res = requests.get(bakURL % release)
-                    if res.status_code == 200:
-                        with open(os.path.join(target_dirpath, "%s.xml" % release), "wb") as f:
-                            f.write(res.content)
-                    else:
-                        print("ERROR: failed to download %s.xml from backup ftp server, status code: %d" % (release, res.status_code))
-                except:
-                    print("EXCEPTION: failed to download %s.xml from backup ftp server" % release)
-        except:
-            print("EXCEPTION: failed to download %s.xml" % release)
-
-def ubuntu_crawler(root_path):
-    ubuntuMatrix = { # shouldBzipFetch
-        "artful":  False,
-        "bionic":  True,
-        "cosmic":  True,
-        "disco":   True,
-        "precise": False,
-        "trusty":  True,
-        "xenial":  True,
-        "eoan":    True,
-        "focal":   True,
-        "impish":  True,
-    }
-
-    OVALTemplateBzip = "https://people.canonical.com/~ubuntu-security/oval/com.ubuntu.%s.cve.oval.xml.bz2"
-    OVALTemplate     = "https://people.canonical.com/~ubuntu-security/oval/com.ubuntu.%s.cve.oval.xml"
-
-    target_dirpath = os.path.join(root_path, "ubuntu")
-    if not os.path.exists(target_dirpath):
-        os.makedirs(target_dirpath)
-
-    for release in ubuntuMatrix.keys():
-        if ubuntuMatrix[release]:
-            try:
-                res = requests.get(OVALTemplateBzip % release)
-                if res.status_code == 200:
-                    with open(os.path.join(target_dirpath, "com.ubuntu.%s.cve.oval.xml.bz2" % release), "wb") as f:
-                        f.write(res.content)
-                else:
-                    print("ERROR: failed to download %s xml.bz2 file, status code: %d" % (release, res.status_code))
-            except:
-                print("EXCEPTION: failed to download %s xml.bz2 file" % release)
-        else:
-            try:
-                res = requests.get(OVALTemplate % release)
-                if res.status_code == 200:
-                    with open(os.path.join(target_dirpath, "com.ubuntu.%s.cve.oval.xml" % release), "wb") as f:
-                        f.write(res.content)
-                else:
-                    print("ERROR: failed to download %s xml file, status code: %d" % (release, res.status_code))
-            except:
-                print("EXCEPTION: failed to download %s xml file" % release)
-
-def cvss_crawler(root_path):
-    DefaultFeeds = "https://nvd.nist.gov/feeds/json/cve/1.1/"
-
-    target_dirpath = os.path.join(root_path, "cvss")
-    if not os.path.exists(target_dirpath):
-        os.makedirs(target_dirpath)
-
-    for year in range(2002, datetime.datetime.now().year+1):
-        metafileURL = DefaultFeeds + "nvdcve-1.1-%d.meta" % year
-        gzURL = DefaultFeeds + "nvdcve-1.1-%d.json.gz" % year
-        try:
-            res = requests.get(metafileURL)
-            if res.status_code == 200:
-                with open(os.path.join(target_dirpath, "nvdcve-1.1-%d.meta" % year), "wb") as f:
-                    f.write(res.content)
-                try:
-                    res = requests.get(gzURL)
-                    if res.status_code == 200:
-                        with open(os.path.join(target_dirpath, "nvdcve-1.1-%d.json.gz" % year), "wb") as f:
-                            f.write(res.content)
-                    else:
-                        print("ERROR: failed to download %s, status code: %d" % (gzURL, res.status_code))
-                except:
-                    print("EXCEPTION: failed to download %s" % gzURL)
+            entries = check_manifest(filepath)
+        except ValueError:
+            # a bad manifest answered with 304: download it in full next run
+            if scheduler.manifest is not None:
+                scheduler.manifest.forget(item["url"])
+            raise
+
+        # largest first
+        for entry, (sha256, size) in sorted(entries.items(), key=lambda entry: -entry[1][1]):
+            url = DefaultURL % entry
+            entry_filepath = os.path.join(target_dirpath, entry)
+            if is_current(url, entry_filepath, sha256, size):
+                scheduler.skip(url, entry_filepath)
             else:
-                print("ERROR: failed to download %s, status code: %d" % (metafileURL, res.status_code))
-        except:
-            print("EXCEPTION: failed to download %s" % metafileURL)
+                scheduler.submit(url, entry_filepath, sha256=sha256)
+
+        # drop files that are no longer listed
+        stale = set(previous_entries)
+        for sub_dirname in set(entry.split("/")[0] for entry in entries):
+            sub_dirpath = os.path.join(target_dirpath, sub_dirname)
+            if os.path.isdir(sub_dirpath):
+                stale.update(sub_dirname + "/" + name for name in os.listdir(sub_dirpath) if not name.startswith("."))
+        for entry in sorted(stale - set(entries)):
+            entry_filepath = os.path.join(target_dirpath, entry)
+            if os.path.isfile(entry_filepath):
+                print("Removing %s, no longer in PULP_MANIFEST" % entry_filepath)
+                os.unlink(entry_filepath)
+            if scheduler.manifest is not None:
+                scheduler.manifest.forget(DefaultURL % entry)
+
+    on_manifest.validate = check_manifest
+    return on_manifest
+
+def on_nvd_meta(root_path, scheduler, item):
+    # the feed is only downloaded when the .meta says it changed
+    gzURL = feed_name(item["url"])
+    gz_filepath = os.path.join(root_path, feed_name(item["path"]))
+
+    def content_sha256(gz_filepath, compute=gunzip_sha256):
+        # the .meta sha256 is taken over the uncompressed JSON
+        if scheduler.manifest is None:
+            return compute(gz_filepath)
+        return scheduler.manifest.cached_digest(gzURL, gz_filepath, "content_sha256", compute)
+
+    def check_feed(meta, checked, tmp_filepath):
+        # runs before the download replaces the previous feed, which is kept on a mismatch
+        # (e.g. the feed was republished between the .meta and .json.gz requests)
+        digest = gunzip_sha256(tmp_filepath)
+        if digest != meta["sha256"]:
+            raise ValueError("sha256 of %s does not match its meta file" % gzURL)
+        checked.append(digest)
+
+    def on_feed(meta, checked, gz_filepath):
+        # a fresh download was checked already; a 304 keeps a feed the .meta says changed
+        compute = (lambda filepath: checked.pop()) if checked else gunzip_sha256
+        if content_sha256(gz_filepath, compute) != meta["sha256"]:
+            # no validators next run, the feed is downloaded in full
+            if scheduler.manifest is not None:
+                scheduler.manifest.forget(gzURL)
+            raise ValueError("sha256 of %s does not match its meta file" % gzURL)
+
+    def on_meta(meta_filepath):
+        meta = read_nvd_meta(meta_filepath)
+        if os.path.exists(gz_filepath) and str(os.path.getsize(gz_filepath)) == meta.get("gzSize"):
+            if content_sha256(gz_filepath) == meta["sha256"]:
+                scheduler.skip(gzURL, gz_filepath)
+                return
+        checked = []
+        scheduler.submit(gzURL, gz_filepath, functools.partial(on_feed, meta, checked), validate=functools.partial(check_feed, meta, checked))
+
+    return on_meta
+
+# handlers named by "then" in sources.json, called with the plan item before
+# it is submitted; they return the callback that submits what the file leads to
+HANDLERS = {
+    "amazon_mirror": on_amazon_mirror,
+    "rhel_pulp": on_rhel_pulp_manifest,
+    "nvd_meta": on_nvd_meta
+}
+
+def crawl(root_path, scheduler, names=None, registry=None, entries=None):
+    # Submits the fetch plan of the named sources (all by default), largest
+    # first, sized from entries or else the scheduler's fetch manifest.
+    if entries is None:
+        entries = {}
+        if scheduler.manifest is not None:
+            with scheduler.manifest.lock:
+                entries = dict(scheduler.manifest.entries)
+    for item in fetch_plan(root_path, names, registry, entries):
+        callback = HANDLERS[item["then"]](root_path, scheduler, item) if item["then"] else None
+        filepath = os.path.join(root_path, item["path"]) if item["path"] else None
+        # a handler may check the downloaded file before it replaces the previous one
+        validate = getattr(callback, "validate", None)
+        scheduler.submit(item["url"], filepath, callback, fallback=item["fallback"], validate=validate)
+
+def source_crawler(name):
+    # <name>_crawler(root_path, scheduler=None) running one source of the registry
+    def crawler(root_path, scheduler):
+        crawl(root_path, scheduler, [name])
+    crawler.__name__ = name + "_crawler"
+    return scheduled(crawler)
+
+alpine_crawler = source_crawler("alpine")
+amazon_crawler = source_crawler("amazon")
+debian_crawler = source_crawler("debian")
+oracle_crawler = source_crawler("oracle")
+photon_crawler = source_crawler("photon")
+pyupio_crawler = source_crawler("pyupio")
+rhel_crawler = source_crawler("rhel")
+suse_crawler = source_crawler("suse")
+ubuntu_crawler = source_crawler("ubuntu")
+cvss_crawler = source_crawler("cvss")
+
+def finish_crawl(root_path, metrics, index=False, changes_dirpath=None, snapshot_dirpath=None, keep=7):
+    # the --index, --changes and --snapshot steps after the downloads, each in its own stage
+    if index:
+        with metrics.stage("index") as stage:
+            stage["files"] = VulnIndex(os.path.join(root_path, "vuln-index.sqlite")).build(root_path)
+        print("%d files indexed" % stage["files"])
+
+    if changes_dirpath:
+        with metrics.stage("changes") as stage:
+            summary = change_feed.run(root_path, changes_dirpath)
+            for name, counts in sorted(summary.items()):
+                print("%s: %d added, %d modified, %d withdrawn" % (name, counts[change_feed.ADDED], counts[change_feed.MODIFIED], counts[change_feed.WITHDRAWN]))
+            stage["sources"] = len(summary)
+
+    if snapshot_dirpath:
+        # failed downloads keep their previous file, so the snapshot is still whole
+        store = SnapshotStore(snapshot_dirpath)
+        with metrics.stage("snapshot") as stage:
+            stage["snapshot"], stage["files"], stage["objects"] = store.publish(root_path)
+            removed, stage["pruned_objects"] = store.prune(keep)
+            stage["pruned"] = len(removed)
+        print("snapshot %(snapshot)s: %(files)d files, %(objects)d new objects, %(pruned)d snapshots pruned" % stage)
 
 if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser(prog='PROG', description='Generate alpine/amazon/debian/oracle/photon/pyupio/rhel/suse/ubuntu/cvss vuln database.')
     arg_parser.add_argument('-o', metavar='<DATABASE DIR>', required=True, help='Specify the directory to store vuln database. (e.g. /home/user/secdb/)')
+    arg_parser.add_argument('-j', metavar='<WORKERS>', type=int, default=16, help='Number of concurrent downloads. (default. 16)')
+    arg_parser.add_argument('--per-host', metavar='<CONNECTIONS>', type=int, default=4, help='Maximum concurrent downloads from one host. (default. 4)')
+    arg_parser.add_argument('--full', action='store_true', help='Ignore the fetch manifest and download every file again.')
+    arg_parser.add_argument('--sources', metavar='<REGISTRY FILE>', help='Source registry. (default. sources.json next to this script)')
+    arg_parser.add_argument('--only', metavar='<SOURCE>', action='append', help='Source to crawl, may be repeated. (e.g. rhel, default. all)')
+    arg_parser.add_argument('--exclude', metavar='<SOURCE>', action='append', help='Source to leave out, may be repeated.')
+    arg_parser.add_argument('--dry-run', action='store_true', help='Print the fetch plan, largest downloads first, without downloading.')
+    arg_parser.add_argument('--timeout', metavar='<SECONDS>', type=float, default=60, help='Read timeout of a single request. (default. 60)')
+    arg_parser.add_argument('--retries', metavar='<COUNT>', type=int, default=5, help='Retries on 429/5xx and connection resets. (default. 5)')
+    arg_parser.add_argument('--rate', metavar='<HOST=RPS>', type=host_rate, action='append', default=[], help='Requests per second allowed to a host, may be repeated. (e.g. nvd.nist.gov=2)')
+    arg_parser.add_argument('--index', action='store_true', help='Refresh <DATABASE DIR>/vuln-index.sqlite from the changed files after downloading.')
+    arg_parser.add_argument('--snapshot', metavar='<STORE DIR>', help='Publish the downloaded files as a new snapshot of this store after the run, see snapshot_store.py.')
+    arg_parser.add_argument('--keep', metavar='<N>', type=int, default=7, help='Snapshots kept in the store by --snapshot. (default. 7)')
+    arg_parser.add_argument('--changes', metavar='<CHANGES DIR>', help='Write the advisories added, modified or withdrawn by the run to this directory, see change_feed.py.')
+    arg_parser.add_argument('--report', metavar='<REPORT FILE>', help='JSON report of every download of the run. (default. <DATABASE DIR>/.crawl-report.json)')
+    arg_parser.add_argument('--prom', metavar='<TEXTFILE>', help='Also write the run metrics for the node_exporter textfile collector. (e.g. /var/lib/node_exporter/secdb_crawl.prom)')
     args = arg_parser.parse_args()
     root_path = args.o
-    
-    alpine_crawler(root_path)
-    amazon_crawler(root_path)
-    debian_crawler(root_path)
-    oracle_crawler(root_path)
-    photon_crawler(root_path)
-    pyupio_crawler(root_path)
-    rhel_crawler(root_path)
-    suse_crawler(root_path)
-    ubuntu_crawler(root_path)
-    cvss_crawler(root_path)
-    
\ No newline at end of file
+    registry = load_registry(args.sources)
+    try:
+        names = select(registry, args.only, args.exclude)
+    except KeyError as e:
+        arg_parser.error("unknown source %s, known: %s" % (e, ", ".join(registry)))
+    if args.dry_run:
+        print_plan(fetch_plan(root_path, names, registry))
+        sys.exit(0)
+    if not os.path.exists(root_path):
+        os.makedirs(root_path)
+
+    manifest = FetchManifest(root_path)
+    # the sizes of the previous run still order a --full run
+    entries = dict(manifest.entries)
+    if args.full:
+        manifest.clear()
+    client = HttpClient(timeout=(10, args.timeout), retries=args.retries, host_rates=dict(args.rate), pool_size=args.per_host)
+    metrics = RunMetrics("crawler", root_path)
+    scheduler = FetchScheduler(args.j, args.per_host, manifest, client, metrics)
+
+    with metrics.stage("crawl") as stage:
+        crawl(root_path, scheduler, names, registry, entries)
+
+        scheduler.shutdown()
+        stage["failures"] = len(scheduler.failures)
+
+    finish_crawl(root_path, metrics, args.index, args.changes, args.snapshot, args.keep)
+
+    metrics.finish()
+    metrics.write_report(args.report if args.report else os.path.join(root_path, ".crawl-report.json"))
+    if args.prom:
+        metrics.write_prometheus(args.prom)
+
+    if scheduler.failures:
+        print("%d downloads failed:" % len(scheduler.failures))
+        for url in sorted(scheduler.failures):
+            print("  %s" % url)
+        sys.exit(1)
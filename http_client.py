@@ -0,0 +1,127 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/python3
+
+import time, random, threading, requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# requests per second, hosts that throttle us under load
+HOST_RATES = {
+    "nvd.nist.gov": 2.0,
+    "access.redhat.com": 5.0,
+}
+
+def host_rate(item):
+    # "<host>=<requests per second>" of a --rate option, as an argparse type
+    host, sep, rate = item.partition("=")
+    if not host or not sep or not float(rate) > 0:
+        raise ValueError("expected <HOST=RPS> with a positive rate, got %s" % item)
+    return host, float(rate)
+
+class TransferError(IOError):
+    # The body was received but is unusable (truncated, wrong checksum); retried like a reset.
+    pass
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst else max(1.0, rate))
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+class HttpClient(object):
+    # One client shared by all crawlers: a pooled keep-alive session per host,
+    # timeouts, exponential backoff with jitter and a token bucket per host.
+    def __init__(self, timeout=(10, 60), retries=5, backoff=1.0, max_backoff=60.0, rate=None, host_rates=None, pool_size=8, rewrite=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate = rate
+        self.host_rates = dict(HOST_RATES)
+        if host_rates:
+            self.host_rates.update(host_rates)
+        self.pool_size = pool_size
+        self.rewrite = rewrite      # url -> url actually requested, e.g. a local stand-in server
+        self.sessions = {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def session(self, host):
+        with self.lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self.sessions[host] = session
+            return self.sessions[host]
+
+    def bucket(self, host):
+        with self.lock:
+            if host not in self.buckets:
+                rate = self.host_rates.get(host, self.rate)
+                self.buckets[host] = TokenBucket(rate) if rate else None
+            return self.buckets[host]
+
+    def delay(self, attempt, res=None):
+        if res is not None and res.headers.get("Retry-After", "").isdigit():
+            return min(self.max_backoff, float(res.headers["Retry-After"]))
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def get(self, url, consume=None, **kwargs):
+        # Without consume the (streamed) response is returned. With consume the
+        # body is handed to consume(res) inside the retry loop, so a connection
+        # reset halfway through the body is retried too, and its result returned.
+        # Either way the number of retries spent is left in res.retries.
+        host = urlparse(url).netloc
+        session = self.session(host)
+        bucket = self.bucket(host)
+        kwargs.setdefault("timeout", self.timeout)
+        if self.rewrite is not None:
+            url = self.rewrite(url)
+
+        attempt = 0
+        while True:
+            if bucket is not None:
+                bucket.acquire()
+            res = None
+            try:
+                res = session.get(url, stream=True, **kwargs)
+                res.retries = attempt
+                if res.status_code in RETRY_STATUS and attempt < self.retries:
+                    res.close()
+                    time.sleep(self.delay(attempt, res))
+                    attempt += 1
+                    continue
+                if consume is None:
+                    return res
+                with res:
+                    return consume(res)
+            except (requests.exceptions.RequestException, TransferError) as e:
+                if attempt >= self.retries:
+                    raise
+                print("Retrying %s after error: %s" % (url, e))
+                time.sleep(self.delay(attempt))
+                attempt += 1
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
@@ -0,0 +1,170 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/python3
+
+import os, json, gzip, sqlite3, functools, jsonpath, argparse
+from pathlib import Path
+
+def nvd_fields(jsondata):
+    # (severity, cpe23Uri list) of one NVD CVE item, cpe23Uri is False when there is none
+    if "baseMetricV3" in jsondata["impact"]:
+        severity = jsondata["impact"]["baseMetricV3"]["cvssV3"]["baseSeverity"]
+    elif "baseMetricV2" in jsondata["impact"]:
+        severity = jsondata["impact"]["baseMetricV2"]["severity"]
+    else:
+        severity = "None"
+    cpe23Uri = jsonpath.jsonpath(jsondata["configurations"], '$..cpe23Uri')
+    return severity, cpe23Uri
+
+def iter_feed_items(filepath, chunk_size=1024 * 1024):
+    # Yields the CVE_Items of an nvdcve-1.1-*.json.gz feed one at a time,
+    # decoding the gzip stream incrementally instead of json.load()ing it.
+    decoder = json.JSONDecoder()
+    with gzip.open(filepath, "rt", encoding="utf-8") as f:
+        buf = ""
+        while True:
+            chunk = f.read(chunk_size)
+            buf += chunk
+            start = buf.find('"CVE_Items"')
+            if start >= 0 and buf.find("[", start) >= 0:
+                buf = buf[buf.find("[", start) + 1:]
+                break
+            if not chunk:
+                return
+
+        pos = 0
+        eof = False
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                if pos == len(buf):
+                    raise ValueError("need more data")
+                item, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            yield item
+
+class NvdJsonTree(object):
+    # Reads nvd/<year>/<CVE>.json from a vuln-list checkout on every lookup.
+    def __init__(self, nvd_dirpath):
+        self.nvd_json_filepath = Path(nvd_dirpath).joinpath("nvd/%s/%s.json")
+
+    def lookup(self, cve):
+        vulnyear = cve.split("-")[1].strip()
+        filepath = Path(str(self.nvd_json_filepath) % (vulnyear, cve))
+        if not filepath.exists():
+            return None
+        with open(filepath) as f:
+            return nvd_fields(json.load(f))
+
+class NvdIndex(object):
+    # SQLite store of CVE id -> (severity, cpe23Uri list) built from the NVD
+    # tree once and refreshed from the files whose size or mtime changed.
+    def __init__(self, index_filepath, cache_size=65536):
+        self.index_filepath = str(index_filepath)
+        self.conn = None
+        self.pid = None
+        self.lookup = functools.lru_cache(maxsize=cache_size)(self.query)
+
+    def __getstate__(self):
+        # workers reopen the index themselves
+        return {"index_filepath": self.index_filepath, "cache_size": self.lookup.cache_info().maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(state["index_filepath"], state["cache_size"])
+
+    def connect(self):
+        # one connection per process, the index is shared by forked workers
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.index_filepath)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime REAL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS cves (id TEXT PRIMARY KEY, severity TEXT, cpes TEXT, source TEXT)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS cves_source ON cves (source)")
+            self.pid = os.getpid()
+        return self.conn
+
+    def query(self, cve):
+        row = self.connect().execute("SELECT severity, cpes FROM cves WHERE id = ?", (cve,)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1].split("\n") if row[1] else False
+
+    def store(self, conn, cve, severity, cpe23Uri, source):
+        cpes = "\n".join(cpe23Uri) if isinstance(cpe23Uri, list) else ""
+        conn.execute("INSERT OR REPLACE INTO cves VALUES (?, ?, ?, ?)", (cve, severity, cpes, source))
+
+    def sync_files(self, filepaths, load):
+        # Calls load(conn, filepath) for every new or changed file and drops
+        # the records of files that disappeared. Returns the number reloaded.
+        conn = self.connect()
+        known = dict((row[0], (row[1], row[2])) for row in conn.execute("SELECT path, size, mtime FROM files"))
+        # A file that fails to load keeps its previous records: each file is
+        # reloaded under a savepoint of the one transaction of the sync.
+        changed = 0
+        with conn:
+            conn.execute("BEGIN")
+            for filepath in filepaths:
+                stat = os.stat(filepath)
+                state = (stat.st_size, stat.st_mtime)
+                if known.pop(filepath, None) == state:
+                    continue
+                conn.execute("SAVEPOINT load_file")
+                try:
+                    conn.execute("DELETE FROM cves WHERE source = ?", (filepath,))
+                    load(conn, filepath)
+                    conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (filepath, state[0], state[1]))
+                except:
+                    print("EXCEPTION: failed to index %s" % filepath)
+                    conn.execute("ROLLBACK TO load_file")
+                    conn.execute("RELEASE load_file")
+                    continue
+                conn.execute("RELEASE load_file")
+                changed += 1
+            for filepath in known:
+                conn.execute("DELETE FROM cves WHERE source = ?", (filepath,))
+                conn.execute("DELETE FROM files WHERE path = ?", (filepath,))
+        self.lookup.cache_clear()
+        return changed
+
+    def build(self, nvd_dirpath):
+        # nvd/<year>/<CVE>.json from a vuln-list checkout
+        def load(conn, filepath):
+            with open(filepath) as f:
+                severity, cpe23Uri = nvd_fields(json.load(f))
+            self.store(conn, Path(filepath).stem, severity, cpe23Uri, filepath)
+
+        filepaths = sorted(str(p) for p in Path(nvd_dirpath).joinpath("nvd").glob("*/*.json"))
+        return self.sync_files(filepaths, load)
+
+    def build_from_feeds(self, feed_dirpath):
+        # nvdcve-1.1-<year>.json.gz as downloaded by crawler.py's cvss_crawler,
+        # the "modified" feed only repeats entries of the yearly ones
+        def load(conn, filepath):
+            for item in iter_feed_items(filepath):
+                severity, cpe23Uri = nvd_fields(item)
+                self.store(conn, item["cve"]["CVE_data_meta"]["ID"], severity, cpe23Uri, filepath)
+
+        filepaths = sorted(str(p) for p in Path(feed_dirpath).glob("nvdcve-1.1-[0-9]*.json.gz"))
+        return self.sync_files(filepaths, load)
+
+if ( __name__ == "__main__"):
+    arg_parser = argparse.ArgumentParser(prog='PROG', description='Build or refresh the NVD lookup index used by cnvd_xml_handler.py.')
+    nvd_group = arg_parser.add_mutually_exclusive_group(required=True)
+    nvd_group.add_argument('-n', metavar='<NVD JSON DIR>', help='Specify the directory including NVD info. (e.g. /home/user/vuln-list-main/)')
+    nvd_group.add_argument('-f', metavar='<NVD FEED DIR>', help='Specify the directory including the NVD JSON feeds. (e.g. /home/user/secdb/cvss/)')
+    arg_parser.add_argument('-i', metavar='<INDEX FILE>', required=True, help='Specify the index file. (e.g. /home/user/secdb/cnvd/nvd-index.sqlite)')
+    args = arg_parser.parse_args()
+
+    if args.f:
+        changed = NvdIndex(args.i).build_from_feeds(args.f)
+    else:
+        changed = NvdIndex(args.i).build(args.n)
+    print("%d NVD files indexed" % changed)
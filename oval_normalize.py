@@ -0,0 +1,141 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/python3
+
+import os, sys, json, argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from oval_parser import oval_files, iter_definitions
+from run_metrics import RunMetrics
+from snapshot_store import file_sha256
+
+def output_name(root_path, filepath):
+    # redhat/RHEL8/rhel-8.oval.xml.bz2 -> RHEL8-rhel-8.oval.jsonl
+    relpath = Path(filepath).relative_to(root_path)
+    name = "-".join(relpath.parts[1:])
+    for suffix in (".bz2", ".gz", ".xml"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name + ".jsonl"
+
+def normalize_file(distro, release, filepath, output_filepath, source):
+    # One JSON line per (advisory, package, fixed version) of an OVAL file,
+    # written next to output_filepath and renamed into place. Returns the
+    # number of lines.
+    tmp_filepath = str(output_filepath) + ".part"
+    records = 0
+    try:
+        with open(tmp_filepath, "w") as f:
+            for definition in iter_definitions(filepath, release):
+                seen = set()
+                for package in definition["packages"]:
+                    key = (package["release"], package["name"], package["fixed_version"])
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    record = {
+                        "distro": distro,
+                        "release": package["release"],
+                        "advisory": definition["advisory"],
+                        "package": package["name"],
+                        "fixed_version": package["fixed_version"],
+                        "cves": definition["cves"],
+                        "severity": definition["severity"],
+                        "title": definition["title"],
+                        "class": definition["class"],
+                        "source": source
+                    }
+                    f.write(json.dumps(record, ensure_ascii=False))
+                    f.write("\n")
+                    records += 1
+    except:
+        os.unlink(tmp_filepath)
+        raise
+    os.replace(tmp_filepath, output_filepath)
+    return records
+
+def normalize(root_path, output_dirpath, jobs=1):
+    # Converts every OVAL file under root_path into <output>/<distro>/<name>.jsonl
+    # on a process pool, largest files first. oval-state.json keeps the size,
+    # mtime and sha256 of each input, files whose content did not change are
+    # skipped. Outputs of inputs that disappeared are removed, a file that
+    # fails to parse keeps its previous output.
+    root_path = Path(root_path)
+    output_dirpath = Path(output_dirpath)
+    state_filepath = output_dirpath.joinpath("oval-state.json")
+    state = {}
+    if state_filepath.exists():
+        with open(state_filepath) as f:
+            state = json.load(f)
+
+    files = {}
+    tasks = []
+    skipped = 0
+    for distro, release, filepath in oval_files(root_path):
+        source = filepath.relative_to(root_path).as_posix()
+        output_filepath = output_dirpath.joinpath(distro, output_name(root_path, filepath))
+        stat = os.stat(filepath)
+        previous = state.get(source)
+        entry = {"size": stat.st_size, "mtime": stat.st_mtime, "output": output_filepath.relative_to(output_dirpath).as_posix()}
+        if previous and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+            entry["sha256"] = previous["sha256"]
+        else:
+            entry["sha256"] = file_sha256(filepath)
+        if previous and previous["sha256"] == entry["sha256"] and previous["output"] == entry["output"] and output_filepath.exists():
+            entry["records"] = previous["records"]
+            skipped += 1
+        else:
+            tasks.append((stat.st_size, distro, release, filepath, output_filepath, source))
+        files[source] = entry
+
+    tasks.sort(key=lambda task: task[0], reverse=True)
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = []
+        for size, distro, release, filepath, output_filepath, source in tasks:
+            output_filepath.parent.mkdir(parents=True, exist_ok=True)
+            futures.append((source, executor.submit(normalize_file, distro, release, filepath, output_filepath, source)))
+        for source, future in futures:
+            try:
+                files[source]["records"] = future.result()
+            except:
+                print("EXCEPTION: failed to normalize %s" % source)
+                if state.get(source) and output_dirpath.joinpath(state[source]["output"]).exists():
+                    files[source] = state[source]
+                else:
+                    files.pop(source)
+                failed += 1
+
+    # outputs of inputs that are gone
+    current = set(entry["output"] for entry in files.values())
+    for source, entry in state.items():
+        if source not in files and entry["output"] not in current and output_dirpath.joinpath(entry["output"]).exists():
+            output_dirpath.joinpath(entry["output"]).unlink()
+
+    tmp_filepath = output_dirpath.joinpath(".oval-state.json.part")
+    with open(tmp_filepath, "w") as f:
+        json.dump(files, f, indent=1, sort_keys=True)
+    os.replace(tmp_filepath, state_filepath)
+
+    return {"converted": len(tasks) - failed, "skipped": skipped, "failed": failed, "records": sum(entry["records"] for entry in files.values())}
+
+if ( __name__ == "__main__"):
+    arg_parser = argparse.ArgumentParser(prog='PROG', description='Normalize the OVAL files downloaded by crawler.py into one JSON line per (advisory, package, fixed version).')
+    arg_parser.add_argument('-d', metavar='<DATABASE DIR>', required=True, help='Specify the directory crawler.py stores the vuln database in. (e.g. /home/user/secdb/)')
+    arg_parser.add_argument('-o', metavar='<OUTPUT DIR>', required=True, help='Specify the directory to store the JSONL files. (e.g. /home/user/secdb-oval/)')
+    arg_parser.add_argument('--jobs', metavar='<N>', type=int, default=os.cpu_count(), help='Number of processes parsing OVAL files in parallel. (default. number of CPUs)')
+    arg_parser.add_argument('--report', metavar='<REPORT FILE>', help='JSON report of the run. (default. <OUTPUT DIR>/.oval-report.json)')
+    arg_parser.add_argument('--prom', metavar='<TEXTFILE>', help='Also write the run metrics for the node_exporter textfile collector.')
+    args = arg_parser.parse_args()
+
+    Path(args.o).mkdir(parents=True, exist_ok=True)
+    metrics = RunMetrics("oval")
+    with metrics.stage("normalize") as stage:
+        stage.update(normalize(args.d, args.o, args.jobs))
+    print("%(converted)d OVAL files normalized, %(skipped)d unchanged, %(records)d records" % stage)
+
+    metrics.finish()
+    metrics.write_report(args.report if args.report else Path(args.o).joinpath(".oval-report.json"))
+    if args.prom:
+        metrics.write_prometheus(args.prom)
+    if stage["failed"]:
+        sys.exit(1)
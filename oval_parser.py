@@ -0,0 +1,214 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/python3
+
+import re, bz2, gzip, json, argparse
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+# distro, files under the database root written by crawler.py, release taken from the path
+OVAL_FILES = [
+    ("debian", "debian/oval-definitions-*.xml", r"oval-definitions-(\w+)\.xml$"),
+    ("ubuntu", "ubuntu/com.ubuntu.*.cve.oval.xml*", r"com\.ubuntu\.(\w+)\.cve\."),
+    ("oracle", "oracle/com.oracle.elsa-all.xml.bz2", None),     # the yearly files repeat elsa-all
+    ("photon", "photon/com.vmware.phsa-*.xml", r"phsa-photon(\d+)\.xml$"),
+    ("redhat", "redhat/com.redhat.rhsa-RHEL*.xml", r"RHEL(\d+)\.xml$"),
+    ("redhat", "redhat/RHEL*/*.oval.xml.bz2", r"RHEL(\d+)/"),
+    ("suse", "suse/*.xml", r"suse/(.+)\.xml$"),
+]
+
+# criterion comments marking the release of the criteria around them, for files covering several
+RELEASE_COMMENT = re.compile(r"^(?:Oracle Linux|Red Hat Enterprise Linux)\s+(\d+)\s+is installed$")
+# package criterion comments, used when the test cannot be resolved
+EARLIER_COMMENT = re.compile(r"^(\S+) (?:DPKG )?is earlier than (\S+)$")
+UBUNTU_FIXED_COMMENT = re.compile(r"^(\S+) package in \S+ (?:was vulnerable but )?has been fixed \(note: '([^']+)'\)")
+UBUNTU_AFFECTED_COMMENT = re.compile(r"^(\S+) package in \S+ is affected and (?:may need|needs) fixing")
+
+def open_source(filepath):
+    # decompressing reader for .bz2/.gz downloads, plain file otherwise
+    filepath = str(filepath)
+    if filepath.endswith(".bz2"):
+        return bz2.open(filepath, "rb")
+    if filepath.endswith(".gz"):
+        return gzip.open(filepath, "rb")
+    return open(filepath, "rb")
+
+def oval_files(root_path):
+    # (distro, release, filepath) of every OVAL file found under root_path
+    root_path = Path(root_path)
+    files = []
+    for distro, pattern, release_pattern in OVAL_FILES:
+        for filepath in sorted(root_path.glob(pattern)):
+            release = None
+            if release_pattern:
+                match = re.search(release_pattern, filepath.relative_to(root_path).as_posix())
+                if match is None:
+                    continue
+                release = match.group(1)
+            files.append((distro, release, filepath))
+    return files
+
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+def child(element, name):
+    for item in element:
+        if local_name(item.tag) == name:
+            return item
+    return None
+
+def read_tests(filepath):
+    # First pass: the tests, objects, states and constant variables that the
+    # definitions refer to. They are small next to the definitions, which are
+    # skipped and dropped as they stream by.
+    tests = {}
+    objects = {}
+    states = {}
+    variables = {}
+    with open_source(filepath) as f:
+        stack = []
+        for event, element in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                stack.append(element)
+                continue
+            stack.pop()
+            if len(stack) != 2:
+                continue
+            # a direct child of <definitions>, <tests>, <objects>, <states> or <variables>
+            name = local_name(element.tag)
+            if local_name(stack[-1].tag) in ("tests", "objects", "states", "variables"):
+                if name.endswith("_test"):
+                    object_item = child(element, "object")
+                    state_item = child(element, "state")
+                    tests[element.get("id")] = (
+                        object_item.get("object_ref") if object_item is not None else None,
+                        state_item.get("state_ref") if state_item is not None else None
+                    )
+                elif name.endswith("_object"):
+                    name_item = child(element, "name")
+                    if name_item is not None:
+                        objects[element.get("id")] = (name_item.text, name_item.get("var_ref"))
+                elif name.endswith("_state"):
+                    version_item = child(element, "evr")
+                    if version_item is None:
+                        version_item = child(element, "version")
+                    if version_item is not None:
+                        states[element.get("id")] = (version_item.get("operation"), version_item.text)
+                elif name == "constant_variable":
+                    variables[element.get("id")] = [item.text for item in element if local_name(item.tag) == "value"]
+            stack[-1].remove(element)
+
+    resolved = {}
+    for test_id, (object_ref, state_ref) in tests.items():
+        if object_ref not in objects:
+            continue
+        package, var_ref = objects[object_ref]
+        names = variables.get(var_ref, []) if var_ref else [package]
+        operation, version = states.get(state_ref, (None, None))
+        resolved[test_id] = (names, operation, version)
+    return resolved
+
+def criterion_packages(criterion, tests):
+    # [(name, fixed_version)] of one criterion, fixed_version None when no fix is known
+    resolved = tests.get(criterion.get("test_ref"))
+    if resolved is not None:
+        names, operation, version = resolved
+        if operation == "less than" and version:
+            return [(name, version) for name in names if name]
+    comment = criterion.get("comment") or ""
+    match = EARLIER_COMMENT.match(comment) or UBUNTU_FIXED_COMMENT.match(comment)
+    if match:
+        return [(match.group(1), match.group(2))]
+    match = UBUNTU_AFFECTED_COMMENT.match(comment)
+    if match:
+        return [(match.group(1), None)]
+    return []
+
+def walk_criteria(criteria, tests, release, packages):
+    # criteria holding an "<OS> N is installed" criterion apply to that release
+    for item in criteria:
+        if local_name(item.tag) == "criterion":
+            match = RELEASE_COMMENT.match(item.get("comment") or "")
+            if match:
+                release = match.group(1)
+    for item in criteria:
+        name = local_name(item.tag)
+        if name == "criteria":
+            walk_criteria(item, tests, release, packages)
+        elif name == "criterion":
+            for package, fixed_version in criterion_packages(item, tests):
+                packages.append({"name": package, "fixed_version": fixed_version, "release": release})
+
+def definition_record(element, tests, release):
+    metadata = child(element, "metadata")
+    title = ""
+    severity = ""
+    references = []
+    cves = []
+    if metadata is not None:
+        title_item = child(metadata, "title")
+        title = (title_item.text or "").strip() if title_item is not None else ""
+        for item in metadata:
+            if local_name(item.tag) == "reference":
+                references.append((item.get("source"), item.get("ref_id")))
+                if item.get("source") == "CVE":
+                    cves.append(item.get("ref_id"))
+        advisory = child(metadata, "advisory")
+        if advisory is not None:
+            severity_item = child(advisory, "severity")
+            if severity_item is not None and severity_item.text:
+                severity = severity_item.text.strip()
+            for item in advisory:
+                if local_name(item.tag) == "cve":
+                    cve = (item.text or "").strip() or item.get("ref_id") or ""
+                    if cve.startswith("CVE-"):
+                        cves.append(cve)
+
+    # the vendor advisory (RHSA, ELSA, PHSA, ...) names the definition, else its first CVE
+    name = element.get("id")
+    for source, ref_id in references:
+        if source != "CVE" and ref_id:
+            name = ref_id
+            break
+    else:
+        if cves:
+            name = cves[0]
+
+    packages = []
+    criteria = child(element, "criteria")
+    if criteria is not None:
+        walk_criteria(criteria, tests, release, packages)
+
+    return {
+        "id": element.get("id"),
+        "class": element.get("class"),
+        "advisory": name,
+        "title": title,
+        "severity": severity,
+        "cves": list(dict.fromkeys(cves)),
+        "packages": packages
+    }
+
+def iter_definitions(filepath, release=None):
+    # Streams the <definition>s of an OVAL file (plain, .gz or .bz2) as dicts,
+    # clearing each one once read so memory stays bounded by the largest one.
+    tests = read_tests(filepath)
+    with open_source(filepath) as f:
+        stack = []
+        for event, element in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                stack.append(element)
+                continue
+            stack.pop()
+            if len(stack) == 2:
+                if local_name(element.tag) == "definition":
+                    yield definition_record(element, tests, release)
+                stack[-1].remove(element)
+
+if ( __name__ == "__main__"):
+    arg_parser = argparse.ArgumentParser(prog='PROG', description='Print the definitions of an OVAL file downloaded by crawler.py as JSON lines.')
+    arg_parser.add_argument('-x', metavar='<OVAL FILE>', required=True, help='Specify the OVAL file, plain, .gz or .bz2. (e.g. /home/user/secdb/redhat/com.redhat.rhsa-RHEL8.xml)')
+    arg_parser.add_argument('-r', metavar='<RELEASE>', help='Release the definitions apply to when the file does not name it.')
+    args = arg_parser.parse_args()
+
+    for record in iter_definitions(args.x, args.r):
+        print(json.dumps(record, ensure_ascii=False))
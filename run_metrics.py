@@ -0,0 +1,161 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/python3
+
+import os, time, json, tempfile, threading, contextlib, collections
+from urllib.parse import urlparse
+
+# fetch results
+DOWNLOADED = "downloaded"
+NOT_MODIFIED = "not_modified"       # 304 on a conditional request
+SKIPPED = "skipped"                 # not requested, the local copy matches a manifest/meta checksum
+FAILED = "failed"
+FALLBACK = "fallback"               # failed, the backup URL was tried instead
+CALLBACK_ERROR = "callback_error"   # downloaded but could not be processed
+
+def write_atomic(filepath, data):
+    dirpath = os.path.dirname(os.path.abspath(filepath))
+    fd, tmp_filepath = tempfile.mkstemp(prefix="." + os.path.basename(filepath) + ".", suffix=".part", dir=dirpath)
+    with os.fdopen(fd, "w") as f:
+        f.write(data)
+    os.chmod(tmp_filepath, 0o644)
+    os.replace(tmp_filepath, filepath)
+
+def label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+class RunMetrics(object):
+    # Measurements of one crawler.py / cnvd_xml_handler.py run: one entry per
+    # download, timed stages with their record counts, and free counters.
+    # Thread safe, the fetch scheduler records from its worker threads.
+    def __init__(self, job, root_path=None):
+        self.job = job
+        self.root_path = root_path
+        self.started = time.time()
+        self.finished = None
+        self.fetches = []
+        self.stages = []
+        self.counters = collections.Counter()
+        self.lock = threading.Lock()
+
+    def source(self, url, filepath=None):
+        # top level directory under the database root (alpine, redhat, cvss, ...), else the host
+        if filepath is not None and self.root_path is not None:
+            relpath = os.path.relpath(filepath, self.root_path)
+            if not relpath.startswith(".."):
+                return relpath.split(os.sep)[0]
+        return urlparse(url).netloc
+
+    def record_fetch(self, url, filepath, result, status=None, size=0, seconds=0.0, retries=0, error=None):
+        entry = {
+            "url": url,
+            "source": self.source(url, filepath),
+            "result": result,
+            "status": status,
+            "bytes": size,
+            "seconds": round(seconds, 3),
+            "bytes_per_sec": round(size / seconds, 1) if seconds > 0 else None,
+            "retries": retries
+        }
+        if error is not None:
+            entry["error"] = error
+        with self.lock:
+            self.fetches.append(entry)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        # times the block, the caller may add counts to the yielded dict
+        stage = {"name": name}
+        start = time.perf_counter()
+        try:
+            yield stage
+            stage["ok"] = True
+        except:
+            stage["ok"] = False
+            raise
+        finally:
+            stage["seconds"] = round(time.perf_counter() - start, 3)
+            with self.lock:
+                self.stages.append(stage)
+
+    def sources(self):
+        summary = {}
+        with self.lock:
+            fetches = list(self.fetches)
+        for entry in fetches:
+            source = summary.setdefault(entry["source"], {
+                "requests": 0, "bytes": 0, "seconds": 0.0, "max_seconds": 0.0, "retries": 0,
+                DOWNLOADED: 0, NOT_MODIFIED: 0, SKIPPED: 0, FAILED: 0, FALLBACK: 0, CALLBACK_ERROR: 0
+            })
+            source[entry["result"]] += 1
+            if entry["result"] != SKIPPED:
+                source["requests"] += 1
+            source["bytes"] += entry["bytes"]
+            source["seconds"] = round(source["seconds"] + entry["seconds"], 3)
+            source["max_seconds"] = max(source["max_seconds"], entry["seconds"])
+            source["retries"] += entry["retries"]
+        return summary
+
+    def finish(self):
+        self.finished = time.time()
+
+    def report(self):
+        finished = self.finished if self.finished is not None else time.time()
+        with self.lock:
+            fetches = list(self.fetches)
+            stages = list(self.stages)
+            counters = dict(self.counters)
+        return {
+            "job": self.job,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+            "seconds": round(finished - self.started, 3),
+            "sources": self.sources(),
+            "stages": stages,
+            "counters": counters,
+            "fetches": fetches
+        }
+
+    def write_report(self, filepath):
+        write_atomic(filepath, json.dumps(self.report(), indent=1))
+
+    def write_prometheus(self, filepath):
+        # node_exporter textfile collector format, replaced atomically
+        report = self.report()
+        job = self.job
+        metrics = collections.OrderedDict()
+
+        def add(name, help_text, labels, value):
+            if name not in metrics:
+                metrics[name] = (help_text, [])
+            label_text = ",".join('%s="%s"' % (key, label_value(labels[key])) for key in sorted(labels))
+            metrics[name][1].append("%s{%s} %s" % (name, label_text, value))
+
+        add("secdb_run_timestamp_seconds", "End of the last run.", {"job": job}, int(self.finished or time.time()))
+        add("secdb_run_seconds", "Duration of the last run.", {"job": job}, report["seconds"])
+        for source, summary in sorted(report["sources"].items()):
+            labels = {"job": job, "source": source}
+            for result in (DOWNLOADED, NOT_MODIFIED, SKIPPED, FAILED, FALLBACK, CALLBACK_ERROR):
+                add("secdb_fetch_files", "Files of the last run by result.", dict(labels, result=result), summary[result])
+            add("secdb_fetch_bytes", "Bytes downloaded in the last run.", labels, summary["bytes"])
+            add("secdb_fetch_seconds", "Time spent downloading in the last run.", labels, summary["seconds"])
+            add("secdb_fetch_max_seconds", "Slowest single download of the last run.", labels, summary["max_seconds"])
+            add("secdb_fetch_retries", "Retries spent in the last run.", labels, summary["retries"])
+        for stage in report["stages"]:
+            labels = {"job": job, "stage": stage["name"]}
+            add("secdb_stage_seconds", "Duration of a stage of the last run.", labels, stage["seconds"])
+            add("secdb_stage_ok", "1 when the stage completed.", labels, int(stage["ok"]))
+            for key, value in sorted(stage.items()):
+                if key not in ("name", "seconds", "ok") and isinstance(value, (int, float)):
+                    add("secdb_stage_records", "Record counts of a stage of the last run.", dict(labels, kind=key), value)
+        for key, value in sorted(report["counters"].items()):
+            add("secdb_run_count", "Counters of the last run.", {"job": job, "kind": key}, value)
+
+        lines = []
+        for name, (help_text, samples) in metrics.items():
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s gauge" % name)
+            lines.extend(samples)
+        write_atomic(filepath, "\n".join(lines) + "\n")
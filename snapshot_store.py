@@ -0,0 +1,230 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/python3
+
+import os, json, time, errno, fcntl, shutil, hashlib, argparse, tempfile, contextlib
+from pathlib import Path
+from sources import load_registry, expand
+
+def file_sha256(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def source_paths(registry):
+    # top level files and directories under the database root the crawl sources write to
+    paths = set()
+    for name, source in registry.items():
+        for item in expand(name, source):
+            for path in (item["path"], item.get("dir")):
+                if path:
+                    paths.add(path.split("/")[0])
+    return sorted(paths)
+
+def database_files(root_path, sources=None):
+    # {relative path: sha256} of the files crawler.py downloaded into root_path.
+    # The fetch manifest lists them with their sha256, recomputed for files whose
+    # size or mtime no longer match; without a manifest the non-hidden files under
+    # the paths of the sources registry count. Other files, e.g. vuln-index.sqlite
+    # or a changes/ directory, are written in place and must not become objects.
+    root_path = Path(root_path)
+    files = {}
+    manifest_filepath = root_path.joinpath(".fetch-manifest.json")
+    if manifest_filepath.exists():
+        with open(manifest_filepath) as f:
+            entries = json.load(f)
+        for entry in entries.values():
+            filepath = root_path.joinpath(entry["path"])
+            if not filepath.is_file():
+                continue
+            stat = filepath.stat()
+            if entry.get("sha256") and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+                files[entry["path"]] = entry["sha256"]
+            else:
+                files[entry["path"]] = file_sha256(filepath)
+        return files
+
+    for path in source_paths(load_registry(sources)):
+        if path.startswith(".") or not root_path.joinpath(path).exists():
+            continue
+        if root_path.joinpath(path).is_file():
+            files[path] = file_sha256(root_path.joinpath(path))
+            continue
+        for dirpath, dirnames, filenames in os.walk(root_path.joinpath(path)):
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith("."))
+            for name in sorted(filenames):
+                if not name.startswith("."):
+                    filepath = Path(dirpath).joinpath(name)
+                    files[filepath.relative_to(root_path).as_posix()] = file_sha256(filepath)
+    return files
+
+class SnapshotStore(object):
+    # Content addressed copies of a vuln database:
+    #   objects/<aa>/<sha256>      one inode per distinct file content
+    #   snapshots/<id>/...         the database tree of one run, hardlinks into objects/
+    #   snapshots/<id>.json        {path: sha256} of that snapshot
+    #   current -> snapshots/<id>  flipped atomically once a snapshot is complete
+    # Readers open files through current/ and always see one whole snapshot.
+    # Files are only ever hardlinked, crawler.py replaces downloads by rename
+    # so the objects are never modified in place.
+    def __init__(self, store_path):
+        self.store_path = Path(store_path)
+        self.objects_dirpath = self.store_path.joinpath("objects")
+        self.snapshots_dirpath = self.store_path.joinpath("snapshots")
+        self.current_linkpath = self.store_path.joinpath("current")
+
+    @contextlib.contextmanager
+    def locked(self):
+        self.store_path.mkdir(parents=True, exist_ok=True)
+        with open(self.store_path.joinpath(".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def object_path(self, sha256):
+        return self.objects_dirpath.joinpath(sha256[:2], sha256)
+
+    def store_object(self, filepath, sha256):
+        # links filepath into objects/, copies when the store is on another filesystem
+        object_path = self.object_path(sha256)
+        if object_path.exists():
+            return False
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(filepath, object_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            fd, tmp_filepath = tempfile.mkstemp(prefix=".", suffix=".part", dir=object_path.parent)
+            os.close(fd)
+            shutil.copy2(filepath, tmp_filepath)
+            os.replace(tmp_filepath, object_path)
+        return True
+
+    def snapshots(self):
+        # snapshot ids, oldest first
+        if not self.snapshots_dirpath.exists():
+            return []
+        return sorted(path.name[:-len(".json")] for path in self.snapshots_dirpath.glob("*.json"))
+
+    def current(self):
+        if not self.current_linkpath.is_symlink():
+            return None
+        return Path(os.readlink(self.current_linkpath)).name
+
+    def manifest(self, snapshot_id):
+        with open(self.snapshots_dirpath.joinpath(snapshot_id + ".json")) as f:
+            return json.load(f)
+
+    def flip(self, snapshot_id):
+        # replaces the current symlink in one rename
+        tmp_linkpath = self.store_path.joinpath(".current.%d" % os.getpid())
+        if tmp_linkpath.is_symlink():
+            tmp_linkpath.unlink()
+        os.symlink(os.path.join("snapshots", snapshot_id), tmp_linkpath)
+        os.replace(tmp_linkpath, self.current_linkpath)
+
+    def publish(self, root_path, sources=None):
+        # Snapshots the database in root_path and makes it current. Returns
+        # (snapshot id, files, new objects); nothing is created when the
+        # database did not change since the current snapshot.
+        root_path = Path(root_path)
+        files = database_files(root_path, sources)
+        with self.locked():
+            current = self.current()
+            if current is not None and self.manifest(current) == files:
+                return current, len(files), 0
+
+            created = 0
+            for path, sha256 in files.items():
+                if self.store_object(root_path.joinpath(path), sha256):
+                    created += 1
+
+            snapshot_id = time.strftime("%Y%m%dT%H%M%S")
+            if self.snapshots_dirpath.joinpath(snapshot_id + ".json").exists():
+                snapshot_id += "-%d" % os.getpid()
+            self.snapshots_dirpath.mkdir(parents=True, exist_ok=True)
+            tmp_dirpath = Path(tempfile.mkdtemp(prefix="." + snapshot_id + ".", dir=self.snapshots_dirpath))
+            for path, sha256 in files.items():
+                target = tmp_dirpath.joinpath(path)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.link(self.object_path(sha256), target)
+            os.chmod(tmp_dirpath, 0o755)
+            os.replace(tmp_dirpath, self.snapshots_dirpath.joinpath(snapshot_id))
+
+            tmp_filepath = self.snapshots_dirpath.joinpath("." + snapshot_id + ".json.part")
+            with open(tmp_filepath, "w") as f:
+                json.dump(files, f, indent=1, sort_keys=True)
+            os.replace(tmp_filepath, self.snapshots_dirpath.joinpath(snapshot_id + ".json"))
+
+            self.flip(snapshot_id)
+        return snapshot_id, len(files), created
+
+    def rollback(self, snapshot_id):
+        with self.locked():
+            if snapshot_id not in self.snapshots():
+                raise KeyError(snapshot_id)
+            self.flip(snapshot_id)
+
+    def prune(self, keep=7, max_age_days=None):
+        # Drops snapshots beyond the newest `keep` (and older than max_age_days
+        # when given), never the current one, then the objects no remaining
+        # snapshot refers to. Returns (snapshots removed, objects removed).
+        with self.locked():
+            current = self.current()
+            snapshots = self.snapshots()
+            removed = []
+            for position, snapshot_id in enumerate(reversed(snapshots)):
+                if snapshot_id == current or position < keep:
+                    continue
+                if max_age_days is not None:
+                    age = time.time() - self.snapshots_dirpath.joinpath(snapshot_id + ".json").stat().st_mtime
+                    if age < max_age_days * 86400:
+                        continue
+                self.snapshots_dirpath.joinpath(snapshot_id + ".json").unlink()
+                shutil.rmtree(self.snapshots_dirpath.joinpath(snapshot_id), ignore_errors=True)
+                removed.append(snapshot_id)
+
+            referenced = set()
+            for snapshot_id in self.snapshots():
+                referenced.update(self.manifest(snapshot_id).values())
+            objects = 0
+            if self.objects_dirpath.exists():
+                for object_path in self.objects_dirpath.glob("*/*"):
+                    if object_path.name not in referenced and not object_path.name.startswith("."):
+                        object_path.unlink()
+                        objects += 1
+        return removed, objects
+
+if ( __name__ == "__main__"):
+    arg_parser = argparse.ArgumentParser(prog='PROG', description='Publish, list, roll back and prune snapshots of the vuln database downloaded by crawler.py.')
+    arg_parser.add_argument('-s', metavar='<STORE DIR>', required=True, help='Specify the snapshot store. (e.g. /home/user/secdb-store/)')
+    subparsers = arg_parser.add_subparsers(dest='command', required=True)
+    publish_parser = subparsers.add_parser('publish', help='Snapshot a database directory and make it current.')
+    publish_parser.add_argument('-d', metavar='<DATABASE DIR>', required=True, help='Specify the directory crawler.py stores the vuln database in. (e.g. /home/user/secdb/)')
+    publish_parser.add_argument('--sources', metavar='<REGISTRY FILE>', help='Source registry naming the directories to snapshot when the database has no fetch manifest. (default. sources.json next to crawler.py)')
+    subparsers.add_parser('list', help='List the snapshots, * marks the current one.')
+    rollback_parser = subparsers.add_parser('rollback', help='Make an older snapshot current.')
+    rollback_parser.add_argument('snapshot', metavar='<SNAPSHOT>')
+    prune_parser = subparsers.add_parser('prune', help='Remove old snapshots and unreferenced objects.')
+    prune_parser.add_argument('--keep', metavar='<N>', type=int, default=7, help='Number of newest snapshots to keep. (default. 7)')
+    prune_parser.add_argument('--max-age', metavar='<DAYS>', type=float, help='Only remove snapshots older than this.')
+    args = arg_parser.parse_args()
+
+    store = SnapshotStore(args.s)
+    if args.command == 'publish':
+        snapshot_id, files, created = store.publish(args.d, args.sources)
+        print("%s: %d files, %d new objects" % (snapshot_id, files, created))
+    elif args.command == 'list':
+        current = store.current()
+        for snapshot_id in store.snapshots():
+            print("%s %s" % ("*" if snapshot_id == current else " ", snapshot_id))
+    elif args.command == 'rollback':
+        try:
+            store.rollback(args.snapshot)
+        except KeyError:
+            print("ERROR: no snapshot %s" % args.snapshot)
+            exit(1)
+    else:
+        removed, objects = store.prune(args.keep, args.max_age)
+        print("%d snapshots, %d objects removed" % (len(removed), objects))
@@ -0,0 +1,164 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/python3
+
+import os, json, datetime, itertools, argparse
+
+REGISTRY_FILEPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sources.json")
+
+def load_registry(filepath=None):
+    # {source: {"files": [entry, ...]}} in crawl order. An entry has a url and
+    # optionally a path under the database root (without one the body is only
+    # handed to its handler), a fallback url, a dir for the handler's downloads,
+    # "then" naming the handler of crawler.py that submits the downloads the
+    # file leads to, constant "vars" and a "matrix" of values to expand
+    # {placeholders} with.
+    with open(filepath if filepath else REGISTRY_FILEPATH) as f:
+        return json.load(f)
+
+def select(registry, only=None, exclude=None):
+    # source names in registry order, KeyError for names not in the registry
+    for name in (only or []) + (exclude or []):
+        if name not in registry:
+            raise KeyError(name)
+    return [name for name in registry if (not only or name in only) and name not in (exclude or [])]
+
+def matrix_values(values):
+    # {"from": 2007} stands for every year from 2007 up to the current one
+    expanded = []
+    for value in values:
+        if isinstance(value, dict):
+            last = value.get("to", datetime.datetime.now().year)
+            expanded.extend(str(year) for year in range(value["from"], last + 1))
+        else:
+            expanded.append(str(value))
+    return expanded
+
+def expand(name, source):
+    # one item per entry and combination of its matrix values
+    items = []
+    for entry in source["files"]:
+        matrix = entry.get("matrix", {})
+        keys = list(matrix)
+        for combination in itertools.product(*[matrix_values(matrix[key]) for key in keys]):
+            values = dict(entry.get("vars", {}))
+            values.update(zip(keys, combination))
+            item = {"source": name, "url": entry["url"].format(**values), "path": None, "fallback": None, "dir": None, "then": entry.get("then"), "vars": values}
+            for key in ("path", "fallback", "dir"):
+                if entry.get(key):
+                    item[key] = entry[key].format(**values)
+            items.append(item)
+    return items
+
+def read_pulp_manifest(filepath):
+    # lines are "<dir>/<file>,<sha256>,<size>", the last one is empty; others are skipped
+    entries = {}
+    with open(filepath) as f:
+        for line in f:
+            fields = line.strip().split(",")
+            if len(fields) == 3 and "/" in fields[0] and fields[2].isdigit():
+                entries[fields[0]] = (fields[1].lower(), int(fields[2]))
+    return entries
+
+def read_nvd_meta(filepath):
+    # "key:value" lines; sha256 is taken over the uncompressed feed
+    meta = {}
+    with open(filepath) as f:
+        for line in f:
+            if ":" in line:
+                key, value = line.strip().split(":", 1)
+                meta[key] = value
+    meta["sha256"] = meta.get("sha256", "").lower()
+    return meta
+
+def feed_name(meta_name):
+    # nvdcve-1.1-2021.meta -> nvdcve-1.1-2021.json.gz, for urls and paths
+    return meta_name[:-len(".meta")] + ".json.gz"
+
+def dependents(item, root_path, entries):
+    # (url, path, size) of the downloads the item led to on the previous run,
+    # read from the files that run left behind
+    found = []
+    if item["then"] == "rhel_pulp":
+        filepath = os.path.join(root_path, item["path"])
+        if os.path.exists(filepath):
+            base_url = item["url"].rsplit("/", 1)[0]
+            for name, (sha256, size) in read_pulp_manifest(filepath).items():
+                found.append((base_url + "/" + name, os.path.join(os.path.dirname(item["path"]), name), size))
+    elif item["then"] == "nvd_meta":
+        filepath = os.path.join(root_path, item["path"])
+        size = None
+        if os.path.exists(filepath):
+            gz_size = read_nvd_meta(filepath).get("gzSize", "")
+            size = int(gz_size) if gz_size.isdigit() else None
+        found.append((feed_name(item["url"]), feed_name(item["path"]), size))
+    elif item["then"] == "amazon_mirror":
+        # the mirror changes, the files it served are in the fetch manifest
+        for url, entry in sorted(entries.items()):
+            if entry["path"].startswith(item["dir"] + "/"):
+                found.append((url, entry["path"], entry.get("size")))
+    return found
+
+def fetch_plan(root_path, names=None, registry=None, entries=None):
+    # Every download of the named sources (all by default), largest first.
+    # expected_size comes from the fetch manifest of the previous run (entries,
+    # read from root_path when None) and "dependents" lists what an item led to
+    # then. Items are ordered by total_size, the item with its dependents;
+    # items never downloaded before keep registry order ahead of the rest.
+    if registry is None:
+        registry = load_registry()
+    if entries is None:
+        entries = {}
+        manifest_filepath = os.path.join(root_path, ".fetch-manifest.json")
+        if os.path.exists(manifest_filepath):
+            with open(manifest_filepath) as f:
+                entries = json.load(f)
+    plan = []
+    for name in names if names is not None else list(registry):
+        for item in expand(name, registry[name]):
+            entry = entries.get(item["url"])
+            item["expected_size"] = None
+            if entry and item["path"] and entry["path"] == os.path.normpath(item["path"]):
+                item["expected_size"] = entry.get("size")
+            item["dependents"] = [{"url": url, "path": path, "expected_size": size} for url, path, size in dependents(item, root_path, entries)]
+            item["dependents"].sort(key=lambda dependent: -(dependent["expected_size"] or 0))
+            known = [size for size in [item["expected_size"]] + [dependent["expected_size"] for dependent in item["dependents"]] if size is not None]
+            item["total_size"] = sum(known) if known else None
+            plan.append(item)
+    plan.sort(key=lambda item: (item["total_size"] is not None, -(item["total_size"] or 0)))
+    return plan
+
+def print_plan(plan):
+    downloads = 0
+    expected = 0
+    unknown = 0
+    for item in plan:
+        line = "%12s  %-7s %s" % ("-" if item["total_size"] is None else item["total_size"], item["source"], item["url"])
+        if item["path"]:
+            line += " -> " + item["path"]
+        if item["fallback"]:
+            line += " (fallback %s)" % item["fallback"]
+        print(line)
+        for download in [item] + item["dependents"]:
+            downloads += 1
+            if download["expected_size"] is None:
+                unknown += 1
+            else:
+                expected += download["expected_size"]
+        for dependent in item["dependents"]:
+            print("%12s  %-7s   %s -> %s" % ("-" if dependent["expected_size"] is None else dependent["expected_size"], "", dependent["url"], dependent["path"]))
+    print("%d downloads, %d bytes expected, %d of unknown size" % (downloads, expected, unknown))
+
+if ( __name__ == "__main__"):
+    arg_parser = argparse.ArgumentParser(prog='PROG', description='Print the fetch plan of the source registry crawler.py downloads from.')
+    arg_parser.add_argument('-d', metavar='<DATABASE DIR>', required=True, help='Specify the directory crawler.py stores the vuln database in, its fetch manifest gives the expected sizes. (e.g. /home/user/secdb/)')
+    arg_parser.add_argument('--sources', metavar='<REGISTRY FILE>', help='Source registry. (default. sources.json next to this script)')
+    arg_parser.add_argument('--only', metavar='<SOURCE>', action='append', help='Source to plan, may be repeated. (default. all)')
+    arg_parser.add_argument('--exclude', metavar='<SOURCE>', action='append', help='Source to leave out, may be repeated.')
+    args = arg_parser.parse_args()
+
+    registry = load_registry(args.sources)
+    try:
+        names = select(registry, args.only, args.exclude)
+    except KeyError as e:
+        arg_parser.error("unknown source %s, known: %s" % (e, ", ".join(registry)))
+    print_plan(fetch_plan(args.d, names, registry))
@@ -0,0 +1,48 @@
+# -*- coding: UTF-8 -*-
+
+import os, sys, gzip, json
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def nvd_item(number, year):
+    cpes = [{"cpe23Uri": "cpe:2.3:a:vendor%d:prod%d:%d.%d:*:*:*:*:*:*:*" % (number % 7, j, number % 3, j)} for j in range(number % 3 + 1)]
+    cpes += [{"cpe23Uri": "cpe:2.3:o:osv%d:os%d:%d:*:*:*:*:*:*:*" % (j, j, number % 4)} for j in range(number % 2 + 1)]
+    return {
+        "cve": {"CVE_data_meta": {"ID": "CVE-%d-%04d" % (year, number)}},
+        "impact": {"baseMetricV3": {"cvssV3": {"baseSeverity": "HIGH"}}},
+        "configurations": {"nodes": [{"cpe_match": cpes}]}
+    }
+
+def write_feeds(feed_dirpath, items):
+    by_year = {}
+    for item in items:
+        by_year.setdefault(item["cve"]["CVE_data_meta"]["ID"].split("-")[1], []).append(item)
+    feed_dirpath.mkdir(parents=True, exist_ok=True)
+    for year, year_items in by_year.items():
+        with gzip.open(feed_dirpath.joinpath("nvdcve-1.1-%s.json.gz" % year), "wt") as f:
+            json.dump({"CVE_data_type": "CVE", "CVE_Items": year_items}, f)
+
+def write_cnvd_xml(filepath, numbers):
+    out = ['<?xml version="1.0" encoding="UTF-8"?>', '<vulnerabilitys>']
+    for number in numbers:
+        out.append(
+            "<vulnerability><number>CNVD-2021-%05d</number><title>Title %d</title><serverity>高</serverity>"
+            "<products><product>Prod %d</product></products><isEvent>通用型漏洞</isEvent>"
+            "<submitTime>2021-01-01</submitTime><openTime>2021-02-01</openTime><referenceLink>http://x/%d</referenceLink>"
+            "<formalWay>upgrade</formalWay><description>desc %d</description><patchName>patch %d</patchName>"
+            "<cves><cve><cveNumber>CVE-%d-%04d</cveNumber></cve></cves></vulnerability>"
+            % (number, number, number, number, number, number, 2015 + number % 3, number))
+    out.append("</vulnerabilitys>")
+    filepath.write_text("\n".join(out), encoding="utf-8")
+
+@pytest.fixture
+def cnvd_inputs(tmp_path):
+    # three CNVD XML files of 40 vulns and the NVD feeds of their CVEs, one in ten missing
+    xml_dirpath = tmp_path.joinpath("xml")
+    xml_dirpath.mkdir()
+    for position in range(3):
+        write_cnvd_xml(xml_dirpath.joinpath("cnvd-%d.xml" % position), range(position, 120, 3))
+    items = [nvd_item(number, 2015 + number % 3) for number in range(120) if number % 10]
+    write_feeds(tmp_path.joinpath("cvss"), items)
+    return xml_dirpath, tmp_path.joinpath("cvss"), items
@@ -0,0 +1,36 @@
+# -*- coding: UTF-8 -*-
+
+import json
+from change_feed import merge, run, ADDED, MODIFIED, WITHDRAWN
+
+def test_merge_added_modified_withdrawn():
+    old = [("a", "1"), ("b", "1"), ("d", "1"), ("e", "1")]
+    new = [("b", "2"), ("c", "1"), ("d", "1"), ("f", "1")]
+    assert list(merge(old, new)) == [(WITHDRAWN, "a"), (MODIFIED, "b"), (ADDED, "c"), (WITHDRAWN, "e"), (ADDED, "f")]
+
+def test_merge_empty_sides():
+    assert list(merge([], [("a", "1")])) == [(ADDED, "a")]
+    assert list(merge([("a", "1")], [])) == [(WITHDRAWN, "a")]
+    assert list(merge([("a", "1")], [("a", "1")])) == []
+
+def write_secdb(filepath, secfixes):
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    filepath.write_text(json.dumps({"packages": [{"pkg": {"name": name, "secfixes": fixes}} for name, fixes in sorted(secfixes.items())]}))
+
+def test_run_writes_the_changes_since_the_last_run(tmp_path):
+    root_path = tmp_path.joinpath("secdb")
+    changes_dirpath = tmp_path.joinpath("changes")
+    secdb_filepath = root_path.joinpath("alpine", "v3.18", "main.json")
+    write_secdb(secdb_filepath, {"curl": {"8.0.0-r0": ["CVE-2023-0001"]}, "zlib": {"1.2.13-r0": ["CVE-2022-0001"]}})
+    run(root_path, changes_dirpath, baseline=True)
+    assert not list(changes_dirpath.glob("*.jsonl"))
+
+    write_secdb(secdb_filepath, {"curl": {"8.0.0-r0": ["CVE-2023-0001", "CVE-2023-0002"]}, "musl": {"1.2.4-r0": ["CVE-2023-0003"]}})
+    summary = run(root_path, changes_dirpath)
+    assert summary == {"alpine/v3.18/main.json": {ADDED: 1, MODIFIED: 1, WITHDRAWN: 1}}
+    delta_filepath, = changes_dirpath.glob("*.jsonl")
+    changes = dict((change["key"], change) for change in map(json.loads, delta_filepath.read_text().splitlines()))
+    assert changes["curl@8.0.0-r0"]["change"] == MODIFIED
+    assert changes["curl@8.0.0-r0"]["record"]["cves"] == ["CVE-2023-0001", "CVE-2023-0002"]
+    assert changes["musl@1.2.4-r0"]["change"] == ADDED
+    assert changes["zlib@1.2.13-r0"] == {"source": "alpine/v3.18/main.json", "change": WITHDRAWN, "key": "zlib@1.2.13-r0"}
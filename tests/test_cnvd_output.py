@@ -0,0 +1,20 @@
+# -*- coding: UTF-8 -*-
+
+import pytest
+from cnvd_output import JsonlShardWriter, iter_records, find_records
+
+@pytest.mark.parametrize("compress", [None, "gzip", "zstd"])
+def test_find_records_in_every_compression(tmp_path, compress):
+    if compress == "zstd":
+        pytest.importorskip("zstandard")
+    writer = JsonlShardWriter(tmp_path, 5, compress=compress)
+    vulns = [{"cnvdNumber": "CNVD-2021-%05d" % (position // 2), "row": position} for position in range(23)]
+    for vuln in vulns:
+        writer.write(vuln)
+    writer.close()
+
+    assert list(iter_records(tmp_path)) == vulns
+    # the rows of one number may start late in a shard or span two shards
+    for number in ("CNVD-2021-00000", "CNVD-2021-00002", "CNVD-2021-00004", "CNVD-2021-00011"):
+        assert find_records(tmp_path, number) == [vuln for vuln in vulns if vuln["cnvdNumber"] == number]
+    assert find_records(tmp_path, "CNVD-2021-99999") == []
@@ -0,0 +1,95 @@
+# -*- coding: UTF-8 -*-
+
+import json, collections
+import pytest
+from conftest import write_feeds, write_cnvd_xml, nvd_item
+from nvd_index import NvdIndex, NvdJsonTree
+from cnvd_xml_handler import convert, update, open_writer
+
+SPLIT_NUMBER = 20
+
+def build(output_dirpath, xml_dirpath, feed_dirpath, file_format, incremental):
+    output_dirpath.mkdir(exist_ok=True)
+    nvd_source = NvdIndex(output_dirpath.joinpath("nvd-index.sqlite"))
+    nvd_source.build_from_feeds(feed_dirpath)
+    writer = open_writer(output_dirpath, file_format, SPLIT_NUMBER)
+    xml_filepaths = sorted(xml_dirpath.glob("*.xml"))
+    if incremental:
+        settings = {"format": file_format, "layout": "flat", "split_number": SPLIT_NUMBER, "compress": None, "max_bytes": None}
+        update(xml_filepaths, nvd_source, writer, output_dirpath, "flat", settings)
+    else:
+        convert(xml_filepaths, nvd_source, writer)
+        writer.close()
+
+def database(output_dirpath):
+    return dict((filepath.name, filepath.read_bytes()) for filepath in sorted(output_dirpath.glob("cnvd-[0-9]*")) + sorted(output_dirpath.glob("cnvd-index.json")))
+
+@pytest.mark.parametrize("file_format", ["json", "jsonl"])
+def test_update_matches_full_rebuild(tmp_path, cnvd_inputs, file_format):
+    xml_dirpath, feed_dirpath, items = cnvd_inputs
+    updated = tmp_path.joinpath("updated")
+    build(updated, xml_dirpath, feed_dirpath, file_format, True)
+    shards = len(database(updated))
+
+    # one input gone and one NVD record changed: fewer shards than before
+    xml_dirpath.joinpath("cnvd-2.xml").unlink()
+    items[1]["impact"] = {"baseMetricV2": {"severity": "LOW"}}
+    write_feeds(feed_dirpath, items)
+    build(updated, xml_dirpath, feed_dirpath, file_format, True)
+
+    full = tmp_path.joinpath("full")
+    build(full, xml_dirpath, feed_dirpath, file_format, False)
+    assert len(database(full)) < shards
+    assert database(updated) == database(full)
+
+class FailingWriter(object):
+    def __init__(self, writer):
+        self.writer = writer
+
+    def resume(self, kept_shards):
+        self.writer.resume(kept_shards)
+
+    def write(self, vuln):
+        raise IOError("disk full")
+
+@pytest.mark.parametrize("file_format", ["json", "jsonl"])
+def test_update_after_a_failed_update_matches_full_rebuild(tmp_path, cnvd_inputs, file_format):
+    xml_dirpath, feed_dirpath, items = cnvd_inputs
+    updated = tmp_path.joinpath("updated")
+    build(updated, xml_dirpath, feed_dirpath, file_format, True)
+
+    # the caches get the new NVD fingerprints, then writing the shards fails
+    items[1]["impact"] = {"baseMetricV2": {"severity": "LOW"}}
+    write_feeds(feed_dirpath, items)
+    nvd_source = NvdIndex(updated.joinpath("nvd-index.sqlite"))
+    nvd_source.build_from_feeds(feed_dirpath)
+    settings = {"format": file_format, "layout": "flat", "split_number": SPLIT_NUMBER, "compress": None, "max_bytes": None}
+    with pytest.raises(IOError):
+        update(sorted(xml_dirpath.glob("*.xml")), nvd_source, FailingWriter(open_writer(updated, file_format, SPLIT_NUMBER)), updated, "flat", settings)
+
+    build(updated, xml_dirpath, feed_dirpath, file_format, True)
+    full = tmp_path.joinpath("full")
+    build(full, xml_dirpath, feed_dirpath, file_format, False)
+    assert database(updated) == database(full)
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_a_malformed_cve_is_a_record_error(tmp_path, incremental):
+    nvd_dirpath = tmp_path.joinpath("vuln-list")
+    nvd_dirpath.joinpath("nvd", "2015").mkdir(parents=True)
+    nvd_dirpath.joinpath("nvd", "2015", "CVE-2015-0000.json").write_text(json.dumps(nvd_item(0, 2015)))
+    xml_filepath = tmp_path.joinpath("cnvd.xml")
+    write_cnvd_xml(xml_filepath, [0, 3])
+    xml_filepath.write_text(xml_filepath.read_text(encoding="utf-8").replace("CVE-2015-0003", "CVE20150003"), encoding="utf-8")
+
+    output_dirpath = tmp_path.joinpath("cnvd")
+    output_dirpath.mkdir()
+    writer = open_writer(output_dirpath, "json", SPLIT_NUMBER)
+    stats = collections.Counter()
+    if incremental:
+        settings = {"format": "json", "layout": "flat", "split_number": SPLIT_NUMBER, "compress": None, "max_bytes": None}
+        update([xml_filepath], NvdJsonTree(nvd_dirpath), writer, output_dirpath, "flat", settings, stats=stats)
+    else:
+        convert([xml_filepath], NvdJsonTree(nvd_dirpath), writer, stats=stats)
+        writer.close()
+    assert stats["errors"] == 1
+    assert set(vuln["cveNumber"] for vuln in json.load(open(output_dirpath.joinpath("cnvd-0000.json")))) == {"CVE-2015-0000"}
@@ -0,0 +1,98 @@
+# -*- coding: UTF-8 -*-
+
+import gzip, hashlib
+import pytest
+import crawler
+from sources import load_registry, expand
+
+class RecordingScheduler(object):
+    # stands in for FetchScheduler, remembers what a handler submits
+    def __init__(self):
+        self.manifest = None
+        self.submitted = []
+        self.skipped = []
+        self.callbacks = {}
+        self.validators = {}
+
+    def submit(self, url, filepath=None, callback=None, fallback=None, sha256=None, validate=None):
+        self.submitted.append((url, filepath))
+        self.callbacks[url] = callback
+        self.validators[url] = validate
+
+class FakeResponse(object):
+    def __init__(self, body):
+        self.body = body
+        self.headers = {"Content-Length": str(len(body))}
+
+    def iter_content(self, chunk_size):
+        yield self.body
+
+    def skip(self, url, filepath):
+        self.skipped.append(url)
+
+def registry_item(source, then):
+    return [item for item in expand(source, load_registry()[source]) if item["then"] == then][0]
+
+def test_rhel_rejects_a_manifest_without_entries(tmp_path):
+    item = registry_item("rhel", "rhel_pulp")
+    redhat_dirpath = tmp_path.joinpath("redhat")
+    redhat_dirpath.joinpath("RHEL8").mkdir(parents=True)
+    redhat_dirpath.joinpath("RHEL8", "rhel-8.oval.xml.bz2").write_bytes(b"oval")
+    redhat_dirpath.joinpath("PULP_MANIFEST").write_text("RHEL8/rhel-8.oval.xml.bz2,%s,4\n" % ("0" * 64))
+    scheduler = RecordingScheduler()
+    on_manifest = crawler.on_rhel_pulp_manifest(str(tmp_path), scheduler, item)
+
+    bad_filepath = tmp_path.joinpath("PULP_MANIFEST.new")
+    bad_filepath.write_text("<html>Service maintenance</html>\n")
+    with pytest.raises(ValueError):
+        on_manifest(str(bad_filepath))
+    assert redhat_dirpath.joinpath("RHEL8", "rhel-8.oval.xml.bz2").exists()
+    assert scheduler.submitted == []
+
+    # a partly garbled manifest is rejected as well
+    bad_filepath.write_text("RHEL8/rhel-8.oval.xml.bz2,%s,4\n<html>\n" % ("0" * 64))
+    with pytest.raises(ValueError):
+        on_manifest(str(bad_filepath))
+    assert redhat_dirpath.joinpath("RHEL8", "rhel-8.oval.xml.bz2").exists()
+
+def test_rhel_keeps_the_last_good_manifest(tmp_path):
+    item = registry_item("rhel", "rhel_pulp")
+    manifest_filepath = tmp_path.joinpath(item["path"])
+    manifest_filepath.parent.mkdir(parents=True)
+    manifest_filepath.write_text("RHEL8/rhel-8.oval.xml.bz2,%s,4\n" % ("0" * 64))
+    on_manifest = crawler.on_rhel_pulp_manifest(str(tmp_path), RecordingScheduler(), item)
+    for body in [b"<html>Service maintenance</html>\n", b"RHEL8/a.xml,b,c\n"]:
+        with pytest.raises(ValueError):
+            crawler.save_stream(FakeResponse(body), str(manifest_filepath), validate=on_manifest.validate)
+        assert crawler.read_pulp_manifest(str(manifest_filepath)) == {"RHEL8/rhel-8.oval.xml.bz2": ("0" * 64, 4)}
+    assert sorted(path.name for path in manifest_filepath.parent.iterdir()) == [manifest_filepath.name]
+
+def gzipped(data):
+    return gzip.compress(data, mtime=0)
+
+def test_nvd_feed_must_match_its_meta(tmp_path):
+    item = registry_item("cvss", "nvd_meta")
+    gz_filepath = tmp_path.joinpath(crawler.feed_name(item["path"]))
+    gz_filepath.parent.mkdir(parents=True)
+    gz_filepath.write_bytes(gzipped(b'{"CVE_Items": []}'))
+    meta_filepath = tmp_path.joinpath(item["path"])
+    meta_filepath.write_text("sha256:%s\r\ngzSize:1\r\n" % hashlib.sha256(b'{"CVE_Items": [{}]}').hexdigest().upper())
+    scheduler = RecordingScheduler()
+    crawler.on_nvd_meta(str(tmp_path), scheduler, item)(str(meta_filepath))
+    (url, filepath), = scheduler.submitted
+    assert filepath == str(gz_filepath)
+
+    # republished between the .meta and .json.gz requests: the previous feed stays
+    with pytest.raises(ValueError):
+        crawler.save_stream(FakeResponse(gzipped(b'{"CVE_Items": [{}, {}]}')), filepath, validate=scheduler.validators[url])
+    assert gz_filepath.read_bytes() == gzipped(b'{"CVE_Items": []}')
+    assert sorted(path.name for path in gz_filepath.parent.iterdir()) == sorted([gz_filepath.name, meta_filepath.name])
+
+    crawler.save_stream(FakeResponse(gzipped(b'{"CVE_Items": [{}]}')), filepath, validate=scheduler.validators[url])
+    scheduler.callbacks[url](filepath)
+    assert gz_filepath.read_bytes() == gzipped(b'{"CVE_Items": [{}]}')
+
+    # a 304 for a feed the .meta says changed fails the fetch
+    gz_filepath.write_bytes(gzipped(b'{"CVE_Items": []}'))
+    with pytest.raises(ValueError):
+        scheduler.callbacks[url](filepath)
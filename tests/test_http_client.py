@@ -0,0 +1,11 @@
+# -*- coding: UTF-8 -*-
+
+import pytest
+from http_client import host_rate
+
+def test_host_rate():
+    assert host_rate("nvd.nist.gov=2") == ("nvd.nist.gov", 2.0)
+    assert host_rate("access.redhat.com=0.5") == ("access.redhat.com", 0.5)
+    for item in ["nvd.nist.gov", "nvd.nist.gov=", "nvd.nist.gov=fast", "nvd.nist.gov=0", "nvd.nist.gov=nan", "=2"]:
+        with pytest.raises(ValueError):
+            host_rate(item)
@@ -0,0 +1,17 @@
+# -*- coding: UTF-8 -*-
+
+from nvd_index import NvdIndex
+
+def test_a_feed_that_fails_to_load_keeps_its_records(tmp_path, cnvd_inputs):
+    xml_dirpath, feed_dirpath, items = cnvd_inputs
+    index = NvdIndex(tmp_path.joinpath("nvd-index.sqlite"))
+    assert index.build_from_feeds(feed_dirpath) == 3
+    count = index.connect().execute("SELECT COUNT(*) FROM cves").fetchone()[0]
+    assert count == len(items)
+
+    # a truncated download of one year
+    feed_filepath = feed_dirpath.joinpath("nvdcve-1.1-2016.json.gz")
+    feed_filepath.write_bytes(feed_filepath.read_bytes()[:100])
+    assert index.build_from_feeds(feed_dirpath) == 0
+    assert index.connect().execute("SELECT COUNT(*) FROM cves").fetchone()[0] == count
+    assert index.lookup("CVE-2016-0001") is not None
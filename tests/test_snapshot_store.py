@@ -0,0 +1,19 @@
+# -*- coding: UTF-8 -*-
+
+from snapshot_store import SnapshotStore, database_files
+
+def test_without_a_manifest_only_source_files_are_snapshotted(tmp_path):
+    root_path = tmp_path.joinpath("secdb")
+    root_path.joinpath("alpine", "v3.18").mkdir(parents=True)
+    root_path.joinpath("alpine", "v3.18", "main.json").write_text("{}")
+    root_path.joinpath("alpine", ".main.json.part").write_text("")
+    # written in place by --index and --changes
+    root_path.joinpath("vuln-index.sqlite").write_bytes(b"sqlite")
+    root_path.joinpath("changes").mkdir()
+    root_path.joinpath("changes", "index.json").write_text("{}")
+    assert list(database_files(root_path)) == ["alpine/v3.18/main.json"]
+
+    store = SnapshotStore(tmp_path.joinpath("store"))
+    snapshot_id, files, created = store.publish(root_path)
+    assert (files, created) == (1, 1)
+    assert list(store.manifest(snapshot_id)) == ["alpine/v3.18/main.json"]
@@ -0,0 +1,75 @@
+# -*- coding: UTF-8 -*-
+
+from conftest import write_feeds
+from cnvd_matcher import iter_database
+from work_queue import WorkQueue, PENDING, LEASED, submit_cnvd, work, finalize_cnvd
+
+def test_claim_takes_the_highest_priority_first(tmp_path):
+    queue = WorkQueue(tmp_path.joinpath("queue.sqlite"))
+    job = queue.submit("crawl", {}, [("small", {"n": 1}, 1), ("large", {"n": 2}, 10)])
+    task = queue.claim("w1", 60)
+    assert (task["job"], task["key"], task["payload"], task["attempt"]) == (job, "large", {"n": 2}, 1)
+    assert queue.claim("w2", 60)["key"] == "small"
+    assert queue.claim("w3", 60) is None
+    assert queue.counts(job)[LEASED] == 2
+
+def test_expired_lease_goes_to_the_next_worker(tmp_path):
+    queue = WorkQueue(tmp_path.joinpath("queue.sqlite"))
+    job = queue.submit("crawl", {}, [("only", {}, 0)])
+    lost = queue.claim("w1", -1)
+    task = queue.claim("w2", 60)
+    assert task["id"] == lost["id"] and task["attempt"] == 2
+
+    # the first worker comes back too late and can no longer touch the task
+    assert not queue.heartbeat(lost["id"], "w1", 60)
+    assert not queue.complete(lost["id"], "w1", {"by": "w1"})
+    assert not queue.fail(lost["id"], "w1", "late")
+    assert queue.complete(task["id"], "w2", {"by": "w2"})
+    assert queue.results(job) == [("only", {"by": "w2"})]
+
+def test_expired_lease_of_the_last_attempt_fails(tmp_path):
+    queue = WorkQueue(tmp_path.joinpath("queue.sqlite"), max_attempts=1)
+    job = queue.submit("crawl", {}, [("only", {}, 0)])
+    queue.claim("w1", -1)
+    assert queue.claim("w2", 60) is None
+    assert queue.failures(job) == [("only", "lease expired")]
+
+def test_fail_backs_off_then_gives_up(tmp_path):
+    queue = WorkQueue(tmp_path.joinpath("queue.sqlite"), max_attempts=2, backoff=30)
+    job = queue.submit("crawl", {}, [("only", {}, 0)])
+    assert queue.fail(queue.claim("w1", 60)["id"], "w1", "first")
+    assert queue.counts(job)[PENDING] == 1
+    assert queue.claim("w1", 60) is None    # still backing off
+
+    queue.connect().execute("UPDATE tasks SET not_before = 0")
+    task = queue.claim("w1", 60)
+    assert task["attempt"] == 2
+    assert queue.fail(task["id"], "w1", "second")
+    assert queue.failures(job) == [("only", "second")]
+    assert queue.claim("w1", 60) is None
+
+    assert queue.retry(job) == 1
+    assert queue.claim("w1", 60)["attempt"] == 1
+
+def test_finalized_jobs_are_not_claimed(tmp_path):
+    queue = WorkQueue(tmp_path.joinpath("queue.sqlite"))
+    job = queue.submit("crawl", {}, [("only", {}, 0)])
+    queue.finalize(job)
+    assert queue.claim("w1", 60) is None
+    assert queue.counts()[PENDING] == 0
+    assert queue.counts(job)[PENDING] == 1
+
+def test_a_worker_reads_the_nvd_data_of_each_job(tmp_path, cnvd_inputs):
+    xml_dirpath, feed_dirpath, items = cnvd_inputs
+    queue = WorkQueue(tmp_path.joinpath("queue.sqlite"))
+    output_dirpath = tmp_path.joinpath("cnvd")
+    cve = items[1]["cve"]["CVE_data_meta"]["ID"]
+    severities = []
+    for severity in ["HIGH", "LOW"]:
+        items[1]["impact"] = {"baseMetricV2": {"severity": severity}}
+        write_feeds(feed_dirpath, items)
+        job = submit_cnvd(queue, xml_dirpath, output_dirpath, feed_dirpath=feed_dirpath)
+        assert work(queue, "w1", job=job) == 3
+        assert finalize_cnvd(queue, job) == []
+        severities.append(set(vuln["nvdSeverity"] for vuln in iter_database(output_dirpath) if vuln["cveNumber"] == cve))
+    assert severities == [{"HIGH"}, {"LOW"}]
@@ -0,0 +1,180 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/python3
+
+import os, json, sqlite3, argparse
+from pathlib import Path
+from oval_parser import oval_files, iter_definitions
+from nvd_index import nvd_fields, iter_feed_items
+
+class VulnIndex(object):
+    # SQLite index over the files crawler.py downloads: OVAL definitions,
+    # Alpine secdb and the NVD feeds, keyed by CVE id and by (distro,
+    # release, package). Every source file is streamed once, later builds
+    # only reload the files whose size or mtime changed.
+    def __init__(self, index_filepath):
+        self.index_filepath = str(index_filepath)
+        self.conn = None
+        self.pid = None
+
+    def connect(self):
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.index_filepath)
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, kind TEXT);
+                CREATE TABLE IF NOT EXISTS advisories (id INTEGER PRIMARY KEY, source TEXT, distro TEXT, release TEXT, name TEXT, title TEXT, severity TEXT);
+                CREATE TABLE IF NOT EXISTS advisory_cves (advisory INTEGER, cve TEXT);
+                CREATE TABLE IF NOT EXISTS packages (advisory INTEGER, distro TEXT, release TEXT, name TEXT, fixed_version TEXT);
+                CREATE TABLE IF NOT EXISTS nvd (cve TEXT PRIMARY KEY, severity TEXT, cpes TEXT, source TEXT);
+                CREATE INDEX IF NOT EXISTS advisories_source ON advisories (source);
+                CREATE INDEX IF NOT EXISTS advisory_cves_cve ON advisory_cves (cve);
+                CREATE INDEX IF NOT EXISTS advisory_cves_advisory ON advisory_cves (advisory);
+                CREATE INDEX IF NOT EXISTS packages_name ON packages (distro, release, name);
+                CREATE INDEX IF NOT EXISTS packages_advisory ON packages (advisory);
+                CREATE INDEX IF NOT EXISTS nvd_source ON nvd (source);
+            """)
+            self.pid = os.getpid()
+        return self.conn
+
+    def add_advisory(self, conn, source, distro, release, name, title, severity, cves, packages):
+        # packages are (release, name, fixed_version), release None for the advisory's own
+        cursor = conn.execute("INSERT INTO advisories (source, distro, release, name, title, severity) VALUES (?, ?, ?, ?, ?, ?)", (source, distro, release, name, title, severity))
+        advisory = cursor.lastrowid
+        conn.executemany("INSERT INTO advisory_cves VALUES (?, ?)", [(advisory, cve) for cve in cves])
+        conn.executemany("INSERT INTO packages VALUES (?, ?, ?, ?, ?)", [(advisory, distro, package_release or release, package, fixed_version) for package_release, package, fixed_version in packages])
+
+    def drop(self, conn, source):
+        conn.execute("DELETE FROM advisory_cves WHERE advisory IN (SELECT id FROM advisories WHERE source = ?)", (source,))
+        conn.execute("DELETE FROM packages WHERE advisory IN (SELECT id FROM advisories WHERE source = ?)", (source,))
+        conn.execute("DELETE FROM advisories WHERE source = ?", (source,))
+        conn.execute("DELETE FROM nvd WHERE source = ?", (source,))
+
+    def load_oval(self, conn, filepath, distro, release):
+        for definition in iter_definitions(filepath, release):
+            packages = [(package["release"], package["name"], package["fixed_version"]) for package in definition["packages"]]
+            self.add_advisory(conn, filepath, distro, release, definition["advisory"], definition["title"], definition["severity"], definition["cves"], packages)
+
+    def load_alpine(self, conn, filepath, release):
+        # secfixes map a fixed version to the CVEs it fixes, "0" lists CVEs that never applied
+        with open(filepath) as f:
+            secdb = json.load(f)
+        release = secdb.get("distroversion", release)
+        for item in secdb.get("packages", []):
+            package = item["pkg"]["name"]
+            for fixed_version, fixes in (item["pkg"].get("secfixes") or {}).items():
+                if fixed_version == "0":
+                    continue
+                cves = []
+                for fix in fixes or []:
+                    cves.extend(cve for cve in str(fix).split() if cve.startswith("CVE-"))
+                self.add_advisory(conn, filepath, "alpine", release, "%s-%s" % (package, fixed_version), "", "", cves, [(None, package, fixed_version)])
+
+    def load_nvd(self, conn, filepath):
+        for item in iter_feed_items(filepath):
+            severity, cpe23Uri = nvd_fields(item)
+            cpes = "\n".join(cpe23Uri) if isinstance(cpe23Uri, list) else ""
+            conn.execute("INSERT OR REPLACE INTO nvd VALUES (?, ?, ?, ?)", (item["cve"]["CVE_data_meta"]["ID"], severity, cpes, filepath))
+
+    def sources(self, root_path):
+        # (filepath, kind, loader) of every indexable file under root_path
+        root_path = Path(root_path)
+        sources = []
+        for distro, release, filepath in oval_files(root_path):
+            sources.append((str(filepath), "oval", lambda conn, path, distro=distro, release=release: self.load_oval(conn, path, distro, release)))
+        for filepath in sorted(root_path.glob("alpine/*/*.json")):
+            sources.append((str(filepath), "alpine", lambda conn, path, release=filepath.parent.name: self.load_alpine(conn, path, release)))
+        for filepath in sorted(root_path.glob("cvss/nvdcve-1.1-[0-9]*.json.gz")):
+            sources.append((str(filepath), "nvd", self.load_nvd))
+        return sources
+
+    def build(self, root_path):
+        # Reloads new or changed files and drops the records of files that
+        # disappeared. Returns the number of files reloaded.
+        conn = self.connect()
+        known = dict((row[0], (row[1], row[2])) for row in conn.execute("SELECT path, size, mtime FROM files"))
+        changed = 0
+        for filepath, kind, load in self.sources(root_path):
+            stat = os.stat(filepath)
+            state = (stat.st_size, stat.st_mtime)
+            if known.pop(filepath, None) == state:
+                continue
+            try:
+                with conn:
+                    self.drop(conn, filepath)
+                    load(conn, filepath)
+                    conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (filepath, state[0], state[1], kind))
+            except:
+                print("EXCEPTION: failed to index %s" % filepath)
+                continue
+            changed += 1
+        with conn:
+            for filepath in known:
+                self.drop(conn, filepath)
+                conn.execute("DELETE FROM files WHERE path = ?", (filepath,))
+        return changed
+
+    def affected(self, distro, release, package):
+        # advisories listing package on distro/release, fixed_version None when unfixed
+        rows = self.connect().execute("""
+            SELECT DISTINCT a.id, a.name, a.title, a.severity, p.fixed_version
+            FROM packages p JOIN advisories a ON a.id = p.advisory
+            WHERE p.distro = ? AND p.release = ? AND p.name = ?
+            ORDER BY a.id
+        """, (distro, release, package)).fetchall()
+        return self.describe(rows)
+
+    def cve(self, cve):
+        conn = self.connect()
+        rows = conn.execute("""
+            SELECT a.id, a.name, a.title, a.severity, a.distro
+            FROM advisory_cves c JOIN advisories a ON a.id = c.advisory
+            WHERE c.cve = ? ORDER BY a.id
+        """, (cve,)).fetchall()
+        advisories = []
+        seen = set()
+        for advisory, name, title, severity, distro in rows:
+            packages = []
+            for release, package, fixed_version in conn.execute("SELECT release, name, fixed_version FROM packages WHERE advisory = ?", (advisory,)):
+                packages.append({"release": release, "name": package, "fixed_version": fixed_version})
+            key = (distro, name, json.dumps(packages, sort_keys=True))
+            if key in seen:
+                continue    # the same advisory from overlapping files (e.g. RHEL OVAL v1 and v2)
+            seen.add(key)
+            advisories.append({"distro": distro, "advisory": name, "title": title, "severity": severity, "packages": packages})
+        record = {"cve": cve, "advisories": advisories, "nvd": None}
+        row = conn.execute("SELECT severity, cpes FROM nvd WHERE cve = ?", (cve,)).fetchone()
+        if row is not None:
+            record["nvd"] = {"severity": row[0], "cpes": row[1].split("\n") if row[1] else []}
+        return record
+
+    def describe(self, rows):
+        conn = self.connect()
+        results = []
+        seen = set()
+        for advisory, name, title, severity, fixed_version in rows:
+            if (name, fixed_version) in seen:
+                continue
+            seen.add((name, fixed_version))
+            cves = [row[0] for row in conn.execute("SELECT cve FROM advisory_cves WHERE advisory = ?", (advisory,))]
+            results.append({"advisory": name, "title": title, "severity": severity, "fixed_version": fixed_version, "cves": cves})
+        return results
+
+if ( __name__ == "__main__"):
+    arg_parser = argparse.ArgumentParser(prog='PROG', description='Build or query the vulnerability index of a database downloaded by crawler.py.')
+    arg_parser.add_argument('-d', metavar='<DATABASE DIR>', required=True, help='Specify the directory crawler.py stores the vuln database in. (e.g. /home/user/secdb/)')
+    arg_parser.add_argument('-i', metavar='<INDEX FILE>', help='Specify the index file. (default. <DATABASE DIR>/vuln-index.sqlite)')
+    arg_parser.add_argument('--cve', metavar='<CVE>', help='Print the advisories and NVD data of a CVE instead of building. (e.g. CVE-2021-3449)')
+    arg_parser.add_argument('--package', metavar='<NAME>', help='Print the advisories fixing a package instead of building, needs --distro and --release.')
+    arg_parser.add_argument('--distro', metavar='<DISTRO>', help='alpine/debian/oracle/photon/redhat/suse/ubuntu.')
+    arg_parser.add_argument('--release', metavar='<RELEASE>', help='Release as named in the database. (e.g. bullseye, 8, v3.15)')
+    args = arg_parser.parse_args()
+
+    index = VulnIndex(args.i if args.i else Path(args.d).joinpath("vuln-index.sqlite"))
+    if args.cve:
+        print(json.dumps(index.cve(args.cve), indent=1, ensure_ascii=False))
+    elif args.package:
+        if not args.distro or not args.release:
+            arg_parser.error("--package needs --distro and --release")
+        for advisory in index.affected(args.distro, args.release, args.package):
+            print(json.dumps(advisory, ensure_ascii=False))
+    else:
+        print("%d files indexed" % index.build(args.d))
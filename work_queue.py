@@ -0,0 +1,440 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/python3
+
+import os, sys, json, time, shutil, socket, sqlite3, argparse, threading, contextlib, collections
+from pathlib import Path
+from nvd_index import NvdJsonTree, NvdIndex
+from run_metrics import RunMetrics
+from sources import load_registry, select, fetch_plan
+from http_client import host_rate
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+class WorkQueue(object):
+    # Durable task queue in one SQLite file. Tasks belong to a job; workers on
+    # any host that can open the file claim a task with a lease, extend it while
+    # they work and mark it done or failed. A task whose lease runs out (its
+    # worker died) goes to the next worker, failed tasks are retried with
+    # backoff until max_attempts. The file must be on storage with working
+    # POSIX locks (a local disk, or NFS with locking enabled).
+    def __init__(self, queue_filepath, max_attempts=3, backoff=30):
+        self.queue_filepath = str(queue_filepath)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.conn = None
+        self.pid = None
+
+    def connect(self):
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.queue_filepath, timeout=60, isolation_level=None)
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (job TEXT PRIMARY KEY, kind TEXT, params TEXT, created REAL, finalized REAL);
+                CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY, job TEXT, key TEXT, payload TEXT, priority INTEGER,
+                    state TEXT, attempts INTEGER DEFAULT 0, max_attempts INTEGER, owner TEXT, lease_until REAL,
+                    not_before REAL DEFAULT 0, result TEXT, error TEXT, UNIQUE (job, key));
+                CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, priority);
+            """)
+            self.pid = os.getpid()
+        return self.conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers never claim the same task
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+
+    def submit(self, kind, params, tasks):
+        # tasks are (key, payload, priority), higher priorities are claimed first
+        job = "%s-%s" % (kind, time.strftime("%Y%m%dT%H%M%S"))
+        with self.transaction() as conn:
+            if conn.execute("SELECT 1 FROM jobs WHERE job = ?", (job,)).fetchone():
+                job += "-%d" % os.getpid()
+            conn.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, NULL)", (job, kind, json.dumps(params), time.time()))
+            conn.executemany("INSERT INTO tasks (job, key, payload, priority, state, max_attempts) VALUES (?, ?, ?, ?, ?, ?)",
+                [(job, key, json.dumps(payload), priority, PENDING, self.max_attempts) for key, payload, priority in tasks])
+        return job
+
+    def job(self, job):
+        row = self.connect().execute("SELECT job, kind, params, created, finalized FROM jobs WHERE job = ?", (job,)).fetchone()
+        if row is None:
+            return None
+        return {"job": row[0], "kind": row[1], "params": json.loads(row[2]), "created": row[3], "finalized": row[4]}
+
+    def jobs(self):
+        return [self.job(row[0]) for row in self.connect().execute("SELECT job FROM jobs ORDER BY created")]
+
+    def claim(self, owner, lease_seconds, job=None):
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute("UPDATE tasks SET state = ?, error = 'lease expired' WHERE state = ? AND lease_until < ? AND attempts >= max_attempts", (FAILED, LEASED, now))
+            query = """
+                SELECT t.id, t.job, t.key, t.payload, t.attempts FROM tasks t JOIN jobs j ON j.job = t.job
+                WHERE j.finalized IS NULL AND ((t.state = ? AND t.not_before <= ?) OR (t.state = ? AND t.lease_until < ?))
+            """
+            values = [PENDING, now, LEASED, now]
+            if job is not None:
+                query += " AND t.job = ?"
+                values.append(job)
+            row = conn.execute(query + " ORDER BY t.priority DESC, t.id LIMIT 1", values).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE tasks SET state = ?, owner = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?", (LEASED, owner, now + lease_seconds, row[0]))
+        return {"id": row[0], "job": row[1], "key": row[2], "payload": json.loads(row[3]), "attempt": row[4] + 1}
+
+    def heartbeat(self, task_id, owner, lease_seconds):
+        # False once the lease was lost to another worker
+        with self.transaction() as conn:
+            cursor = conn.execute("UPDATE tasks SET lease_until = ? WHERE id = ? AND owner = ? AND state = ?", (time.time() + lease_seconds, task_id, owner, LEASED))
+        return cursor.rowcount == 1
+
+    def complete(self, task_id, owner, result):
+        with self.transaction() as conn:
+            cursor = conn.execute("UPDATE tasks SET state = ?, result = ?, error = NULL WHERE id = ? AND owner = ? AND state = ?", (DONE, json.dumps(result), task_id, owner, LEASED))
+        return cursor.rowcount == 1
+
+    def fail(self, task_id, owner, error):
+        with self.transaction() as conn:
+            row = conn.execute("SELECT attempts, max_attempts FROM tasks WHERE id = ? AND owner = ? AND state = ?", (task_id, owner, LEASED)).fetchone()
+            if row is None:
+                return False
+            if row[0] >= row[1]:
+                conn.execute("UPDATE tasks SET state = ?, error = ? WHERE id = ?", (FAILED, error, task_id))
+            else:
+                not_before = time.time() + self.backoff * 2 ** (row[0] - 1)
+                conn.execute("UPDATE tasks SET state = ?, error = ?, not_before = ? WHERE id = ?", (PENDING, error, not_before, task_id))
+        return True
+
+    def retry(self, job):
+        # puts the failed tasks of a job back with fresh attempts
+        with self.transaction() as conn:
+            cursor = conn.execute("UPDATE tasks SET state = ?, attempts = 0, not_before = 0 WHERE job = ? AND state = ?", (PENDING, job, FAILED))
+        return cursor.rowcount
+
+    def counts(self, job=None):
+        query = "SELECT t.state, COUNT(*) FROM tasks t JOIN jobs j ON j.job = t.job WHERE j.finalized IS NULL"
+        values = []
+        if job is not None:
+            query = "SELECT state, COUNT(*) FROM tasks WHERE job = ?"
+            values.append(job)
+        counts = dict((state, 0) for state in (PENDING, LEASED, DONE, FAILED))
+        counts.update(self.connect().execute(query + " GROUP BY state", values).fetchall())
+        return counts
+
+    def results(self, job):
+        # (key, result) of the finished tasks in key order
+        rows = self.connect().execute("SELECT key, result FROM tasks WHERE job = ? AND state = ? ORDER BY key", (job, DONE))
+        return [(key, json.loads(result)) for key, result in rows]
+
+    def failures(self, job):
+        return self.connect().execute("SELECT key, error FROM tasks WHERE job = ? AND state = ? ORDER BY key", (job, FAILED)).fetchall()
+
+    def finalize(self, job):
+        with self.transaction() as conn:
+            conn.execute("UPDATE jobs SET finalized = ? WHERE job = ?", (time.time(), job))
+
+def submit_crawl(queue, root_path, workers=16, per_host=4, timeout=60, retries=5, rates=None, full=False, index=False, snapshot=None, keep=7,
+                 sources=None, only=None, exclude=None, changes=None):
+    # One task per source, all downloading into the shared root_path. Sources
+    # with the most bytes in their fetch plan are claimed first.
+    registry = load_registry(sources)
+    names = select(registry, only, exclude)
+    params = {
+        "root_path": os.path.abspath(root_path), "workers": workers, "per_host": per_host, "timeout": timeout,
+        "retries": retries, "rates": rates or {}, "full": full, "index": index,
+        "snapshot": os.path.abspath(snapshot) if snapshot else None, "keep": keep,
+        "sources": os.path.abspath(sources) if sources else None,
+        "changes": os.path.abspath(changes) if changes else None
+    }
+    os.makedirs(params["root_path"], exist_ok=True)
+    sizes = collections.Counter()
+    for item in fetch_plan(params["root_path"], names, registry):
+        sizes[item["source"]] += item["total_size"] or 0
+    return queue.submit("crawl", params, [(name, {"source": name}, sizes[name] // 1024) for name in names])
+
+def run_crawl_task(params, payload):
+    import crawler
+    from http_client import HttpClient
+
+    manifest = crawler.FetchManifest(params["root_path"])
+    if params["full"]:
+        # no conditional requests; clear() would also drop the other crawlers' entries
+        manifest.entries = {}
+    client = HttpClient(timeout=(10, params["timeout"]), retries=params["retries"], host_rates=params["rates"], pool_size=params["per_host"])
+    metrics = RunMetrics("crawler", params["root_path"])
+    scheduler = crawler.FetchScheduler(params["workers"], params["per_host"], manifest, client, metrics)
+    with metrics.stage(payload["source"]):
+        try:
+            crawler.crawl(params["root_path"], scheduler, [payload["source"]], load_registry(params["sources"]))
+        finally:
+            scheduler.shutdown()
+    if scheduler.failures:
+        raise RuntimeError("%d downloads failed: %s" % (len(scheduler.failures), " ".join(sorted(scheduler.failures))))
+    return {"fetches": metrics.fetches, "stages": metrics.stages}
+
+def finalize_crawl(queue, job, report_filepath=None, prom_filepath=None):
+    # Report of all crawl tasks, then the --index / --changes / --snapshot steps of the job.
+    # Sources that failed keep their previous files. Returns the failed sources.
+    import crawler
+
+    params = queue.job(job)["params"]
+    root_path = params["root_path"]
+    metrics = RunMetrics("crawler", root_path)
+    metrics.started = queue.job(job)["created"]
+    for name, result in queue.results(job):
+        metrics.fetches.extend(result["fetches"])
+        metrics.stages.extend(result["stages"])
+    failures = queue.failures(job)
+    metrics.count("failed_tasks", len(failures))
+
+    crawler.finish_crawl(root_path, metrics, params["index"], params.get("changes"), params["snapshot"], params["keep"])
+
+    metrics.finish()
+    metrics.write_report(report_filepath if report_filepath else os.path.join(root_path, ".crawl-report.json"))
+    if prom_filepath:
+        metrics.write_prometheus(prom_filepath)
+    queue.finalize(job)
+    return failures
+
+def submit_cnvd(queue, xml_dirpath, output_dirpath, nvd_dirpath=None, feed_dirpath=None, index_filepath=None, no_index=False,
+                split_number=40000, file_format="json", layout="flat", compress=None, max_bytes=None, backend="sax"):
+    # Builds the NVD index once, then queues one task per XML file, largest
+    # first. Workers spool the records of a file under <output>/.queue-<job>/,
+    # finalize replays the spools in file order into the shards.
+    output_dirpath = Path(output_dirpath).absolute()
+    output_dirpath.mkdir(parents=True, exist_ok=True)
+    params = {
+        "output_dirpath": str(output_dirpath), "split_number": split_number, "format": file_format, "layout": layout,
+        "compress": compress, "max_bytes": max_bytes, "backend": backend, "nvd_index": None, "nvd_dirpath": None
+    }
+    if no_index and nvd_dirpath:
+        params["nvd_dirpath"] = os.path.abspath(nvd_dirpath)
+    else:
+        index_filepath = Path(index_filepath if index_filepath else output_dirpath.joinpath("nvd-index.sqlite")).absolute()
+        nvd_source = NvdIndex(index_filepath)
+        if feed_dirpath:
+            print("%d NVD feeds indexed" % nvd_source.build_from_feeds(feed_dirpath))
+        else:
+            print("%d NVD files indexed" % nvd_source.build(nvd_dirpath))
+        params["nvd_index"] = str(index_filepath)
+
+    tasks = []
+    for position, filepath in enumerate(sorted(Path(xml_dirpath).glob('*.xml'))):
+        key = "%06d" % position
+        tasks.append((key, {"xml": str(filepath.absolute()), "spool": key + ".jsonl"}, filepath.stat().st_size // 1024))
+    job = queue.submit("cnvd", params, tasks)
+    params["job"] = job
+    params["spool_dirpath"] = str(output_dirpath.joinpath(".queue-" + job))
+    Path(params["spool_dirpath"]).mkdir(exist_ok=True)
+    with queue.transaction() as conn:
+        conn.execute("UPDATE jobs SET params = ? WHERE job = ?", (json.dumps(params), job))
+    return job
+
+nvd_sources = {}
+
+def run_cnvd_task(params, payload):
+    from cnvd_xml_handler import parse_file
+    from cnvd_output import SpoolWriter
+
+    # one NVD source per worker process, its lookup cache carries over between
+    # the files of a job; every job rebuilds the index, so the next one reopens it
+    if params["job"] not in nvd_sources:
+        nvd_sources.clear()
+        nvd_sources[params["job"]] = NvdIndex(params["nvd_index"]) if params["nvd_index"] else NvdJsonTree(params["nvd_dirpath"])
+    spool_filepath = Path(params["spool_dirpath"]).joinpath(payload["spool"])
+    tmp_filepath = spool_filepath.with_name(".%s.%s.%d.part" % (payload["spool"], socket.gethostname(), os.getpid()))
+    try:
+        with open(tmp_filepath, "w") as f:
+            stats = parse_file(payload["xml"], nvd_sources[params["job"]], SpoolWriter(f), params["backend"])
+    except:
+        os.unlink(tmp_filepath)
+        raise
+    os.replace(tmp_filepath, spool_filepath)
+    return dict(stats)
+
+def finalize_cnvd(queue, job, report_filepath=None, prom_filepath=None):
+    # Writes the shards from the spools once every task is done; with failed
+    # tasks nothing is written and the job stays open for `retry`.
+    from cnvd_xml_handler import replay_spool, open_writer, drop_state
+    from cnvd_output import FlatWriter, CountingWriter
+
+    failures = queue.failures(job)
+    if failures:
+        return failures
+    params = queue.job(job)["params"]
+    output_dirpath = Path(params["output_dirpath"])
+    metrics = RunMetrics("cnvd")
+    metrics.started = queue.job(job)["created"]
+    stats = collections.Counter()
+    with metrics.stage("convert") as stage:
+        writer = open_writer(output_dirpath, params["format"], params["split_number"], params["max_bytes"], params["compress"], params["layout"])
+        counter = CountingWriter(writer)
+        records = FlatWriter(counter) if params["layout"] == "flat" else counter
+        results = queue.results(job)
+        for key, result in results:
+            stats.update(result)
+            replay_spool(Path(params["spool_dirpath"]).joinpath(key + ".jsonl"), records)
+        stats["records_out"] += counter.count
+        stage["files"] = len(results)
+        stage.update(stats)
+    with metrics.stage("write"):
+        writer.close()
+    drop_state(output_dirpath)
+    shutil.rmtree(params["spool_dirpath"], ignore_errors=True)
+    if stats["errors"]:
+        print("ERROR: %d vulnerabilities failed to convert" % stats["errors"])
+
+    metrics.finish()
+    metrics.write_report(report_filepath if report_filepath else output_dirpath.joinpath(".cnvd-report.json"))
+    if prom_filepath:
+        metrics.write_prometheus(prom_filepath)
+    queue.finalize(job)
+    return failures
+
+HANDLERS = {"crawl": run_crawl_task, "cnvd": run_cnvd_task}
+FINALIZERS = {"crawl": finalize_crawl, "cnvd": finalize_cnvd}
+
+def keep_leased(queue_filepath, task_id, owner, lease_seconds, stop):
+    # extends the lease until the task ends, on its own connection
+    queue = WorkQueue(queue_filepath)
+    while not stop.wait(lease_seconds / 3.0):
+        if not queue.heartbeat(task_id, owner, lease_seconds):
+            print("ERROR: lost the lease of task %d" % task_id)
+            return
+
+def work(queue, owner, lease_seconds=300, job=None, wait=False, poll=5):
+    # Runs tasks until none is pending or leased (or forever with wait),
+    # returns the number completed. Tasks leased by other workers are waited
+    # for, they come back to the queue if those workers die.
+    completed = 0
+    while True:
+        task = queue.claim(owner, lease_seconds, job)
+        if task is None:
+            counts = queue.counts(job)
+            if not wait and counts[PENDING] == 0 and counts[LEASED] == 0:
+                return completed
+            time.sleep(poll)
+            continue
+
+        kind = queue.job(task["job"])["kind"]
+        stop = threading.Event()
+        beat = threading.Thread(target=keep_leased, args=(queue.queue_filepath, task["id"], owner, lease_seconds, stop), daemon=True)
+        beat.start()
+        print("%s: %s %s (attempt %d)" % (owner, task["job"], task["key"], task["attempt"]))
+        try:
+            result = HANDLERS[kind](queue.job(task["job"])["params"], task["payload"])
+        except Exception as e:
+            print("EXCEPTION: %s %s failed" % (task["job"], task["key"]))
+            queue.fail(task["id"], owner, "%s: %s" % (type(e).__name__, e))
+            continue
+        finally:
+            stop.set()
+            beat.join()
+        if queue.complete(task["id"], owner, result):
+            completed += 1
+        else:
+            print("ERROR: %s %s was handed to another worker" % (task["job"], task["key"]))
+
+if ( __name__ == "__main__"):
+    arg_parser = argparse.ArgumentParser(prog='PROG', description='Split crawls and CNVD conversions into tasks of a shared queue, run them on any number of workers and finalize the outputs.')
+    arg_parser.add_argument('-q', metavar='<QUEUE FILE>', required=True, help='SQLite queue on storage every worker can reach, paths in the jobs must be the same on every host. (e.g. /mnt/secdb/queue.sqlite)')
+    arg_parser.add_argument('--attempts', metavar='<COUNT>', type=int, default=3, help='Attempts of a task before it fails. (default. 3)')
+    subparsers = arg_parser.add_subparsers(dest='command', required=True)
+
+    crawl_parser = subparsers.add_parser('crawl', help='Queue a crawl, one task per source.')
+    crawl_parser.add_argument('-o', metavar='<DATABASE DIR>', required=True, help='Specify the directory to store vuln database. (e.g. /home/user/secdb/)')
+    crawl_parser.add_argument('-j', metavar='<WORKERS>', type=int, default=16, help='Number of concurrent downloads of a task. (default. 16)')
+    crawl_parser.add_argument('--per-host', metavar='<CONNECTIONS>', type=int, default=4, help='Maximum concurrent downloads of a task from one host. (default. 4)')
+    crawl_parser.add_argument('--full', action='store_true', help='Ignore the fetch manifest and download every file again.')
+    crawl_parser.add_argument('--sources', metavar='<REGISTRY FILE>', help='Source registry. (default. sources.json next to crawler.py)')
+    crawl_parser.add_argument('--only', metavar='<SOURCE>', action='append', help='Source to crawl, may be repeated. (default. all)')
+    crawl_parser.add_argument('--exclude', metavar='<SOURCE>', action='append', help='Source to leave out, may be repeated.')
+    crawl_parser.add_argument('--timeout', metavar='<SECONDS>', type=float, default=60, help='Read timeout of a single request. (default. 60)')
+    crawl_parser.add_argument('--retries', metavar='<COUNT>', type=int, default=5, help='Retries on 429/5xx and connection resets. (default. 5)')
+    crawl_parser.add_argument('--rate', metavar='<HOST=RPS>', type=host_rate, action='append', default=[], help='Requests per second allowed to a host by each worker, may be repeated. (e.g. nvd.nist.gov=2)')
+    crawl_parser.add_argument('--index', action='store_true', help='Refresh <DATABASE DIR>/vuln-index.sqlite when finalizing.')
+    crawl_parser.add_argument('--snapshot', metavar='<STORE DIR>', help='Publish a snapshot to this store when finalizing, see snapshot_store.py.')
+    crawl_parser.add_argument('--keep', metavar='<N>', type=int, default=7, help='Snapshots kept in the store by --snapshot. (default. 7)')
+    crawl_parser.add_argument('--changes', metavar='<CHANGES DIR>', help='Write the advisories added, modified or withdrawn by the crawl to this directory when finalizing, see change_feed.py.')
+
+    cnvd_parser = subparsers.add_parser('cnvd', help='Queue a CNVD conversion, one task per XML file.')
+    cnvd_parser.add_argument('-c', metavar='<CNVD XML DIR>', required=True, help='Specify the directory including CNVD info. (e.g. /home/user/cnvd_xml_files/)')
+    nvd_group = cnvd_parser.add_mutually_exclusive_group(required=True)
+    nvd_group.add_argument('-n', metavar='<NVD JSON DIR>', help='Specify the directory including NVD info. (e.g. /home/user/vuln-list-main/)')
+    nvd_group.add_argument('-f', metavar='<NVD FEED DIR>', help='Specify the directory including the NVD JSON feeds downloaded by crawler.py. (e.g. /home/user/secdb/cvss/)')
+    cnvd_parser.add_argument('-o', metavar='<DATABASE DIR>', required=True, help='Specify the directory to store CNVD database. (e.g. /home/user/secdb/cnvd/)')
+    cnvd_parser.add_argument('-s', metavar='<SPLIT NUMBER>', type=int, default=40000, help='Number of vulnerabilities in a JSON file. (default. 40000)')
+    cnvd_parser.add_argument('-i', metavar='<INDEX FILE>', help='NVD lookup index, built or refreshed from -n/-f before queueing. (default. <DATABASE DIR>/nvd-index.sqlite)')
+    cnvd_parser.add_argument('--no-index', action='store_true', help='Read the NVD JSON files of -n directly for every CVE instead of using the index.')
+    cnvd_parser.add_argument('--format', choices=['json', 'jsonl'], default='json', help='json: cnvd-%%04d.json lists, jsonl: one vuln per line with a cnvd-index.json. (default. json)')
+    cnvd_parser.add_argument('--layout', choices=['flat', 'normalized'], default='flat', help='flat: one vuln per (package, system) pair, normalized: one vuln per CNVD number. (default. flat)')
+    cnvd_parser.add_argument('--compress', choices=['gzip', 'zstd'], help='Compress jsonl shards.')
+    cnvd_parser.add_argument('--max-bytes', metavar='<BYTES>', type=int, help='Also start a new jsonl shard after this many uncompressed bytes.')
+    cnvd_parser.add_argument('--parser', choices=['sax', 'expat'], default='sax', help='XML parser backend. (default. sax)')
+
+    worker_parser = subparsers.add_parser('worker', help='Run queued tasks until the queue is empty.')
+    worker_parser.add_argument('--job', metavar='<JOB>', help='Only run the tasks of this job.')
+    worker_parser.add_argument('--lease', metavar='<SECONDS>', type=float, default=300, help='Lease of a claimed task, renewed while it runs. (default. 300)')
+    worker_parser.add_argument('--wait', action='store_true', help='Keep polling for new jobs instead of exiting when idle.')
+    worker_parser.add_argument('--poll', metavar='<SECONDS>', type=float, default=5, help='Polling interval when no task is free. (default. 5)')
+
+    subparsers.add_parser('status', help='Task counts of every job.')
+    retry_parser = subparsers.add_parser('retry', help='Queue the failed tasks of a job again.')
+    retry_parser.add_argument('job', metavar='<JOB>')
+
+    finalize_parser = subparsers.add_parser('finalize', help='Wait for every task of a job, then write its outputs.')
+    finalize_parser.add_argument('job', metavar='<JOB>')
+    finalize_parser.add_argument('--work', action='store_true', help='Also run tasks of the job while waiting.')
+    finalize_parser.add_argument('--poll', metavar='<SECONDS>', type=float, default=5, help='Polling interval while tasks run elsewhere. (default. 5)')
+    finalize_parser.add_argument('--report', metavar='<REPORT FILE>', help='JSON report of the job. (default. .crawl-report.json/.cnvd-report.json in the output directory)')
+    finalize_parser.add_argument('--prom', metavar='<TEXTFILE>', help='Also write the job metrics for the node_exporter textfile collector.')
+    args = arg_parser.parse_args()
+
+    queue = WorkQueue(args.q, args.attempts)
+    owner = "%s:%d" % (socket.gethostname(), os.getpid())
+    if args.command == 'crawl':
+        rates = dict(args.rate)
+        try:
+            print(submit_crawl(queue, args.o, args.j, args.per_host, args.timeout, args.retries, rates, args.full, args.index, args.snapshot, args.keep,
+                               args.sources, args.only, args.exclude, args.changes))
+        except KeyError as e:
+            crawl_parser.error("unknown source %s" % e)
+    elif args.command == 'cnvd':
+        print(submit_cnvd(queue, args.c, args.o, args.n, args.f, args.i, args.no_index, args.s, args.format, args.layout, args.compress, args.max_bytes, args.parser))
+    elif args.command == 'worker':
+        print("%d tasks completed" % work(queue, owner, args.lease, args.job, args.wait, args.poll))
+    elif args.command == 'status':
+        for job in queue.jobs():
+            counts = queue.counts(job["job"])
+            state = "finalized" if job["finalized"] else "open"
+            print("%s %s: %d pending, %d leased, %d done, %d failed" % (job["job"], state, counts[PENDING], counts[LEASED], counts[DONE], counts[FAILED]))
+    elif args.command == 'retry':
+        print("%d tasks queued again" % queue.retry(args.job))
+    else:
+        job = queue.job(args.job)
+        if job is None:
+            print("ERROR: no job %s" % args.job)
+            sys.exit(1)
+        if job["finalized"]:
+            print("ERROR: %s is already finalized" % args.job)
+            sys.exit(1)
+        if args.work:
+            work(queue, owner, job=args.job, poll=args.poll)
+        while True:
+            counts = queue.counts(args.job)
+            if counts[PENDING] == 0 and counts[LEASED] == 0:
+                break
+            time.sleep(args.poll)
+        failures = FINALIZERS[job["kind"]](queue, args.job, args.report, args.prom)
+        if failures:
+            for key, error in failures:
+                print("ERROR: %s failed: %s" % (key, error))
+            sys.exit(1)